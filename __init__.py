@@ -14,19 +14,51 @@ bl_info = {
 
 import lpy
 from lindenmaker import turtle_interpretation
+from lindenmaker import lstring_production
+from lindenmaker import lsystem_cache
+from lindenmaker import variants
+from lindenmaker import scatter
+from lindenmaker import profiling
+from lindenmaker import geometry_cache
+from lindenmaker import derivation_history
+from lindenmaker import spatial_queries
 from lindenmaker.turtle_interpretation_error import TurtleInterpretationError
+from lindenmaker import turtle
+from lindenmaker.turtle import run_steps
 # reload scripts even if already imported, in case they have changed.
 # this allows use of operator "Reload Scripts" (key F8)
 import imp
 imp.reload(lpy)
 imp.reload(turtle_interpretation)
+imp.reload(lstring_production)
+imp.reload(lsystem_cache)
+imp.reload(variants)
+imp.reload(scatter)
+imp.reload(profiling)
+imp.reload(geometry_cache)
+imp.reload(derivation_history)
+imp.reload(spatial_queries)
 
 import bpy
 import os.path
-import re
+import time
+from bpy.app.handlers import persistent
+import random
 from math import radians
 from mathutils import Vector, Matrix
 
+# seconds of work per timer event of the modal operator, before the UI is updated again
+modal_time_budget = 0.1
+# name of the text the results of profiling are written to
+profile_text_name = "Lindenmaker Profile"
+# names of the scenes the modal operator is currently running on, to not start a second run on the same scene
+running_scenes = set()
+# events passed through to the 3D View while the modal operator is running, all other events are blocked
+navigation_events = {'MOUSEMOVE', 'INBETWEEN_MOUSEMOVE', 'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE',
+                     'WHEELINMOUSE', 'WHEELOUTMOUSE', 'TRACKPADPAN', 'TRACKPADZOOM', 'MOUSEROTATE', 'NDOF_MOTION',
+                     'NUMPAD_0', 'NUMPAD_1', 'NUMPAD_2', 'NUMPAD_3', 'NUMPAD_4', 'NUMPAD_5', 'NUMPAD_6', 'NUMPAD_7',
+                     'NUMPAD_8', 'NUMPAD_9', 'NUMPAD_PERIOD', 'NUMPAD_PLUS', 'NUMPAD_MINUS', 'HOME'}
+
 class LindenmakerPanel(bpy.types.Panel):
     """Lindenmaker Panel"""
     bl_label = "Lindenmaker"
@@ -38,7 +70,9 @@ class LindenmakerPanel(bpy.types.Panel):
     def draw(self, context):
         layout = self.layout
         
-        layout.prop(context.scene, "lpyfile_path")
+        row = layout.row(align=True)
+        row.prop(context.scene, "lpyfile_path")
+        row.operator(LindenmakerReloadLsystem.bl_idname, text="", icon='FILE_REFRESH')
         
         col = layout.column() # if placed in column elements are closer to each other
         col.prop(context.scene, "turtle_step_size")
@@ -55,7 +89,12 @@ class LindenmakerPanel(bpy.types.Panel):
         boxlabelrow.label(text="Internodes and Nodes")
         if context.scene.section_internode_expanded is True:
             boxcol = box.column()
-            boxcol.prop_search(context.scene, "internode_mesh_name", bpy.data, "meshes")
+            boxcolcol = boxcol.column()
+            boxcolcol.enabled = not context.scene.bool_weld_internodes
+            boxcolcol.prop_search(context.scene, "internode_mesh_name", bpy.data, "meshes")
+            boxcolcol = boxcol.column()
+            boxcolcol.enabled = context.scene.output_mode == 'SINGLE_OBJECT'
+            boxcolcol.prop(context.scene, "bool_weld_internodes")
             boxcol.prop(context.scene, "turtle_line_width")
             boxcol.prop(context.scene, "turtle_width_growth_factor")
             boxcol.prop(context.scene, "internode_length_scale")
@@ -71,16 +110,45 @@ class LindenmakerPanel(bpy.types.Panel):
             boxcolcol.alert = context.scene.bool_recreate_default_meshes
             boxcolcol.prop(context.scene, "default_internode_cylinder_vertices")
             boxcolcol.prop(context.scene, "default_node_icosphere_subdivisions")
+            boxcol.prop(context.scene, "bool_lod")
+            boxcolcol = boxcol.column(align=True)
+            boxcolcol.enabled = context.scene.bool_lod
+            boxcolcol.prop(context.scene, "lod_full_detail_width")
+            boxcolcol.prop(context.scene, "lod_cull_width")
+            boxcolcol.prop(context.scene, "lod_depth_falloff")
+            boxcolsplit = boxcolcol.split(1/3, align=True)
+            boxcolsplit.prop(context.scene, "bool_lod_camera")
+            boxcolsplitcol = boxcolsplit.column(align=True)
+            boxcolsplitcol.enabled = context.scene.bool_lod_camera
+            boxcolsplitcol.prop(context.scene, "lod_reference_distance")
         
         col = layout.column()
         col.prop(context.scene, "bool_force_shade_flat")
-        col.prop(context.scene, "bool_no_hierarchy")
+        col.prop(context.scene, "output_mode", text="")
+        col.prop(context.scene, "interpretation_processes")
+        split = col.split(1/3)
+        split.prop(context.scene, "bool_profile")
+        splitcol = split.column()
+        splitcol.enabled = context.scene.bool_profile
+        splitcol.prop(context.scene, "bool_profile_cprofile")
         col.prop(context.scene, "bool_remove_last_interpretation_result")
+        colcol = col.column()
+        colcol.enabled = context.scene.bool_remove_last_interpretation_result and context.scene.output_mode == 'HIERARCHY'
+        colcol.prop(context.scene, "bool_incremental_interpretation")
+        col.prop(context.scene, "random_seed")
+        row = col.row(align=True)
+        row.prop(context.scene, "bool_geometry_cache")
+        rowrow = row.row(align=True)
+        rowrow.enabled = context.scene.bool_geometry_cache
+        rowrow.prop(context.scene, "geometry_cache_directory", text="")
+        row.operator(LindenmakerClearGeometryCache.bl_idname, text="", icon='X')
         
         op_lindenmaker = layout.operator(Lindenmaker.bl_idname, icon='OUTLINER_OB_MESH')
         op_lindenmaker.lstring_production_mode = 'PRODUCE_FULL'
         op_lindenmaker.bool_clear_lstring = True
         op_lindenmaker.bool_interpret_lstring = True
+        layout.operator(LindenmakerVariants.bl_idname, icon='MOD_ARRAY')
+        layout.operator(LindenmakerScatter.bl_idname, icon='PARTICLES')
         
         box = layout.box()
         boxlabelcol = box.column()
@@ -110,6 +178,25 @@ class LindenmakerPanel(bpy.types.Panel):
             op_produce_step.bool_clear_lstring = False
             op_produce_step.bool_interpret_lstring = False
             
+            # buttons to go back one step or to any step, restored from the derivation history if possible
+            history = derivation_history.histories.get(context.scene.name)
+            if history is not None and len(history) > 0:
+                boxcol.label("History: {} steps ({:.1f} MB)".format(len(history), history.size / 2**20))
+            row = boxcol.row(align=True)
+            op_previous_step = row.operator(Lindenmaker.bl_idname, text="Previous Step", icon='FRAME_PREV')
+            op_previous_step.lstring_production_mode = 'PRODUCE_TO_STEP'
+            op_previous_step.target_step = max(0, context.scene.number_production_steps_done - 1)
+            op_previous_step.bool_clear_lstring = False
+            op_previous_step.bool_interpret_lstring = False
+            row = boxcol.row(align=True)
+            row.prop(context.scene, "history_target_step")
+            op_to_step = row.operator(Lindenmaker.bl_idname, text="Go to Step")
+            op_to_step.lstring_production_mode = 'PRODUCE_TO_STEP'
+            op_to_step.target_step = context.scene.history_target_step
+            op_to_step.bool_clear_lstring = False
+            op_to_step.bool_interpret_lstring = False
+            boxcol.prop(context.scene, "history_memory_limit")
+            
             # text field to inspect and edit lstring used for production via copy/paste.
             # this L-string is not used for interpretation (no homomorphism rules applied).
             boxcol.label("L-string for Production (after " + str(context.scene.number_production_steps_done) + " steps):")
@@ -150,7 +237,10 @@ class Lindenmaker(bpy.types.Operator):
                                 "and also do the final homomorphism substitution step.", 0),
                ('PRODUCE_ONE_STEP', "Produce One Step", 
                                     "Apply one production step to current L-string", 1),
-               ('PRODUCE_NONE', "Produce None", "Skip L-string production", 2)),
+               ('PRODUCE_NONE', "Produce None", "Skip L-string production", 2),
+               ('PRODUCE_TO_STEP', "Produce to Step",
+                                   "Restore L-string after 'Target Step' production steps from the derivation history, "
+                                   "or produce it from the nearest step before it", 3)),
         default='PRODUCE_FULL')
     bool_clear_lstring = bpy.props.BoolProperty(
         name="Clear L-string",
@@ -160,6 +250,16 @@ class Lindenmaker(bpy.types.Operator):
         name="Interpret L-string",
         description="Interpret current L-string via graphical turtle interpretation.",
         default=True)    
+    derivation_length = bpy.props.IntProperty(
+        name="Derivation Length",
+        description="Number of production steps of a full production, 0 to use the derivation length of the .lpy file.",
+        default=0,
+        min=0)
+    target_step = bpy.props.IntProperty(
+        name="Target Step",
+        description="Number of production steps of the L-string to go to in mode 'Produce to Step'.",
+        default=0,
+        min=0)
     
     @classmethod
     def poll(cls, context):
@@ -167,6 +267,101 @@ class Lindenmaker(bpy.types.Operator):
         return context.mode == 'OBJECT'
 
     def execute(self, context):
+        if self.is_running(context):
+            return {'CANCELLED'}
+        # run all steps at once, blocking
+        return run_steps(self.profiled_steps(context))
+
+    def invoke(self, context, event):
+        if self.is_running(context):
+            return {'CANCELLED'}
+        # run steps in a modal loop, a few at a time on each timer event, to keep the progress in the header up to date
+        self.scene_name = context.scene.name
+        running_scenes.add(self.scene_name)
+        self.running_steps = self.profiled_steps(context)
+        self.progress = ""
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(0.01, context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            # closing the generator ends the current step cleanly, objects of an incomplete drawing are removed
+            self.running_steps.close()
+            self.finish_modal(context)
+            self.report({'WARNING'}, "Cancelled: {}".format(self.progress))
+            return {'CANCELLED'}
+        if event.type in navigation_events:
+            # the view can be navigated while running
+            return {'PASS_THROUGH'}
+        if event.type != 'TIMER':
+            # other events are blocked while running, so the scene and L-strings are not changed in between steps
+            return {'RUNNING_MODAL'}
+        deadline = time.time() + modal_time_budget
+        try:
+            while time.time() < deadline:
+                self.progress = next(self.running_steps)
+        except StopIteration as e:
+            self.finish_modal(context)
+            return e.value
+        except BaseException:
+            self.finish_modal(context)
+            raise
+        if context.area is not None:
+            context.area.header_text_set("Lindenmaker: {} (ESC to cancel)".format(self.progress))
+        return {'RUNNING_MODAL'}
+
+    def finish_modal(self, context):
+        running_scenes.discard(self.scene_name)
+        context.window_manager.event_timer_remove(self.timer)
+        if context.area is not None:
+            context.area.header_text_set()
+            context.area.tag_redraw()
+
+    def is_running(self, context):
+        """Return whether the modal operator is already running on the scene of context, reporting it if so"""
+        if context.scene.name in running_scenes:
+            self.report({'WARNING'}, "Lindenmaker is already running on scene '{}'".format(context.scene.name))
+            return True
+        return False
+
+    def profiled_steps(self, context):
+        """
+        Generator running steps, profiling its phases if enabled in the scene.
+        The profile is kept by the operator and only active while steps run, not in between the time slices of the modal operator.
+        The results are reported and written as JSON to the text "Lindenmaker Profile".
+        """
+        scene = context.scene
+        if not scene.bool_profile:
+            return (yield from self.steps(context))
+        profile = self.profile = profiling.Profile(scene.bool_profile_cprofile)
+        steps = self.steps(context)
+        try:
+            while True:
+                with profiling.activated(profile):
+                    try:
+                        progress = next(steps)
+                    except StopIteration as e:
+                        result = e.value
+                        break
+                yield progress
+        finally:
+            # cleanup of a cancelled run is profiled as well
+            with profiling.activated(profile):
+                steps.close()
+            profiling.finish(profile)
+        text = bpy.data.texts.get(profile_text_name) or bpy.data.texts.new(profile_text_name)
+        text.from_string(profiling.to_json())
+        self.report({'INFO'}, "Profile: {} (details in text '{}')".format(profile.summary(), text.name))
+        return result
+
+    def steps(self, context):
+        """
+        Generator doing the work of the operator: production and interpretation.
+        Yields a progress message after each production step and each chunk of interpreted commands or drawn modules,
+        returns the operator result.
+        """
         scene = context.scene
         
         ##### PRE-OP CLEANUP CONTEXT #####
@@ -186,14 +381,33 @@ class Lindenmaker(bpy.types.Operator):
                 item.user_clear()
                 bpy.data.materials.remove(item)
                 
+        # the step count is set before the L-strings, which are stored along with it (see lstring_production)
         if self.bool_clear_lstring:
+            scene.number_production_steps_done = 0
             scene.lstring_for_production = ""
             scene.lstring_for_interpretation = ""
-            scene.number_production_steps_done = 0
+            
+        ##### GEOMETRY CACHE #####
+        
+        # a full production and interpretation from the axiom is looked up in the geometry cache,
+        # on a hit the stored L-strings and interpretation arrays are used without production and interpretation.
+        # without a seed the result of a stochastic L-system differs every time, thus it is neither looked up nor stored.
+        cache_key = None
+        cached = None
+        if (scene.bool_geometry_cache and self.lstring_production_mode == 'PRODUCE_FULL' and scene.random_seed >= 0
+            and self.bool_clear_lstring and self.bool_interpret_lstring and os.path.isfile(scene.lpyfile_path)):
+            cache_key = production_key(scene, self.derivation_length)
+            with profiling.phase("geometry cache load"):
+                cached = geometry_cache.load(geometry_cache_directory(scene), cache_key)
+            if cached is not None:
+                strings = cached[1]
+                scene.number_production_steps_done = int(strings['number_production_steps_done'])
+                scene.lstring_for_production = strings['lstring_for_production']
+                scene.lstring_for_interpretation = strings['lstring_for_interpretation']
             
         ##### LSTRING PRODUCTION #####
         
-        if self.lstring_production_mode != 'PRODUCE_NONE':
+        if self.lstring_production_mode != 'PRODUCE_NONE' and cached is None:
             
             # load L-Py framework lsystem specification file (.lpy)
             if not os.path.isfile(scene.lpyfile_path):
@@ -201,77 +415,150 @@ class Lindenmaker(bpy.types.Operator):
                 "Select a valid file path in the Lindenmaker options panel in the tool shelf.\n"
                 "File not found: {}".format(scene.lpyfile_path))
                 return {'CANCELLED'}
-            lsys = lpy.Lsystem(scene.lpyfile_path)
+            yield "Loading L-system"
+            if self.lstring_production_mode == 'PRODUCE_FULL' and scene.random_seed >= 0:
+                # productions and module level code of .lpy files may use the random module
+                random.seed(scene.random_seed)
+            # compiled L-systems are cached, the file is only compiled again if its content changed
+            with profiling.phase("load"):
+                lsys = lsystem_cache.get_lsystem(scene.lpyfile_path)
             #print("LSYSTEM DEFINITION: {}".format(lsys.__str__()))
             
             # to allow for turtle state queries between L-Py production steps
             # we always have to use derivationLength=1 for Lindenmaker to run the queries
             # before handing back over to L-Py.
+            # the cached L-system is reused, thus restore derivation length and axiom when done.
             derivationLengthBackup = lsys.derivationLength
+            axiomBackup = lsys.axiom
+            # L-strings after each step are kept in the derivation history of the scene,
+            # which starts over when the .lpy file or the turtle parameters change.
+            history = derivation_history.get_history(scene.name, production_key(scene),
+                                                     scene.history_memory_limit * 2**20)
             if self.lstring_production_mode == 'PRODUCE_ONE_STEP':
                 steps = 1
+            elif self.lstring_production_mode == 'PRODUCE_TO_STEP':
+                # continue from the current L-string or the nearest step in the history, whichever is closer
+                nearest = history.nearest(self.target_step)
+                current = scene.number_production_steps_done
+                if current > self.target_step or (nearest is not None and nearest > current):
+                    scene.number_production_steps_done = nearest or 0
+                    if nearest is not None:
+                        with profiling.phase("history restore"):
+                            production, scene.lstring_for_interpretation = history.get(nearest)
+                            lstring_production.set_production(scene, production)
+                    else:
+                        scene.lstring_for_production = ""
+                        scene.lstring_for_interpretation = ""
+                steps = self.target_step - scene.number_production_steps_done
             else: # PRODUCE_FULL
-                steps = derivationLengthBackup
+                steps = self.derivation_length or derivationLengthBackup
+            step_count = steps
             lsys.derivationLength = 1
-            while (steps > 0):
-                # use current L-string as axiom unless empty
-                if (scene.lstring_for_production != ""):
-                    lsys.axiom = lpy.AxialTree(scene.lstring_for_production)
-                # derive lstring via production rules (stored as L-Py AxialTree datastructure)
-                derivedAxialTree = lsys.derive()
-                scene.lstring_for_production = str(derivedAxialTree)
-                # substitute occurrences of e.g. ~(Object,4) with ~("Object",4)
-                # or ?(P,0,0,0) with ?("P",0,0,0).
-                # L-Py strips the quotes, but without them production fails.
-                scene.lstring_for_production = re.sub(r'(?<=[~\?]\()(\w*)(?=[,\)])', r'"\1"',
-                                                      scene.lstring_for_production)
-                scene.number_production_steps_done += 1
-
-                # apply homomorphism substituation step and store result separately.
-                # this is an L-Py feature intended as a postproduction step 
-                # to replace abstract module names by actual interpretation commands.
-                # in L-Py these rules are preceded by keywords "homomorphism:" or "interpretation:",
-                # however this should not be confused with the graphical turtle interpretation!
-                scene.lstring_for_interpretation = str(lsys.interpret(
-                                                       lpy.AxialTree(scene.lstring_for_production)))
-                # do a dryrun interpretation without drawing any objects to perform the
-                # turtle state queries (via command '?') that will replace the placeholder values
-                # in the command arguments with the actual position/heading/up/left vector values.
-                # e.g. query ?('P',0,0,0) will become ?('P',Px,Py,Pz) for position vector P.
-                # ?(type,x,y,z) can then be used in a production rule.
-                try:
-                    turtle_interpretation.interpret(scene.lstring_for_interpretation,
-                                                    scene.turtle_step_size, 
-                                                    scene.turtle_line_width,
-                                                    scene.turtle_width_growth_factor,
-                                                    scene.turtle_rotation_angle,
-                                                    dryrun_nodraw=True)
-                except TurtleInterpretationError as e:
-                    self.report({'ERROR_INVALID_INPUT'}, str(e))
-                    return {'CANCELLED'}
-                steps -= 1
-                
-            lsys.derivationLength = derivationLengthBackup
+            try:
+                while (steps > 0):
+                    if profiling.active is not None:
+                        profiling.active.begin_step()
+                    # state before this step, restored if cancelled before the step is complete
+                    previous_step = (scene.number_production_steps_done, lstring_production.get_production(scene),
+                                     scene.lstring_for_interpretation)
+                    # use current L-string as axiom unless empty.
+                    # the derived AxialTree of the last step is still in memory, no need to parse text.
+                    axialtree = lstring_production.get_production_axialtree(scene)
+                    if axialtree is not None:
+                        lsys.axiom = axialtree
+                    # derive lstring via production rules (stored as L-Py AxialTree datastructure)
+                    with profiling.phase("derive"):
+                        derivedAxialTree = lsys.derive()
+                    # keep the AxialTree, it is only converted to text when needed
+                    scene.number_production_steps_done += 1
+                    lstring_production.set_production_axialtree(scene, derivedAxialTree)
+
+                    # apply homomorphism substituation step and store result separately.
+                    # this is an L-Py feature intended as a postproduction step 
+                    # to replace abstract module names by actual interpretation commands.
+                    # in L-Py these rules are preceded by keywords "homomorphism:" or "interpretation:",
+                    # however this should not be confused with the graphical turtle interpretation!
+                    with profiling.phase("homomorphism"):
+                        scene.lstring_for_interpretation = str(lsys.interpret(derivedAxialTree))
+                    if profiling.active is not None:
+                        profiling.active.record_lstring(scene.lstring_for_interpretation)
+                    # do a dryrun interpretation without drawing any objects to perform the
+                    # turtle state queries (via command '?') that will replace the placeholder values
+                    # in the command arguments with the actual position/heading/up/left vector values.
+                    # e.g. query ?('P',0,0,0) will become ?('P',Px,Py,Pz) for position vector P.
+                    # ?(type,x,y,z) can then be used in a production rule.
+                    try:
+                        yield from drawing_progress(turtle_interpretation.interpret_steps(
+                                                        scene.lstring_for_interpretation,
+                                                        scene.turtle_step_size, 
+                                                        scene.turtle_line_width,
+                                                        scene.turtle_width_growth_factor,
+                                                        scene.turtle_rotation_angle,
+                                                        dryrun_nodraw=True))
+                    except (TurtleInterpretationError, GeneratorExit) as e:
+                        # failed or cancelled during the dry run, the query results of the derived L-string are missing,
+                        # thus the next step would derive from placeholder values. go back to the previous step instead.
+                        scene.number_production_steps_done, production, scene.lstring_for_interpretation = previous_step
+                        lstring_production.set_production(scene, production)
+                        if isinstance(e, GeneratorExit):
+                            raise
+                        self.report({'ERROR_INVALID_INPUT'}, str(e))
+                        return {'CANCELLED'}
+                    # the live AxialTree is stored as is, it is only converted to text if the history runs out of memory
+                    if history.max_bytes > 0:
+                        with profiling.phase("history store"):
+                            history.store(scene.number_production_steps_done,
+                                          lstring_production.get_production(scene), scene.lstring_for_interpretation)
+                    steps -= 1
+                    yield "Production step {} of {}".format(step_count - steps, step_count)
+            finally:
+                lsys.derivationLength = derivationLengthBackup
+                lsys.axiom = axiomBackup
+                if profiling.active is not None:
+                    profiling.active.end_step()
             #print("LSTRING FOR PRODUCTION: {}".format(context.scene.lstring_for_production))
             #print("LSTRING FOR INTERPRETATION: {}".format(context.scene.lstring_for_interpretation))
         
         ##### GRAPHICAL TURTLE INTERPRETATION #####
         
         if self.bool_interpret_lstring:
+            update_root = None
             if (scene.bool_remove_last_interpretation_result 
                 and scene.last_interpretation_result_objname in bpy.data.objects.keys()):
-                delete_hierarchy(bpy.data.objects[scene.last_interpretation_result_objname])
-            # interpret derived lstring via turtle graphics
+                last_root = bpy.data.objects[scene.last_interpretation_result_objname]
+                # a hierarchy can be updated in place instead, keeping the objects of unchanged modules
+                if scene.bool_incremental_interpretation and turtle.can_update_hierarchy(scene, last_root):
+                    update_root = last_root
+                else:
+                    delete_hierarchy(last_root)
+            if cached is not None:
+                # draw the cached interpretation arrays
+                yield "Loading cached result"
+                interpretation = turtle_interpretation.draw_steps(cached[0], update_root)
+            else:
+                # interpret derived lstring via turtle graphics
+                yield "Interpreting L-string"
+                interpretation = turtle_interpretation.interpret_steps(scene.lstring_for_interpretation,
+                                                                       scene.turtle_step_size, 
+                                                                       scene.turtle_line_width,
+                                                                       scene.turtle_width_growth_factor,
+                                                                       scene.turtle_rotation_angle,
+                                                                       default_materialindex=0,
+                                                                       update_root=update_root)
             try:
-                turtle_interpretation.interpret(scene.lstring_for_interpretation,
-                                                scene.turtle_step_size, 
-                                                scene.turtle_line_width,
-                                                scene.turtle_width_growth_factor,
-                                                scene.turtle_rotation_angle,
-                                                default_materialindex=0)
+                arrays = yield from drawing_progress(interpretation)
             except TurtleInterpretationError as e:
                 self.report({'ERROR_INVALID_INPUT'}, str(e))
                 return {'CANCELLED'}
+            if cache_key is not None and cached is None:
+                try:
+                    with profiling.phase("geometry cache store"):
+                        geometry_cache.store(geometry_cache_directory(scene), cache_key, arrays,
+                                             {'lstring_for_production': scene.lstring_for_production,
+                                              'lstring_for_interpretation': scene.lstring_for_interpretation,
+                                              'number_production_steps_done': str(scene.number_production_steps_done)})
+                except OSError as e:
+                    self.report({'WARNING'}, "Result not stored in geometry cache: {}".format(e))
             
         ##### POST-OP CLEANUP #####
             
@@ -279,15 +566,270 @@ class Lindenmaker(bpy.types.Operator):
         self.lstring_production_mode = 'PRODUCE_FULL'
         self.bool_clear_lstring = True
         self.bool_interpret_lstring = True
+        self.derivation_length = 0
+        self.target_step = 0
         
         return {'FINISHED'}
 
+def drawing_progress(interpretation):
+    """Generator yielding progress messages of turtle_interpretation.interpret_steps or draw_steps, returns its result"""
+    try:
+        while True:
+            try:
+                message, done, count = next(interpretation)
+            except StopIteration as e:
+                return e.value
+            yield "{} {} of {}".format(message, done, count)
+    finally:
+        interpretation.close()
+
+def production_key(scene, derivation_length=0):
+    """
+    Return key of a production and interpretation of the .lpy file of the scene with the current turtle parameters,
+    identifying results in the geometry cache and the derivation history
+    """
+    parameters = {'derivation_length': derivation_length,
+                  'turtle_step_size': scene.turtle_step_size,
+                  'turtle_rotation_angle': scene.turtle_rotation_angle,
+                  'turtle_line_width': scene.turtle_line_width,
+                  'turtle_width_growth_factor': scene.turtle_width_growth_factor,
+                  'internode_length_scale': scene.internode_length_scale}
+    seed = scene.random_seed if scene.random_seed >= 0 else None
+    return geometry_cache.cache_key(lsystem_cache.file_content_hash(scene.lpyfile_path), parameters, seed)
+
+def geometry_cache_directory(scene):
+    """Return absolute geometry cache directory of the scene, None for the default one"""
+    return bpy.path.abspath(scene.geometry_cache_directory) if scene.geometry_cache_directory else None
+
+class LindenmakerReloadLsystem(bpy.types.Operator):
+    bl_idname = "mesh.lindenmaker_reload_lsystem"
+    bl_label = "Reload L-Py File"
+    bl_description = "Compile the .lpy file again and rerun its module level code on next production"
+
+    def execute(self, context):
+        lsystem_cache.invalidate(context.scene.lpyfile_path)
+        # module level code might produce something else when run again
+        derivation_history.histories.pop(context.scene.name, None)
+        return {'FINISHED'}
+
+class LindenmakerClearGeometryCache(bpy.types.Operator):
+    bl_idname = "mesh.lindenmaker_clear_geometry_cache"
+    bl_label = "Clear Geometry Cache"
+    bl_description = "Remove all cached results from the geometry cache directory"
+
+    def execute(self, context):
+        removed = geometry_cache.clear(geometry_cache_directory(context.scene))
+        self.report({'INFO'}, "Removed {} cached results".format(removed))
+        return {'FINISHED'}
+
+class LindenmakerVariants(bpy.types.Operator):
+    bl_idname = "mesh.lindenmaker_variants"
+    bl_label = "Generate Variants"
+    bl_description = "Produce and interpret the L-system once per random seed in parallel processes, as meshes named by seed"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    seed_start = bpy.props.IntProperty(
+        name="First Seed",
+        description="Seed of the random module for the first variant.",
+        default=0)
+    seed_count = bpy.props.IntProperty(
+        name="Variants",
+        description="Number of variants, seeds are consecutive.",
+        default=8,
+        min=1)
+    derivation_length = bpy.props.IntProperty(
+        name="Derivation Length",
+        description="Number of production steps, 0 to use the derivation length of the .lpy file.",
+        default=0,
+        min=0)
+    processes = bpy.props.IntProperty(
+        name="Processes",
+        description="Number of processes producing variants at the same time, 0 for one per CPU core.",
+        default=0,
+        min=0)
+    bool_add_objects = bpy.props.BoolProperty(
+        name="Add Objects",
+        description="Add an object per variant mesh to the scene, placed in a row along the x axis.\nOtherwise the meshes are only kept via fake user.",
+        default=True)
+    spacing = bpy.props.FloatProperty(
+        name="Spacing",
+        description="Distance between the added objects.",
+        default=10.0,
+        min=0.0)
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'OBJECT'
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        scene = context.scene
+        if not os.path.isfile(scene.lpyfile_path):
+            self.report({'ERROR_INVALID_INPUT'}, "Input file does not exist! "
+            "Select a valid file path in the Lindenmaker options panel in the tool shelf.\n"
+            "File not found: {}".format(scene.lpyfile_path))
+            return {'CANCELLED'}
+        seeds = list(range(self.seed_start, self.seed_start + self.seed_count))
+        try:
+            meshes = variants.generate_variants(scene.lpyfile_path, seeds,
+                                                self.derivation_length, self.processes)
+        except TurtleInterpretationError as e:
+            self.report({'ERROR_INVALID_INPUT'}, str(e))
+            return {'CANCELLED'}
+        if self.bool_add_objects:
+            for i, mesh in enumerate(meshes):
+                obj = bpy.data.objects.new(mesh.name, mesh)
+                obj.location = scene.cursor_location
+                obj.location.x += i * self.spacing
+                scene.objects.link(obj)
+        self.report({'INFO'}, "Generated {} variants: {}".format(len(meshes), ", ".join(mesh.name for mesh in meshes)))
+        return {'FINISHED'}
+
+class LindenmakerScatter(bpy.types.Operator):
+    bl_idname = "object.lindenmaker_scatter"
+    bl_label = "Scatter Results"
+    bl_description = ("Place instances of the selected interpretation results (or the last one) randomly on the surface "
+                      "of the active mesh object. Instances share the objects and meshes of the results")
+    bl_options = {'REGISTER', 'UNDO'}
+
+    count = bpy.props.IntProperty(
+        name="Instances",
+        description="Number of instances to place.",
+        default=100,
+        min=1)
+    seed = bpy.props.IntProperty(
+        name="Seed",
+        description="Seed of the random placement.",
+        default=0)
+    vertex_group = bpy.props.StringProperty(
+        name="Vertex Group",
+        description="Vertex group of the target object scaling the density of instances, all of its surface if empty.")
+    bool_align_to_normal = bpy.props.BoolProperty(
+        name="Align to Normal",
+        description="Orient instances along the surface normal instead of the z axis.",
+        default=False)
+    scale_min = bpy.props.FloatProperty(
+        name="Scale Min",
+        description="Minimum random scale of instances.",
+        default=0.8,
+        min=0.0)
+    scale_max = bpy.props.FloatProperty(
+        name="Scale Max",
+        description="Maximum random scale of instances.",
+        default=1.2,
+        min=0.0)
+    lod_levels = bpy.props.IntProperty(
+        name="LOD Levels",
+        description="Number of detail levels per result, each level halves the polygons via decimation.\n"
+                    "Instances use the level of their distance to the scene camera divided by 'LOD Distance'.",
+        default=1,
+        min=1,
+        max=8)
+    lod_distance = bpy.props.FloatProperty(
+        name="LOD Distance",
+        description="Camera distance per detail level.",
+        default=50.0,
+        min=0.001)
+
+    @classmethod
+    def poll(cls, context):
+        return context.mode == 'OBJECT' and context.active_object is not None and context.active_object.type == 'MESH'
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def draw(self, context):
+        col = self.layout.column()
+        col.prop(self, "count")
+        col.prop(self, "seed")
+        col.prop_search(self, "vertex_group", context.active_object, "vertex_groups")
+        col.prop(self, "bool_align_to_normal")
+        col.prop(self, "scale_min")
+        col.prop(self, "scale_max")
+        col.prop(self, "lod_levels")
+        col.prop(self, "lod_distance")
+
+    def execute(self, context):
+        scene = context.scene
+        target = context.active_object
+        # scatter whole hierarchies, even if only some of their objects are selected
+        roots = []
+        for obj in context.selected_objects:
+            if obj == target:
+                continue
+            while obj.parent is not None:
+                obj = obj.parent
+            if obj not in roots:
+                roots.append(obj)
+        if not roots and scene.last_interpretation_result_objname in bpy.data.objects.keys():
+            roots.append(bpy.data.objects[scene.last_interpretation_result_objname])
+        if not roots:
+            self.report({'ERROR_INVALID_INPUT'}, "No interpretation result to scatter. "
+                        "Select results and make the target surface object active.")
+            return {'CANCELLED'}
+        if self.vertex_group and self.vertex_group not in target.vertex_groups.keys():
+            self.report({'ERROR_INVALID_INPUT'}, "No vertex group named '{}' in '{}'.".format(self.vertex_group, target.name))
+            return {'CANCELLED'}
+        scatter.scatter(roots, target, self.count, self.vertex_group, self.seed, self.bool_align_to_normal,
+                        self.scale_min, self.scale_max, self.lod_levels, self.lod_distance)
+        return {'FINISHED'}
+
+@persistent
+def migrate_scene_properties(dummy):
+    """Convert scene properties of files saved with older versions of the add-on"""
+    for scene in bpy.data.scenes:
+        # checkbox "Single Object (No Hierarchy, Faster)" was replaced by the output mode
+        no_hierarchy = scene.pop("bool_no_hierarchy", None)
+        if no_hierarchy is not None and "output_mode" not in scene:
+            scene.output_mode = 'SINGLE_OBJECT' if no_hierarchy else 'HIERARCHY'
+
+@persistent
+def clear_running_scenes(dummy):
+    """Forget the scenes the modal operator was running on, its run ends when another file is loaded"""
+    running_scenes.clear()
+
+@persistent
+def sync_production_lstrings(dummy):
+    """
+    After undo / redo, make the L-strings for production match the restored number of production steps of each scene.
+    The live AxialTree of another step is discarded, the L-strings of the restored step are taken from the derivation history
+    if it has them, otherwise the step count is set to the one of the stored L-string.
+    """
+    for scene in bpy.data.scenes:
+        step = lstring_production.production_step(scene)
+        if step == scene.number_production_steps_done:
+            continue
+        history = derivation_history.histories.get(scene.name)
+        state = None
+        if history is not None and os.path.isfile(scene.lpyfile_path) and history.key == production_key(scene):
+            state = history.get(scene.number_production_steps_done)
+        if state is not None:
+            lstring_production.set_production(scene, state[0])
+            scene.lstring_for_interpretation = state[1]
+        else:
+            scene.number_production_steps_done = step
+
 def menu_func(self, context):
     self.layout.operator(Lindenmaker.bl_idname, icon='PLUGIN')
 
 def register():
     bpy.utils.register_module(__name__)
     bpy.types.INFO_MT_mesh_add.append(menu_func)
+    bpy.app.handlers.save_pre.append(lstring_production.store_production_lstrings)
+    bpy.app.handlers.load_post.append(lstring_production.clear_production_lstrings)
+    bpy.app.handlers.load_post.append(derivation_history.clear_histories)
+    bpy.app.handlers.load_post.append(turtle_interpretation.clear_dryrun_checkpoints)
+    bpy.app.handlers.load_post.append(spatial_queries.clear_indices)
+    bpy.app.handlers.scene_update_post.append(spatial_queries.invalidate_updated)
+    bpy.app.handlers.load_post.append(migrate_scene_properties)
+    bpy.app.handlers.load_post.append(clear_running_scenes)
+    bpy.app.handlers.load_post.append(lsystem_cache.clear_lsystems)
+    bpy.app.handlers.undo_post.append(lsystem_cache.clear_lsystems)
+    bpy.app.handlers.redo_post.append(lsystem_cache.clear_lsystems)
+    bpy.app.handlers.undo_post.append(sync_production_lstrings)
+    bpy.app.handlers.redo_post.append(sync_production_lstrings)
     
     bpy.types.Scene.lpyfile_path = bpy.props.StringProperty(
         name="L-Py File", 
@@ -295,7 +837,9 @@ def register():
         maxlen=1024, subtype='FILE_PATH')
     bpy.types.Scene.lstring_for_production = bpy.props.StringProperty(
         name="L-string for Production Only", 
-        description="The L-string resulting from the L-system productions. No homomorphism rules applied, used for further production only.")
+        description="The L-string resulting from the L-system productions. No homomorphism rules applied, used for further production only.",
+        get=lstring_production.get_lstring_for_production,
+        set=lstring_production.set_lstring_for_production)
     bpy.types.Scene.lstring_for_interpretation = bpy.props.StringProperty(
         name="L-string for Interpretation", 
         description="The L-string resulting from the L-system productions, with homomorphism rules applied (if any specified).\nUsed for graphical turtle interpretation.")
@@ -324,6 +868,10 @@ def register():
         name="Internode", 
         description="Name of mesh to be used for drawing internodes via the 'F' (move and draw) command.\nDefault is 'LindenmakerDefaultInternodeMesh', a cylinder mesh generated at first use.",
         default="LindenmakerDefaultInternodeMesh")
+    bpy.types.Scene.bool_weld_internodes = bpy.props.BoolProperty(
+        name="Welded Tubes",
+        description="Draw unbranched chains of internodes as continuous tubes sharing one vertex ring per joint, capped only at the chain ends.\nOnly used for single object output. Ring vertex count is taken from 'Internode Cylinder Vertices'.",
+        default=False)
     bpy.types.Scene.turtle_line_width = bpy.props.FloatProperty(
         name="Default Line Width", 
         description="Default width of internode and node objects drawn via 'F' (move and draw) command.",
@@ -365,19 +913,98 @@ def register():
         default=1, 
         min=1, 
         max=5)
+    bpy.types.Scene.bool_lod = bpy.props.BoolProperty(
+        name="Adaptive Level of Detail",
+        description="Draw thin internodes and nodes with lower detail default meshes: half the cylinder vertices / one icosphere subdivision less per halving of the width below 'Full Detail Width'.\nInternodes thinner than 'Cull Width' are drawn as a single quad, such nodes are skipped. Welded tubes are not affected.",
+        default=False)
+    bpy.types.Scene.lod_full_detail_width = bpy.props.FloatProperty(
+        name="Full Detail Width",
+        description="Modules at least this wide are drawn in full detail.",
+        default=0.2,
+        min=0.0)
+    bpy.types.Scene.lod_cull_width = bpy.props.FloatProperty(
+        name="Cull Width",
+        description="Internodes thinner than this are drawn as a single quad, such nodes are not drawn.",
+        default=0.01,
+        min=0.0)
+    bpy.types.Scene.lod_depth_falloff = bpy.props.FloatProperty(
+        name="Depth Falloff",
+        description="Factor by which the width used to choose the detail level is multiplied per enclosing branch.\n1 to only use the module width.",
+        default=1.0,
+        min=0.0,
+        max=1.0)
+    bpy.types.Scene.bool_lod_camera = bpy.props.BoolProperty(
+        name="Camera",
+        description="Scale the width used to choose the detail level by 'Reference Distance' divided by the distance to the scene camera.",
+        default=False)
+    bpy.types.Scene.lod_reference_distance = bpy.props.FloatProperty(
+        name="Reference Distance",
+        description="Camera distance at which the width used to choose the detail level is the module width.",
+        default=10.0,
+        min=0.001)
         
     bpy.types.Scene.bool_force_shade_flat = bpy.props.BoolProperty(
         name="Force Flat Shading",
         description="Force flat shading for all parts of the generated structure.",
         default=False)
-    bpy.types.Scene.bool_no_hierarchy = bpy.props.BoolProperty(
-        name="Single Object (No Hierarchy, Faster)",
-        description="Enable to generate a single object with a single joined mesh. Significantly faster.\nDisable to generate a branching hierarchy of objects (internode/node meshes are shared).",
-        default=True)
+    bpy.types.Scene.output_mode = bpy.props.EnumProperty(
+        name="Output Mode",
+        description="Kind of objects generated by the graphical turtle interpretation.",
+        items=(('SINGLE_OBJECT', "Single Object (No Hierarchy, Faster)", 
+                                 "Generate a single object with a single joined mesh. Significantly faster.", 0),
+               ('HIERARCHY', "Hierarchy", 
+                             "Generate a branching hierarchy of objects (internode/node meshes are shared).", 1),
+               ('INSTANCED', "Instanced (Shared Meshes, Fastest)", 
+                             "Generate carrier meshes that instance shared internode/node/custom object meshes "
+                             "via dupli faces, one triangle per module.\n"
+                             "Memory and build time scale with the module count, not the vertex count.", 2)),
+        default='SINGLE_OBJECT')
+    bpy.types.Scene.interpretation_processes = bpy.props.IntProperty(
+        name="Interpretation Processes",
+        description="Number of processes interpreting the branches of large L-strings in parallel.\n1 to interpret in Blender only. Not available on Windows.",
+        default=1,
+        min=1,
+        max=256)
+    bpy.types.Scene.bool_profile = bpy.props.BoolProperty(
+        name="Profile",
+        description="Time the phases of production and interpretation and of each production step, count commands, modules, objects and vertices.\nResults are reported and written as JSON to the text 'Lindenmaker Profile'.",
+        default=False)
+    bpy.types.Scene.bool_profile_cprofile = bpy.props.BoolProperty(
+        name="cProfile",
+        description="Also capture all Python function calls via cProfile, the slowest are added to the profile results.\nSlows down the run considerably.",
+        default=False)
     bpy.types.Scene.bool_remove_last_interpretation_result = bpy.props.BoolProperty(
         name="Remove Last Interpretation Result",
         description="When running the graphical turtle interpretation, the result from the previous interpretation is removed.\nUseful for stepwise production and interpretation, to avoid cluttering the scene.",
         default=False)
+    bpy.types.Scene.bool_incremental_interpretation = bpy.props.BoolProperty(
+        name="Update Incrementally",
+        description="Instead of removing the last interpretation result, update its hierarchy: objects of modules that are unchanged are kept, only changed modules are updated in place, added ones created and removed ones deleted.\nOnly used for hierarchy output.",
+        default=True)
+    bpy.types.Scene.random_seed = bpy.props.IntProperty(
+        name="Seed",
+        description="Seed of the random module, set before a full production, for reproducible results of stochastic L-systems.\n-1 to leave the random module unseeded.",
+        default=-1,
+        min=-1)
+    bpy.types.Scene.bool_geometry_cache = bpy.props.BoolProperty(
+        name="Geometry Cache",
+        description="Store results of full productions on disk, keyed by the .lpy file content, turtle parameters, derivation length and seed.\nThe same production is then loaded from the cache instead of produced and interpreted again.\nOnly used if a seed is set.\nDo not use for L-systems that read the scene, changes of the scene do not invalidate cached results.",
+        default=False)
+    bpy.types.Scene.geometry_cache_directory = bpy.props.StringProperty(
+        name="Geometry Cache Directory",
+        description="Directory of the geometry cache files, the system temporary directory if empty.",
+        maxlen=1024, subtype='DIR_PATH')
+        
+    bpy.types.Scene.history_memory_limit = bpy.props.IntProperty(
+        name="History Memory Limit (MB)",
+        description="Maximum memory of the L-strings kept per production step for 'Previous Step' and 'Go to Step'.\nLeast recently used steps are compressed first, then dropped, 0 to keep no history.",
+        default=64,
+        min=0)
+    bpy.types.Scene.history_target_step = bpy.props.IntProperty(
+        name="Step",
+        description="Number of production steps of the L-string to go to via 'Go to Step'.",
+        default=0,
+        min=0)
         
     bpy.types.Scene.section_internode_expanded = bpy.props.BoolProperty(default = False)
     bpy.types.Scene.section_lstring_expanded = bpy.props.BoolProperty(default = False)
@@ -385,6 +1012,19 @@ def register():
 def unregister():
     bpy.utils.unregister_module(__name__)
     bpy.types.INFO_MT_mesh_add.remove(menu_func)
+    bpy.app.handlers.save_pre.remove(lstring_production.store_production_lstrings)
+    bpy.app.handlers.load_post.remove(lstring_production.clear_production_lstrings)
+    bpy.app.handlers.load_post.remove(derivation_history.clear_histories)
+    bpy.app.handlers.load_post.remove(turtle_interpretation.clear_dryrun_checkpoints)
+    bpy.app.handlers.load_post.remove(spatial_queries.clear_indices)
+    bpy.app.handlers.scene_update_post.remove(spatial_queries.invalidate_updated)
+    bpy.app.handlers.load_post.remove(migrate_scene_properties)
+    bpy.app.handlers.load_post.remove(clear_running_scenes)
+    bpy.app.handlers.load_post.remove(lsystem_cache.clear_lsystems)
+    bpy.app.handlers.undo_post.remove(lsystem_cache.clear_lsystems)
+    bpy.app.handlers.redo_post.remove(lsystem_cache.clear_lsystems)
+    bpy.app.handlers.undo_post.remove(sync_production_lstrings)
+    bpy.app.handlers.redo_post.remove(sync_production_lstrings)
     
     del bpy.types.Scene.lpyfile_path
     del bpy.types.Scene.lstring_for_production
@@ -396,6 +1036,7 @@ def unregister():
     del bpy.types.Scene.turtle_rotation_angle
     
     del bpy.types.Scene.internode_mesh_name
+    del bpy.types.Scene.bool_weld_internodes
     del bpy.types.Scene.turtle_line_width
     del bpy.types.Scene.turtle_width_growth_factor
     del bpy.types.Scene.internode_length_scale
@@ -404,10 +1045,26 @@ def unregister():
     del bpy.types.Scene.bool_recreate_default_meshes
     del bpy.types.Scene.default_internode_cylinder_vertices
     del bpy.types.Scene.default_node_icosphere_subdivisions
+    del bpy.types.Scene.bool_lod
+    del bpy.types.Scene.lod_full_detail_width
+    del bpy.types.Scene.lod_cull_width
+    del bpy.types.Scene.lod_depth_falloff
+    del bpy.types.Scene.bool_lod_camera
+    del bpy.types.Scene.lod_reference_distance
     
     del bpy.types.Scene.bool_force_shade_flat
-    del bpy.types.Scene.bool_no_hierarchy
+    del bpy.types.Scene.output_mode
+    del bpy.types.Scene.interpretation_processes
+    del bpy.types.Scene.bool_profile
+    del bpy.types.Scene.bool_profile_cprofile
     del bpy.types.Scene.bool_remove_last_interpretation_result
+    del bpy.types.Scene.bool_incremental_interpretation
+    del bpy.types.Scene.random_seed
+    del bpy.types.Scene.bool_geometry_cache
+    del bpy.types.Scene.geometry_cache_directory
+    
+    del bpy.types.Scene.history_memory_limit
+    del bpy.types.Scene.history_target_step
     
     del bpy.types.Scene.section_internode_expanded
     del bpy.types.Scene.section_lstring_expanded
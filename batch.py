@@ -0,0 +1,216 @@
+"""
+Headless batch generation of L-system results, without the UI.
+
+Run with any Python 3 interpreter (or Blender's), e.g.
+    python batch.py models/ --output-dir out --processes 8 --seeds 0-9 --output-mode HIERARCHY
+Every job (one .lpy file with one set of parameters) is run by a separate Blender process in background mode,
+up to --processes of them at the same time. Each job writes a .blend (or .obj) file and a .json file
+with its parameters and timings to the output directory, the timings of all jobs are collected in summary.json.
+
+Per-job parameters can be given in a JSON file via --jobs, as list of objects with an "lpyfile"
+and any of the parameter names below (command line values are used as defaults), e.g.
+    [{"lpyfile": "models/model5 tree randomized/thesis_model5_tree_randomized.lpy", "seed": 3, "angle": 30}]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# job parameters: name -> scene property set from it (None for parameters not stored in the scene)
+JOB_PARAMETERS = {
+    'step_size': 'turtle_step_size',
+    'angle': 'turtle_rotation_angle',
+    'width': 'turtle_line_width',
+    'output_mode': 'output_mode',
+    'profile': 'bool_profile',
+    'derivation_length': None,
+    'seed': 'random_seed',
+    'blend_file': None,
+    'format': None,
+}
+# formats of the written files
+OUTPUT_FORMATS = ('blend', 'obj')
+
+##### DRIVER (ANY PYTHON) #####
+
+def find_lpy_files(paths):
+    """Return .lpy files given directly or found in the given directories (recursively), sorted per directory"""
+    lpyfiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                lpyfiles.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.endswith(".lpy"))
+        else:
+            lpyfiles.append(path)
+    return lpyfiles
+
+def parse_seeds(seeds):
+    """Return list of seeds for e.g. "3", "0-9" or "1,5,7", [None] if not given"""
+    if not seeds:
+        return [None]
+    result = []
+    for part in seeds.split(','):
+        first, _, last = part.partition('-')
+        result.extend(range(int(first), int(last or first)+1))
+    return result
+
+def make_jobs(args):
+    """Return list of job dicts from the parsed command line arguments"""
+    defaults = {name: getattr(args, name) for name in JOB_PARAMETERS if getattr(args, name, None) is not None}
+    if args.scene:
+        defaults['scene'] = json.loads(args.scene)
+    jobs = []
+    for lpyfile in find_lpy_files(args.lpyfiles):
+        for seed in parse_seeds(args.seeds):
+            job = dict(defaults, lpyfile=lpyfile)
+            if seed is not None:
+                job['seed'] = seed
+            jobs.append(job)
+    if args.jobs:
+        with open(args.jobs) as f:
+            jobs.extend(dict(defaults, **job) for job in json.load(f))
+    for index, job in enumerate(jobs):
+        job['lpyfile'] = os.path.abspath(job['lpyfile'])
+        if 'name' not in job:
+            name = os.path.splitext(os.path.basename(job['lpyfile']))[0]
+            if job.get('seed') is not None:
+                name += "_seed{}".format(job['seed'])
+            job['name'] = "{:03d}_{}".format(index, name)
+        job['output'] = os.path.join(os.path.abspath(args.output_dir), job['name'])
+    return jobs
+
+def run_job_process(blender, job):
+    """Run job in a new background Blender process, return the job result (see run_job)"""
+    command = [blender, "--background"]
+    if job.get('blend_file'):
+        command.append(job['blend_file'])
+    else:
+        command.append("--factory-startup")
+    command += ["--python", os.path.abspath(__file__), "--", "--job", json.dumps(job)]
+    # a result left by an earlier run must not be taken for the result of this one
+    if os.path.isfile(job['output']+".json"):
+        os.remove(job['output']+".json")
+    start = time.time()
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    result = {'name': job['name'], 'lpyfile': job['lpyfile'], 'success': False}
+    if os.path.isfile(job['output']+".json"):
+        with open(job['output']+".json") as f:
+            result = json.load(f)
+    if process.returncode != 0:
+        # e.g. Blender crashed after writing the result, or the add-on could not be enabled
+        result['success'] = False
+    result['process_seconds'] = time.time() - start
+    if not result['success']:
+        # keep Blender output for inspection
+        result['log'] = job['output']+".log"
+        with open(result['log'], 'w') as f:
+            f.write(process.stdout)
+    return result
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Generate L-system results headless via Blender in background mode.",
+                                     epilog="Scene property names for --scene are those of the Lindenmaker panel, e.g. bool_draw_nodes.")
+    parser.add_argument("lpyfiles", nargs='*', help=".lpy files or directories containing them")
+    parser.add_argument("--jobs", help="JSON file with a list of jobs, see module documentation")
+    parser.add_argument("--output-dir", default="lindenmaker_batch", help="directory of the written files")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="format of the written files (default: blend)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="number of Blender processes at the same time")
+    parser.add_argument("--blender", default="blender", help="path of the Blender executable")
+    parser.add_argument("--blend-file", dest="blend_file", help=".blend file to generate in, e.g. with environment objects")
+    parser.add_argument("--step-size", dest="step_size", type=float, help="default turtle step size")
+    parser.add_argument("--angle", type=float, help="default rotation angle")
+    parser.add_argument("--width", type=float, help="default line width")
+    parser.add_argument("--output-mode", dest="output_mode", choices=('SINGLE_OBJECT', 'HIERARCHY', 'INSTANCED'))
+    parser.add_argument("--derivation-length", dest="derivation_length", type=int,
+                        help="number of production steps instead of the derivation length of the .lpy file")
+    parser.add_argument("--seeds", help="random seeds, one job per seed and file, e.g. 0-9 or 1,5,7")
+    parser.add_argument("--profile", action='store_true', default=None,
+                        help="profile the phases of each job, the results are added to its .json file")
+    parser.add_argument("--scene", help="JSON object of further scene properties to set, e.g. '{\"bool_draw_nodes\": true}'")
+    args = parser.parse_args(argv)
+
+    jobs = make_jobs(args)
+    if not jobs:
+        parser.error("no .lpy files or jobs given")
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.processes)) as executor:
+        results = list(executor.map(lambda job: run_job_process(args.blender, job), jobs))
+    summary = {'jobs': results, 'processes': args.processes, 'total_seconds': time.time() - start}
+    with open(os.path.join(args.output_dir, "summary.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    for result in results:
+        if result['success']:
+            print("{:<50} {:8.2f}s  {:>8} objects {:>10} vertices".format(
+                  result['name'], result['seconds']['total'], result['objects'], result['vertices']))
+        else:
+            print("{:<50} FAILED: {}".format(result['name'], result.get('error', "see "+result['log'])))
+    print("{} jobs in {:.2f}s".format(len(results), summary['total_seconds']))
+    return 0 if all(result['success'] for result in results) else 1
+
+##### JOB (INSIDE BLENDER) #####
+
+def run_job(job):
+    """Generate the result of a single job in the current Blender scene and write it, return result dict with timings"""
+    import bpy
+    import addon_utils
+
+    result = {'name': job['name'], 'lpyfile': job['lpyfile'], 'parameters': job, 'success': False, 'seconds': {}}
+    seconds = result['seconds']
+    start = time.time()
+    try:
+        addon = addon_utils.enable(os.path.basename(os.path.dirname(os.path.abspath(__file__))), default_set=False)
+        scene = bpy.context.scene
+        if not job.get('blend_file'):
+            # generate in an empty scene
+            for obj in list(scene.objects):
+                scene.objects.unlink(obj)
+                bpy.data.objects.remove(obj)
+        scene.lpyfile_path = job['lpyfile']
+        for name, prop in JOB_PARAMETERS.items():
+            if prop is not None and job.get(name) is not None:
+                setattr(scene, prop, job[name])
+        for prop, value in job.get('scene', {}).items():
+            setattr(scene, prop, value)
+        seconds['setup'] = time.time() - start
+
+        generate_start = time.time()
+        status = bpy.ops.mesh.lindenmaker(derivation_length=job.get('derivation_length') or 0)
+        seconds['generate'] = time.time() - generate_start
+        if 'FINISHED' not in status:
+            raise RuntimeError("Lindenmaker operator cancelled, see log")
+
+        save_start = time.time()
+        if job.get('format', 'blend') == 'obj':
+            bpy.ops.export_scene.obj(filepath=job['output']+".obj")
+        else:
+            bpy.ops.wm.save_as_mainfile(filepath=job['output']+".blend")
+        seconds['save'] = time.time() - save_start
+
+        mesh_objects = [obj for obj in scene.objects if obj.type == 'MESH']
+        result['objects'] = len(scene.objects)
+        result['vertices'] = sum(len(obj.data.vertices) for obj in mesh_objects)
+        result['lstring_length'] = len(scene.lstring_for_interpretation)
+        if scene.bool_profile:
+            result['profile'] = addon.profiling.last_profile
+        result['success'] = True
+    except Exception as e:
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    seconds['total'] = time.time() - start
+    with open(job['output']+".json", 'w') as f:
+        json.dump(result, f, indent=2)
+    return result
+
+if __name__ == "__main__":
+    # arguments after "--" are ours when run by Blender
+    argv = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else sys.argv[1:]
+    if argv[:1] == ["--job"]:
+        job_result = run_job(json.loads(argv[1]))
+        sys.exit(0 if job_result['success'] else 1)
+    sys.exit(main(argv))
@@ -0,0 +1,134 @@
+import zlib
+from collections import OrderedDict
+
+try:
+    from bpy.app.handlers import persistent
+    from lindenmaker.lstring_production import axialtree_to_lstring
+except ImportError:
+    # imported outside of Blender, see turtle_kernel. L-strings for production are converted to text via str then
+    persistent = lambda handler: handler
+    axialtree_to_lstring = str
+
+# default maximum size of the L-strings kept per history
+default_max_bytes = 64 * 1024 * 1024
+# estimated memory per module of an AxialTree kept in a history, since its text size is unknown before converting it
+axialtree_module_bytes = 64
+
+class DerivationHistory:
+    """
+    L-strings for production and interpretation after each production step, by step number.
+    The L-string for production is kept as a copy of the AxialTree it was derived as, so storing a step needs no text conversion.
+    When exceeding max_bytes, least recently used steps are converted to text and zlib compressed first, then dropped.
+    A history belongs to one production, identified by key (e.g. .lpy file content and turtle parameters).
+    """
+
+    def __init__(self, key, max_bytes=default_max_bytes):
+        self.key = key
+        self.max_bytes = max_bytes
+        # step: [L-string for production (AxialTree, text or compressed text),
+        #        L-string for interpretation (text or compressed text), size in bytes]
+        self.states = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, step):
+        return step in self.states
+
+    def store(self, step, lstring_for_production, lstring_for_interpretation):
+        """
+        Store the L-strings after production step number step, replacing the ones stored for it before.
+        The L-string for production can be given as AxialTree, a copy of it is kept.
+        """
+        self.remove(step)
+        if not isinstance(lstring_for_production, str):
+            lstring_for_production = copy_tree(lstring_for_production)
+        state = [lstring_for_production, lstring_for_interpretation, 0]
+        state[2] = state_size(state)
+        self.states[step] = state
+        self.size += state[2]
+        self.shrink(self.max_bytes)
+
+    def get(self, step):
+        """
+        Return (L-string for production, L-string for interpretation) after production step number step, None if not stored.
+        The L-string for production is returned as AxialTree if it was not compressed yet, otherwise as text.
+        """
+        state = self.states.get(step)
+        if state is None:
+            return None
+        self.states.move_to_end(step)
+        production, interpretation = state[0], state[1]
+        if isinstance(production, bytes):
+            production = zlib.decompress(production).decode('utf-8')
+        elif not isinstance(production, str):
+            production = copy_tree(production)
+        if isinstance(interpretation, bytes):
+            interpretation = zlib.decompress(interpretation).decode('utf-8')
+        return production, interpretation
+
+    def nearest(self, step):
+        """Return highest stored step number up to step, None if there is none"""
+        return max((s for s in self.states if s <= step), default=None)
+
+    def remove(self, step):
+        """Drop the L-strings stored for step number step, if any"""
+        state = self.states.pop(step, None)
+        if state is not None:
+            self.size -= state[2]
+
+    def compress(self, step):
+        """Convert the L-strings stored for step number step to zlib compressed text"""
+        state = self.states[step]
+        production, interpretation = state[0], state[1]
+        if not isinstance(production, (str, bytes)):
+            production = axialtree_to_lstring(production)
+        if isinstance(production, str):
+            state[0] = zlib.compress(production.encode('utf-8'), 1)
+        if isinstance(interpretation, str):
+            state[1] = zlib.compress(interpretation.encode('utf-8'), 1)
+        self.size -= state[2]
+        state[2] = state_size(state)
+        self.size += state[2]
+
+    def shrink(self, max_bytes):
+        """Compress, then drop least recently used steps until the size is at most max_bytes"""
+        self.max_bytes = max_bytes
+        for step, state in list(self.states.items()):
+            if self.size <= max_bytes:
+                return
+            if not isinstance(state[1], bytes):
+                self.compress(step)
+        while self.size > max_bytes and self.states:
+            self.remove(next(iter(self.states)))
+
+def copy_tree(axialtree):
+    """Return copy of an AxialTree (via the copy constructor of its type, lpy.AxialTree)"""
+    return type(axialtree)(axialtree)
+
+def state_size(state):
+    """Return size in bytes of a stored step (estimated for AxialTrees)"""
+    production, interpretation = state[0], state[1]
+    if isinstance(production, (str, bytes)):
+        size = len(production)
+    else:
+        size = len(production) * axialtree_module_bytes
+    return size + len(interpretation)
+
+# derivation history of each scene by scene name
+histories = {}
+
+def get_history(scene_name, key, max_bytes=default_max_bytes):
+    """Return derivation history of the scene for the production identified by key, a new one if key changed"""
+    history = histories.get(scene_name)
+    if history is None or history.key != key:
+        history = histories[scene_name] = DerivationHistory(key, max_bytes)
+    else:
+        history.shrink(max_bytes)
+    return history
+
+@persistent
+def clear_histories(dummy=None):
+    """Forget all derivation histories, e.g. when another file is loaded"""
+    histories.clear()
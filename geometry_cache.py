@@ -0,0 +1,125 @@
+import os
+import json
+import struct
+import hashlib
+import tempfile
+import numpy as np
+
+try:
+    from lindenmaker import turtle_kernel
+except ImportError:
+    # imported outside of Blender, see turtle_kernel
+    import turtle_kernel
+
+# cache file layout: fixed size prefix (magic, version, header length, data offset), JSON header,
+# then the raw data of each section at an aligned offset, such that the sections can be memory-mapped in place.
+MAGIC = b"LMKCACHE"
+VERSION = 1
+PREFIX = struct.Struct("<8sIIQ")
+ALIGNMENT = 64
+FILE_EXTENSION = ".lmc"
+
+# directory used if none is given
+default_directory = os.path.join(tempfile.gettempdir(), "lindenmaker_cache")
+
+def cache_key(lpy_content_hash, parameters, seed=None):
+    """Return key of the result of an .lpy file (by content hash) produced and interpreted with the given parameters and seed"""
+    text = json.dumps({'lpy': lpy_content_hash, 'parameters': parameters, 'seed': seed}, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def cache_path(directory, key):
+    """Return path of the cache file of key"""
+    return os.path.join(directory or default_directory, key + FILE_EXTENSION)
+
+def aligned(offset):
+    """Return offset rounded up to the next multiple of ALIGNMENT"""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def store(directory, key, arrays, strings):
+    """
+    Write turtle_kernel.InterpretationArrays and strings (dict of name: text, e.g. the derived L-strings)
+    to the cache file of key. Transforms are stored in single precision, as Blender stores geometry anyway.
+    The file is written under a temporary name first, so readers never see an incomplete file.
+    """
+    sections = [
+        ('matrices', arrays.matrices[:,:3,:].astype(np.float32)),
+        ('scales', arrays.scales.astype(np.float32)),
+        ('widths', arrays.widths.astype(np.float32)),
+        ('lengths', arrays.lengths.astype(np.float32)),
+        ('materialindices', arrays.materialindices),
+        ('kinds', arrays.kinds),
+        ('custom_object_ids', arrays.custom_object_ids),
+        ('parents', arrays.parents),
+    ]
+    sections += [("string:" + name, np.frombuffer(text.encode('utf-8'), dtype=np.uint8)) for name, text in strings.items()]
+    header = {'count': len(arrays), 'custom_object_names': arrays.custom_object_names, 'sections': []}
+    offset = 0
+    for name, data in sections:
+        data = np.ascontiguousarray(data)
+        header['sections'].append({'name': name, 'dtype': data.dtype.str, 'shape': data.shape, 'offset': offset})
+        offset = aligned(offset + data.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_offset = aligned(PREFIX.size + len(header_bytes))
+
+    os.makedirs(directory or default_directory, exist_ok=True)
+    path = cache_path(directory, key)
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, VERSION, len(header_bytes), data_offset))
+        f.write(header_bytes)
+        for (name, data), section in zip(sections, header['sections']):
+            f.seek(data_offset + section['offset'])
+            f.write(np.ascontiguousarray(data).tobytes())
+    os.replace(temp_path, path)
+    return path
+
+def load(directory, key):
+    """
+    Return (InterpretationArrays, strings) stored in the cache file of key, None if not cached (or unreadable).
+    The arrays are read-only views of the memory-mapped file, only the matrices are expanded to 4 x 4 doubles.
+    The file stays open as long as any of these views exists, which prevents replacing or removing it on Windows,
+    thus copy arrays that are kept beyond drawing them (see turtle.HierarchyState).
+    """
+    path = cache_path(directory, key)
+    try:
+        with open(path, 'rb') as f:
+            magic, version, header_length, data_offset = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != MAGIC or version != VERSION:
+                return None
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+    except (OSError, ValueError, struct.error):
+        return None
+
+    sections = {}
+    for section in header['sections']:
+        dtype = np.dtype(section['dtype'])
+        start = data_offset + section['offset']
+        size = int(np.prod(section['shape'], dtype=np.int64)) * dtype.itemsize
+        sections[section['name']] = data[start:start+size].view(dtype).reshape(section['shape'])
+
+    n = header['count']
+    arrays = turtle_kernel.InterpretationArrays(0)
+    arrays.count = n
+    arrays.matrices = np.zeros((n, 4, 4))
+    arrays.matrices[:,:3,:] = sections['matrices']
+    arrays.matrices[:,3,3] = 1.0
+    for name in ('scales', 'widths', 'lengths', 'materialindices', 'kinds', 'custom_object_ids', 'parents'):
+        setattr(arrays, name, sections[name])
+    arrays.custom_object_names = header['custom_object_names']
+    arrays.query_vectors = np.empty((0, 3))
+    strings = {name[len("string:"):]: bytes(section).decode('utf-8')
+               for name, section in sections.items() if name.startswith("string:")}
+    return arrays, strings
+
+def clear(directory=None):
+    """Remove all cache files from directory, return number of removed files"""
+    directory = directory or default_directory
+    if not os.path.isdir(directory):
+        return 0
+    removed = 0
+    for filename in os.listdir(directory):
+        if filename.endswith(FILE_EXTENSION):
+            os.remove(os.path.join(directory, filename))
+            removed += 1
+    return removed
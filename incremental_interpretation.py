@@ -0,0 +1,55 @@
+import difflib
+import numpy as np
+
+def children_groups(parents):
+    """
+    Return (order, starts) such that order[starts[p+1]:starts[p+2]] are the indices of the modules with parent p
+    in the order of the L-string (p = -1 for modules of the trunk).
+    """
+    order = np.argsort(parents, kind='mergesort') # stable
+    starts = np.searchsorted(parents[order], np.arange(-1, len(parents)+1))
+    return order, starts
+
+def matching_blocks(old, new):
+    """
+    Return (old start, new start, size) blocks of equal elements of the int arrays old and new, in order.
+    Common prefix and suffix are matched directly, only the remainder in between is aligned via difflib.
+    """
+    n = min(len(old), len(new))
+    unequal = np.flatnonzero(old[:n] != new[:n])
+    prefix = unequal[0] if len(unequal) else n
+    if prefix == len(old) == len(new):
+        return [(0, 0, prefix)]
+    unequal = np.flatnonzero(old[len(old)-n+prefix:][::-1] != new[len(new)-n+prefix:][::-1])
+    suffix = unequal[0] if len(unequal) else n - prefix
+    blocks = [(0, 0, prefix)] if prefix else []
+    matcher = difflib.SequenceMatcher(None, old[prefix:len(old)-suffix].tolist(), new[prefix:len(new)-suffix].tolist(),
+                                      autojunk=False)
+    blocks += [(prefix + a, prefix + b, size) for a, b, size in matcher.get_matching_blocks() if size]
+    if suffix:
+        blocks.append((len(old) - suffix, len(new) - suffix, suffix))
+    return blocks
+
+def match_modules(old_parents, old_signatures, new_parents, new_signatures, new_is_branch):
+    """
+    Return for each module of a new interpretation the index of the same module of the old interpretation, -1 for added modules.
+    Modules are compared via their signatures (int codes, equal if a module can be reused for the other one),
+    as trees: the modules on each branch are aligned with those of the matched branch of the old interpretation,
+    starting from the trunk, such that growth at the apices keeps the modules before it matched.
+    new_is_branch tells which new modules are parents of a branch (node modules).
+    """
+    matches = np.full(len(new_parents), -1, dtype=np.int64)
+    old_order, old_starts = children_groups(old_parents)
+    new_order, new_starts = children_groups(new_parents)
+    pending = [(-1, -1)]
+    while pending:
+        old_parent, new_parent = pending.pop()
+        old_children = old_order[old_starts[old_parent+1]:old_starts[old_parent+2]]
+        new_children = new_order[new_starts[new_parent+1]:new_starts[new_parent+2]]
+        if len(old_children) == 0 or len(new_children) == 0:
+            continue
+        for a, b, size in matching_blocks(old_signatures[old_children], new_signatures[new_children]):
+            matches[new_children[b:b+size]] = old_children[a:a+size]
+            parents = np.flatnonzero(new_is_branch[new_children[b:b+size]])
+            pending.extend(zip(old_children[a+parents].tolist(), new_children[b+parents].tolist()))
+    return matches
@@ -0,0 +1,112 @@
+import bpy
+import numpy as np
+from math import log, sqrt
+
+# relative tolerance of the shape (scale ratio) of instances sharing the same prototype mesh
+shape_tolerance = 0.02
+
+class InstanceBuilder:
+    """
+    Draws modules as instances of shared prototype meshes via Blender dupli faces.
+    Each prototype is a child of a carrier mesh object with one triangle per module,
+    encoding its position (triangle center), orientation (normal and first edge) and uniform scale (area).
+    Dupli faces only support uniform scale, thus modules are grouped by the shape of their scale
+    (i.e. scale divided by its largest component) and each group gets a prototype stretched accordingly.
+    """
+
+    def __init__(self, shade_smooth=True):
+        self.shade_smooth = shade_smooth
+        # triangle vertices of the carrier of each prototype: (prototype mesh, list of (n,3,3) arrays)
+        self.carriers = {}
+
+    def add_instances(self, mesh, name, matrices, scales, material=None):
+        """Add instances of mesh for the given N x 4 x 4 turtle matrices and N x 3 scales"""
+        if len(matrices) == 0:
+            return
+        uniform = np.abs(scales).max(axis=1)
+        uniform[uniform == 0] = 1e-6
+        shapes = scales / uniform[:,np.newaxis]
+        # quantize shapes logarithmically, such that instances in the same group deviate by shape_tolerance at most
+        shape_keys = np.round(np.log(np.maximum(np.abs(shapes), 1e-6)) / log(1+shape_tolerance)).astype(np.int64)
+        shape_keys *= np.where(shapes < 0, -1, 1)
+        # unique rows via a void view of each row (np.unique with axis needs NumPy 1.13)
+        shape_keys = np.ascontiguousarray(shape_keys)
+        rows = shape_keys.view(np.dtype((np.void, shape_keys.dtype.itemsize * shape_keys.shape[1]))).reshape(-1)
+        unique_rows, first, group_of_instance = np.unique(rows, return_index=True, return_inverse=True)
+        groups = shape_keys[first]
+        group_of_instance = group_of_instance.reshape(-1)
+        for g, shape_key in enumerate(groups):
+            members = np.flatnonzero(group_of_instance == g)
+            key = (mesh.name, tuple(shape_key), material.name if material is not None else None)
+            if key not in self.carriers:
+                # prototype shape is taken from the first instance of the group
+                self.carriers[key] = (self.create_prototype(mesh, name, shapes[members[0]], material), [])
+            self.carriers[key][1].append(self.instance_triangles(matrices[members], uniform[members]))
+
+    def instance_triangles(self, matrices, uniform):
+        """
+        Return N x 3 x 3 triangle vertices for instances with the given turtle matrices and uniform scales.
+        The triangle center is the turtle position, its first edge points along heading (local x),
+        its normal along up (local z) and its area is such that dupli face scale yields the uniform scale.
+        """
+        heading = matrices[:,:3,0]
+        left = matrices[:,:3,1]
+        position = matrices[:,:3,3]
+        # right triangle with legs along heading and left, sqrt(area) = edge/sqrt(2)
+        edge = (uniform * sqrt(2))[:,np.newaxis]
+        v1 = position - edge*(heading+left)/3
+        return np.stack((v1, v1 + edge*heading, v1 + edge*left), axis=1)
+
+    def create_prototype(self, mesh, name, shape, material):
+        """Create prototype object with a copy of mesh stretched by shape"""
+        prototype_mesh = mesh.copy()
+        prototype_mesh.name = name+".Instance"
+        co = np.empty(len(prototype_mesh.vertices)*3, dtype=np.float32)
+        prototype_mesh.vertices.foreach_get("co", co)
+        prototype_mesh.vertices.foreach_set("co", (co.reshape(-1, 3) * shape).astype(np.float32).ravel())
+        prototype_mesh.polygons.foreach_set("use_smooth", [self.shade_smooth]*len(prototype_mesh.polygons))
+        prototype_mesh.update()
+        prototype = bpy.data.objects.new(name, prototype_mesh)
+        if material is not None:
+            # to avoid cluttering the prototype mesh, link material to the object
+            prototype.active_material = material # also adds slot if none
+            prototype.material_slots[0].link = 'OBJECT'
+            prototype.material_slots[0].material = material
+        return prototype
+
+    def discard(self):
+        """Remove the prototypes created so far, without building anything"""
+        for prototype, triangle_chunks in self.carriers.values():
+            prototype_mesh = prototype.data
+            bpy.data.objects.remove(prototype)
+            bpy.data.meshes.remove(prototype_mesh)
+        self.carriers.clear()
+
+    def build(self, name="Root"):
+        """Create carrier objects for all prototypes, parented to a new empty which is returned"""
+        scene = bpy.context.scene
+        root = bpy.data.objects.new(name, None)
+        root.empty_draw_type = 'ARROWS'
+        root.empty_draw_size = 0
+        scene.objects.link(root)
+        for prototype, triangle_chunks in self.carriers.values():
+            triangles = np.concatenate(triangle_chunks)
+            n = len(triangles)
+            carrier_mesh = bpy.data.meshes.new(prototype.name+".Instances")
+            carrier_mesh.vertices.add(n*3)
+            carrier_mesh.vertices.foreach_set("co", triangles.astype(np.float32).ravel())
+            carrier_mesh.loops.add(n*3)
+            carrier_mesh.loops.foreach_set("vertex_index", np.arange(n*3, dtype=np.int32))
+            carrier_mesh.polygons.add(n)
+            carrier_mesh.polygons.foreach_set("loop_start", np.arange(0, n*3, 3, dtype=np.int32))
+            carrier_mesh.polygons.foreach_set("loop_total", np.full(n, 3, dtype=np.int32))
+            carrier_mesh.update(calc_edges=True)
+            carrier = bpy.data.objects.new(prototype.name+".Instances", carrier_mesh)
+            carrier.dupli_type = 'FACES'
+            carrier.use_dupli_faces_scale = True
+            carrier.dupli_faces_scale = 1.0
+            carrier.parent = root
+            prototype.parent = carrier
+            scene.objects.link(carrier)
+            scene.objects.link(prototype)
+        return root
@@ -0,0 +1,39 @@
+import numpy as np
+
+# detail level of modules that are not drawn in full detail but as cheap substitute, or skipped (nodes)
+LEVEL_CULLED = -1
+
+def module_depths(arrays):
+    """Return branch depth of every module of the given InterpretationArrays, i.e. number of enclosing branches"""
+    depths = np.zeros(len(arrays), dtype=np.int32)
+    parents = arrays.parents
+    # parents always precede their children, thus one pass in order is enough
+    for i in np.flatnonzero(parents >= 0):
+        depths[i] = depths[parents[i]] + 1
+    return depths
+
+def effective_widths(arrays, depth_falloff=1.0, camera_position=None, reference_distance=10.0):
+    """
+    Return width of every module as used to choose its detail level:
+    the module width, reduced by depth_falloff per enclosing branch,
+    and optionally scaled by reference_distance over the distance to the camera (apparent size).
+    """
+    widths = np.array(arrays.widths)
+    if depth_falloff != 1.0:
+        widths *= depth_falloff ** module_depths(arrays)
+    if camera_position is not None:
+        distances = np.linalg.norm(arrays.matrices[:,:3,3] - np.asarray(camera_position), axis=1)
+        widths *= reference_distance / np.maximum(distances, 1e-6)
+    return widths
+
+def detail_levels(widths, full_detail_width, cull_width):
+    """
+    Return detail level for the given effective widths:
+    0 (full detail) at or above full_detail_width, increasing by one for every halving of the width below it,
+    LEVEL_CULLED below cull_width.
+    """
+    widths = np.maximum(widths, 1e-12)
+    levels = np.ceil(np.log2(full_detail_width / widths)).astype(np.int32)
+    levels = np.maximum(levels, 0)
+    levels[widths < cull_width] = LEVEL_CULLED
+    return levels
@@ -0,0 +1,284 @@
+import re
+import numpy as np
+from array import array
+
+try:
+    from lindenmaker.turtle_interpretation_error import TurtleInterpretationError
+except ImportError:
+    # imported outside of Blender, see turtle_kernel
+    from turtle_interpretation_error import TurtleInterpretationError
+
+# opcodes of the supported turtle commands
+OP_MOVE_DRAW = 0    # F
+OP_MOVE = 1         # f
+OP_PUSH = 2         # [
+OP_POP = 3          # ]
+OP_TURN_LEFT = 4    # +
+OP_TURN_RIGHT = 5   # -
+OP_PITCH_DOWN = 6   # &
+OP_PITCH_UP = 7     # ^
+OP_ROLL_RIGHT = 8   # \
+OP_ROLL_LEFT = 9    # /
+OP_TURN_AROUND = 10 # |
+OP_WIDTH_INC = 11   # _
+OP_WIDTH_DEC = 12   # !
+OP_MATERIAL_INC = 13 # ;
+OP_MATERIAL_DEC = 14 # ,
+OP_CUSTOM = 15      # ~
+OP_LOOK_AT = 16     # @
+OP_QUERY = 17       # ?
+OPCODE_COUNT = 18
+
+# command symbol: (opcode, allowed argument counts, whether first argument is a string, usage for error message)
+COMMANDS = {
+    'F': (OP_MOVE_DRAW, (0, 1, 2), False,
+          "Invalid number of arguments for command 'F' (move turtle and draw).\n"
+          "Usage: 'F' or 'F(step_size)' or 'F(step_size, width)'"),
+    'f': (OP_MOVE, (0, 1), False,
+          "Invalid number of arguments for command 'f' (move turtle).\n"
+          "Usage: 'f' or 'f(step_size)'"),
+    '[': (OP_PUSH, (0,), False,
+          "Invalid number of arguments for command '['"
+          " (push current turtle state to stack).\n"
+          "This command does not take any arguments.\n"
+          "Usage: '['"),
+    ']': (OP_POP, (0,), False,
+          "Invalid number of arguments for command ']'"
+          " (restore turtle state from stack).\n"
+          "This command does not take any arguments.\n"
+          "Usage: ']'"),
+    '+': (OP_TURN_LEFT, (0, 1), False,
+          "Invalid number of arguments for command '+' (turn left).\n"
+          "Usage: '+' or '+(angle_degree)'"),
+    '-': (OP_TURN_RIGHT, (0, 1), False,
+          "Invalid number of arguments for command '-' (turn right).\n"
+          "Usage: '-' or '-(angle_degree)'"),
+    '&': (OP_PITCH_DOWN, (0, 1), False,
+          "Invalid number of arguments for command '&' (pitch down).\n"
+          "Usage: '&' or '&(angle_degree)'"),
+    '^': (OP_PITCH_UP, (0, 1), False,
+          "Invalid number of arguments for command '^' (pitch up).\n"
+          "Usage: '^' or '^(angle_degree)'"),
+    '\\': (OP_ROLL_RIGHT, (0, 1), False,
+          "Invalid number of arguments for command '\\' (roll right).\n"
+          "Usage: '\\' or '\\(angle_degree)'"),
+    '/': (OP_ROLL_LEFT, (0, 1), False,
+          "Invalid number of arguments for command '/' (roll left).\n"
+          "Usage: '/' or '/(angle_degree)'"),
+    '|': (OP_TURN_AROUND, (0,), False,
+          "Invalid number of arguments for command '|' (turn halfway around).\n"
+          "This command does not take any arguments.\n"
+          "Usage: '|'"),
+    '_': (OP_WIDTH_INC, (0, 1), False,
+          "Invalid number of arguments for command '_' (increase or set linewidth).\n"
+          "Usage: '_' or '_(width)'"),
+    '!': (OP_WIDTH_DEC, (0, 1), False,
+          "Invalid number of arguments for command '!' (decrease or set linewidth).\n"
+          "Usage: '!' or '!(width)'"),
+    ';': (OP_MATERIAL_INC, (0, 1), False,
+          "Invalid number of arguments for command ';'"
+          " (increase or set material index).\n"
+          "Usage: ';' or ';(materialindex)'"),
+    ',': (OP_MATERIAL_DEC, (0, 1), False,
+          "Invalid number of arguments for command ','"
+          " (decrease or set material index).\n"
+          "Usage: ',' or ',(materialindex)'"),
+    '~': (OP_CUSTOM, (1, 2, 4), True,
+          "Invalid number of arguments for command '~' (draw custom object).\n"
+          "Usage: '~(\"Object\")' or '~(\"Object\", scale)'"
+          " or '~(\"Object\", scale_x, scale_y, scale_z)'"),
+    '@': (OP_LOOK_AT, (3,), False,
+          "Invalid number of arguments for command '@' (turtle look at).\n"
+          "Usage: '@(x, y, z)'"
+          "The heading vector will point toward x, y, z"
+          " and the heading, left, and up vectors will have the same"
+          " relative orientation (handedness) as before."),
+    '?': (OP_QUERY, (4,), True,
+          "Invalid number of arguments for command '?'"
+          " (query turtle state).\n"
+          "Usage: '?(\"H|L|U|P\",0,0,0)' for heading, left, up or position vector.\n"
+          "The values 0,0,0 will be replaced by the x,y,z respective vector values."),
+}
+
+def opcode_table(opcodes):
+    """Return boolean array indexed by opcode, True for the given opcodes, e.g. to test an array of opcodes via table[opcodes]"""
+    table = np.zeros(256, dtype=bool)
+    table[list(opcodes)] = True
+    return table
+
+# command symbol with optional parameters, e.g. "F(230,24)" or "["
+command_pattern = re.compile(r"([^()])(?:\(([^()]*)\))?")
+
+class CompiledLString:
+    """
+    Compact opcode stream of an L-string, one entry per supported command.
+    opcodes: opcode byte of the command
+    arg_offsets: offset of the first argument of the command in args
+    arg_counts: number of arguments of the command
+    args: float arguments of all commands. String arguments (first argument of '~' and '?')
+          are stored once in strings and their index into strings is stored in args instead,
+          thus identical commands have identical args.
+    Unsupported commands are dropped, cut branches ('%') are already skipped.
+    """
+
+    def __init__(self):
+        self.opcodes = array('B')
+        self.arg_offsets = array('L')
+        self.arg_counts = array('B')
+        self.args = array('d')
+        self.strings = []
+        self._branch_ends = None
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def count(self, *opcodes):
+        """Return number of commands with any of the given opcodes"""
+        return sum(self.opcodes.count(op) for op in opcodes)
+
+    def last_index(self, opcode):
+        """Return index of the last command with the given opcode, -1 if there is none"""
+        return self.opcodes.tobytes().rfind(bytes((opcode,)))
+
+    def branch_ends(self):
+        """Return index of the matching ']' for every '[' command, -1 for unmatched '[' and all other commands"""
+        if self._branch_ends is None:
+            ends = array('l', [-1]) * len(self.opcodes)
+            open_branches = []
+            for i, opcode in enumerate(self.opcodes):
+                if opcode == OP_PUSH:
+                    open_branches.append(i)
+                elif opcode == OP_POP and open_branches:
+                    ends[open_branches.pop()] = i
+            self._branch_ends = ends
+        return self._branch_ends
+
+    def slice(self, start, stop):
+        """Return CompiledLString of the commands start to stop (exclusive), sharing strings with this one"""
+        result = CompiledLString()
+        arg_start = self.arg_offsets[start] if start < len(self) else len(self.args)
+        arg_stop = self.arg_offsets[stop] if stop < len(self) else len(self.args)
+        result.opcodes = self.opcodes[start:stop]
+        result.arg_counts = self.arg_counts[start:stop]
+        result.arg_offsets = array('L', (offset - arg_start for offset in self.arg_offsets[start:stop]))
+        result.args = self.args[arg_start:arg_stop]
+        result.strings = self.strings
+        return result
+
+    def segment_key(self, start, end):
+        """Return hashable content of the commands start to end (inclusive), equal for identical command sequences"""
+        arg_start = self.arg_offsets[start]
+        arg_end = self.arg_offsets[end] + self.arg_counts[end]
+        return (self.opcodes[start:end+1].tobytes(),
+                self.arg_counts[start:end+1].tobytes(),
+                self.args[arg_start:arg_end].tobytes())
+
+    def common_prefix_length(self, other, ignore_args_of=()):
+        """
+        Return number of leading commands that are equal in this and the other CompiledLString.
+        String arguments are compared by content, arguments after the first of the opcodes in ignore_args_of are ignored.
+        """
+        n = min(len(self), len(other))
+        if n == 0:
+            return 0
+        opcodes = np.frombuffer(self.opcodes, dtype=np.uint8)[:n]
+        arg_counts = np.frombuffer(self.arg_counts, dtype=np.uint8)[:n]
+        differs = ((opcodes != np.frombuffer(other.opcodes, dtype=np.uint8)[:n])
+                   | (arg_counts != np.frombuffer(other.arg_counts, dtype=np.uint8)[:n]))
+        prefix = int(np.argmax(differs)) if differs.any() else n
+        if prefix == 0:
+            return 0
+        # commands up to prefix have the same argument counts, thus their arguments are at the same offsets
+        opcodes = opcodes[:prefix]
+        arg_counts = arg_counts[:prefix]
+        arg_offsets = np.frombuffer(self.arg_offsets, dtype=np.dtype(self.arg_offsets.typecode))[:prefix].astype(np.int64)
+        arg_end = int(arg_offsets[-1] + arg_counts[-1])
+        args = np.frombuffer(self.args, dtype=np.float64)[:arg_end]
+        other_args = np.frombuffer(other.args, dtype=np.float64)[:arg_end]
+        args_differ = args != other_args
+        with_strings = np.flatnonzero(opcode_table((OP_CUSTOM, OP_QUERY))[opcodes] & (arg_counts > 0))
+        if len(with_strings):
+            positions = arg_offsets[with_strings]
+            strings = np.array(self.strings + [None], dtype=object)[args[positions].astype(np.int64)]
+            other_strings = np.array(other.strings + [None], dtype=object)[other_args[positions].astype(np.int64)]
+            args_differ[positions] = strings != other_strings
+        ignored = np.flatnonzero(opcode_table(ignore_args_of)[opcodes])
+        for k in range(1, int(arg_counts[ignored].max()) if len(ignored) else 0):
+            has_arg = ignored[arg_counts[ignored] > k]
+            args_differ[arg_offsets[has_arg] + k] = False
+        if args_differ.any():
+            first_arg = int(np.argmax(args_differ))
+            prefix = int(np.searchsorted(arg_offsets, first_arg, side='right')) - 1
+        return prefix
+
+def compile_lstring(lstring):
+    """Compile L-string into a CompiledLString in a single pass over its commands"""
+    # remove all whitespace
+    lstring = "".join(lstring.split())
+
+    result = CompiledLString()
+    opcodes_append = result.opcodes.append
+    arg_offsets_append = result.arg_offsets.append
+    arg_counts_append = result.arg_counts.append
+    args = result.args
+    strings = result.strings
+    string_indices = {}
+    commands_get = COMMANDS.get
+
+    # bracket depth within a cut branch while skipping it, -1 if not in a cut branch.
+    # a cut command ('%') removes the remainder of the current branch,
+    # i.e. until the next unmatched closing bracket (which is kept) or end of string.
+    cut_depth = -1
+
+    for match in command_pattern.finditer(lstring):
+        symbol = match.group(1)
+        if cut_depth >= 0:
+            if symbol == '[':
+                cut_depth += 1
+                continue
+            elif symbol == ']' and cut_depth > 0:
+                cut_depth -= 1
+                continue
+            elif symbol == ']':
+                cut_depth = -1 # end of cut branch
+            else:
+                continue
+        elif symbol == '%':
+            cut_depth = 0
+            continue
+        command = commands_get(symbol)
+        if command is None:
+            continue # unsupported commands are ignored
+        opcode, allowed_counts, first_arg_is_string, usage = command
+        argstring = match.group(2)
+        arglist = argstring.split(',') if argstring else ()
+        if len(arglist) not in allowed_counts:
+            raise TurtleInterpretationError(usage)
+        opcodes_append(opcode)
+        arg_offsets_append(len(args))
+        arg_counts_append(len(arglist))
+        for i, arg in enumerate(arglist):
+            if i == 0 and first_arg_is_string:
+                if arg not in string_indices:
+                    string_indices[arg] = len(strings)
+                    strings.append(arg)
+                args.append(string_indices[arg])
+                continue
+            try:
+                args.append(float(arg))
+            except ValueError:
+                raise TurtleInterpretationError(
+                      "Invalid argument '{}' for command '{}', expected a number.\n{}".format(
+                      arg, symbol, usage))
+    return result
+
+# the last compiled L-string, so that the dry run and the drawing run of the same step
+# (and repeated interpretation of an unchanged L-string) only compile it once
+last_compiled = (None, None)
+
+def get_compiled(lstring):
+    """Return CompiledLString for lstring, reusing the last result if lstring did not change"""
+    global last_compiled
+    if last_compiled[0] is not lstring and last_compiled[0] != lstring:
+        last_compiled = (lstring, compile_lstring(lstring))
+    return last_compiled[1]
@@ -0,0 +1,107 @@
+import lpy
+import bpy
+import re
+from bpy.app.handlers import persistent
+from lindenmaker import profiling
+
+# the L-string for production of each scene (by scene name) is kept as live L-Py AxialTree
+# between production steps, so it does not have to be converted to text and parsed back every step.
+# it is only converted to text when the user views or edits it, or when the file is saved.
+# L-systems with '?' turtle state queries still take the text path once per step: the query results are spliced
+# into the text of the production L-string (see turtle_interpretation), which is parsed again for the next step.
+# each live AxialTree is kept with the number of production steps done when it was set. undo / redo
+# restores the step count but not the live AxialTree, thus it is discarded when the step count differs.
+live_axialtrees = {}
+# text of the live AxialTree, once converted
+live_texts = {}
+
+def axialtree_to_lstring(axialtree):
+    """Return L-string of an AxialTree that can be parsed again by L-Py"""
+    # substitute occurrences of e.g. ~(Object,4) with ~("Object",4)
+    # or ?(P,0,0,0) with ?("P",0,0,0).
+    # L-Py strips the quotes, but without them production fails.
+    with profiling.phase("axialtree to text"):
+        return re.sub(r'(?<=[~\?]\()(\w*)(?=[,\)])', r'"\1"', str(axialtree))
+
+def get_live_axialtree(scene):
+    """Return the live AxialTree of the scene, None if there is none or it belongs to another number of production steps"""
+    entry = live_axialtrees.get(scene.name)
+    if entry is None:
+        return None
+    step, axialtree = entry
+    if step != scene.number_production_steps_done:
+        live_axialtrees.pop(scene.name, None)
+        live_texts.pop(scene.name, None)
+        return None
+    return axialtree
+
+def get_production_axialtree(scene):
+    """Return the L-string for production of the scene as AxialTree, or None if it is empty"""
+    axialtree = get_live_axialtree(scene)
+    if axialtree is None:
+        lstring = scene.get("lstring_for_production", "")
+        if lstring == "":
+            return None
+        # parse text once, then keep the tree
+        axialtree = lpy.AxialTree(lstring)
+        live_axialtrees[scene.name] = (scene.number_production_steps_done, axialtree)
+        live_texts[scene.name] = lstring
+    return axialtree
+
+def set_production_axialtree(scene, axialtree):
+    """
+    Replace the L-string for production of the scene by the given AxialTree, without converting it to text.
+    It belongs to the current number of production steps done, thus set that first.
+    """
+    live_axialtrees[scene.name] = (scene.number_production_steps_done, axialtree)
+    live_texts.pop(scene.name, None)
+
+def get_production(scene):
+    """Return the L-string for production of the scene as live AxialTree if it is kept as one, otherwise as text"""
+    axialtree = get_live_axialtree(scene)
+    return axialtree if axialtree is not None else scene.get("lstring_for_production", "")
+
+def set_production(scene, production):
+    """Replace the L-string for production of the scene by an AxialTree or text, see get_production"""
+    if isinstance(production, str):
+        scene.lstring_for_production = production
+    else:
+        set_production_axialtree(scene, production)
+
+def production_step(scene):
+    """Return number of production steps done when the L-string for production of the scene was set"""
+    if get_live_axialtree(scene) is not None:
+        return scene.number_production_steps_done
+    # files saved before the step was stored along with the text
+    return scene.get("lstring_for_production_step", scene.number_production_steps_done)
+
+def get_lstring_for_production(scene):
+    """Getter of Scene.lstring_for_production, converts the live AxialTree to text on demand"""
+    axialtree = get_live_axialtree(scene)
+    if axialtree is None:
+        return scene.get("lstring_for_production", "")
+    text = live_texts.get(scene.name)
+    if text is None:
+        text = live_texts[scene.name] = axialtree_to_lstring(axialtree)
+    return text
+
+def set_lstring_for_production(scene, value):
+    """Setter of Scene.lstring_for_production, the text replaces the live AxialTree"""
+    live_axialtrees.pop(scene.name, None)
+    live_texts.pop(scene.name, None)
+    scene["lstring_for_production"] = value
+    scene["lstring_for_production_step"] = scene.number_production_steps_done
+
+@persistent
+def store_production_lstrings(dummy):
+    """Store text of live AxialTrees in the scenes before saving"""
+    for scene in bpy.data.scenes:
+        if get_live_axialtree(scene) is not None:
+            scene["lstring_for_production"] = get_lstring_for_production(scene)
+            scene["lstring_for_production_step"] = scene.number_production_steps_done
+
+@persistent
+def clear_production_lstrings(dummy):
+    """Forget live AxialTrees when another file is loaded"""
+    live_axialtrees.clear()
+    live_texts.clear()
@@ -0,0 +1,59 @@
+import lpy
+import os.path
+import hashlib
+from collections import OrderedDict
+from bpy.app.handlers import persistent
+
+# maximum number of compiled L-systems kept in memory, least recently used ones are dropped first
+max_cached_lsystems = 8
+
+# compiled L-systems by absolute .lpy file path: (mtime, size, content hash, lpy.Lsystem)
+cached_lsystems = OrderedDict()
+
+def file_content_hash(path):
+    """Return hash of the content of the file at path"""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def get_lsystem(path):
+    """
+    Return compiled lpy.Lsystem for the .lpy file at path.
+    The file is only read, compiled and its module level code only run again if its content changed.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    entry = cached_lsystems.get(path)
+    if entry is not None:
+        mtime, size, content_hash, lsys = entry
+        if (mtime, size) != (stat.st_mtime, stat.st_size):
+            # file was touched, but content might still be the same
+            new_content_hash = file_content_hash(path)
+            if new_content_hash != content_hash:
+                lsys = None
+            else:
+                cached_lsystems[path] = (stat.st_mtime, stat.st_size, content_hash, lsys)
+        if lsys is not None:
+            cached_lsystems.move_to_end(path)
+            return lsys
+    lsys = lpy.Lsystem(path)
+    cached_lsystems[path] = (stat.st_mtime, stat.st_size, file_content_hash(path), lsys)
+    cached_lsystems.move_to_end(path)
+    while len(cached_lsystems) > max_cached_lsystems:
+        cached_lsystems.popitem(last=False)
+    return lsys
+
+def invalidate(path=None):
+    """Drop the compiled L-system of the given .lpy file path from the cache, or all if no path is given"""
+    if path is None:
+        cached_lsystems.clear()
+    else:
+        cached_lsystems.pop(os.path.abspath(path), None)
+
+@persistent
+def clear_lsystems(dummy=None):
+    """
+    Forget all compiled L-systems when another file is loaded or after undo / redo,
+    since module level code of .lpy files can keep references to datablocks (e.g. bpy.data.objects['Obstacle'] of model 8),
+    which are freed or reallocated then.
+    """
+    invalidate()
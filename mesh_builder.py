@@ -0,0 +1,117 @@
+import bpy
+import numpy as np
+from math import radians
+
+class MeshBuilder:
+    """Collects transformed copies of module meshes in flat arrays and creates a single joined mesh in one go.
+    Used for the single object (no hierarchy) mode instead of joining one object per module into the root,
+    which copies the whole growing mesh on every join and thus takes quadratic time."""
+
+    def __init__(self, shade_smooth=True):
+        self.shade_smooth = shade_smooth
+        # per module chunks, concatenated once when building the mesh
+        self.vertex_chunks = []       # (n,3) float32 vertex positions in world space
+        self.loop_chunks = []         # polygon loop vertex indices, already offset into the joined mesh
+        self.loop_total_chunks = []   # number of loops (vertices) per polygon
+        self.material_chunks = []     # material slot index per polygon
+        self.vertex_count = 0
+        # material slots of the joined mesh
+        self.materials = []
+        self.material_slot_by_name = {}
+        # mesh data read via foreach_get, cached by mesh name since meshes are shared by many modules
+        self.mesh_arrays = {}
+
+    def get_mesh_arrays(self, mesh):
+        """Return vertex positions, loop vertex indices, loop totals and material indices of a mesh as arrays"""
+        arrays = self.mesh_arrays.get(mesh.name)
+        if arrays is None:
+            co = np.empty(len(mesh.vertices)*3, dtype=np.float32)
+            mesh.vertices.foreach_get("co", co)
+            loops = np.empty(len(mesh.loops), dtype=np.int32)
+            mesh.loops.foreach_get("vertex_index", loops)
+            loop_start = np.empty(len(mesh.polygons), dtype=np.int32)
+            mesh.polygons.foreach_get("loop_start", loop_start)
+            loop_total = np.empty(len(mesh.polygons), dtype=np.int32)
+            mesh.polygons.foreach_get("loop_total", loop_total)
+            material_index = np.empty(len(mesh.polygons), dtype=np.int32)
+            mesh.polygons.foreach_get("material_index", material_index)
+            # loops are expected to be stored in polygon order, make sure polygon arrays follow it
+            order = np.argsort(loop_start, kind='mergesort') # stable
+            arrays = (co.reshape(-1, 3), loops, loop_total[order], material_index[order])
+            self.mesh_arrays[mesh.name] = arrays
+        return arrays
+
+    def get_material_slot(self, material):
+        """Return slot index of the given material in the joined mesh, adding a slot if needed"""
+        key = material.name if material is not None else None
+        slot = self.material_slot_by_name.get(key)
+        if slot is None:
+            slot = self.material_slot_by_name[key] = len(self.materials)
+            self.materials.append(material)
+        return slot
+
+    def add_mesh(self, mesh, matrix, scale=(1, 1, 1), material=None, slot_materials=None):
+        """
+        Add a copy of the mesh scaled along its local axes and transformed by the given 4x4 matrix.
+        If material is given it is assigned to all polygons of the copy,
+        otherwise polygons keep the materials of slot_materials (i.e. the slots of a custom object).
+        """
+        co, loops, loop_total, material_index = self.get_mesh_arrays(mesh)
+        if len(co) == 0:
+            return
+        mat = np.array(matrix, dtype=np.float32)
+        rotscale = mat[:3,:3] * np.array(scale, dtype=np.float32) # scale columns, i.e. local axes
+        self.vertex_chunks.append(co.dot(rotscale.T) + mat[:3,3])
+        self.loop_chunks.append(loops + self.vertex_count)
+        self.loop_total_chunks.append(loop_total)
+        if material is not None:
+            self.material_chunks.append(np.full(len(loop_total), self.get_material_slot(material), dtype=np.int32))
+        elif slot_materials:
+            slot_map = np.array([self.get_material_slot(m) for m in slot_materials], dtype=np.int32)
+            self.material_chunks.append(slot_map[np.minimum(material_index, len(slot_map)-1)])
+        else:
+            self.material_chunks.append(np.zeros(len(loop_total), dtype=np.int32))
+        self.vertex_count += len(co)
+
+    def add_geometry(self, co, loops, loop_total, material_slots):
+        """Add polygons given by vertex positions (n,3), loop vertex indices, loop totals and material slot per polygon"""
+        if len(co) == 0:
+            return
+        self.vertex_chunks.append(np.asarray(co, dtype=np.float32))
+        self.loop_chunks.append(loops + self.vertex_count)
+        self.loop_total_chunks.append(loop_total)
+        self.material_chunks.append(np.asarray(material_slots, dtype=np.int32))
+        self.vertex_count += len(co)
+
+    def build(self, name="Root"):
+        """Create a new mesh object from all collected modules and link it to the scene"""
+        scene = bpy.context.scene
+        obj = bpy.data.objects.new(name, self.build_mesh(name))
+        scene.objects.link(obj)
+        return obj
+
+    def build_mesh(self, name):
+        """Create a new mesh from all collected modules via bulk foreach_set calls"""
+        mesh = bpy.data.meshes.new(name)
+        if self.vertex_chunks:
+            co = np.concatenate(self.vertex_chunks).astype(np.float32).ravel()
+            loops = np.concatenate(self.loop_chunks)
+            loop_total = np.concatenate(self.loop_total_chunks)
+            loop_start = np.zeros(len(loop_total), dtype=np.int32)
+            np.cumsum(loop_total[:-1], out=loop_start[1:])
+            material_index = np.concatenate(self.material_chunks)
+            mesh.vertices.add(len(co)//3)
+            mesh.vertices.foreach_set("co", co)
+            mesh.loops.add(len(loops))
+            mesh.loops.foreach_set("vertex_index", loops)
+            mesh.polygons.add(len(loop_total))
+            mesh.polygons.foreach_set("loop_start", loop_start)
+            mesh.polygons.foreach_set("loop_total", loop_total)
+            mesh.polygons.foreach_set("material_index", material_index)
+            mesh.polygons.foreach_set("use_smooth", np.full(len(loop_total), self.shade_smooth, dtype=bool))
+            mesh.update(calc_edges=True)
+        for material in self.materials:
+            mesh.materials.append(material)
+        mesh.use_auto_smooth = True
+        mesh.auto_smooth_angle = radians(85)
+        return mesh
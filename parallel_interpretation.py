@@ -0,0 +1,251 @@
+import re
+import sys
+import heapq
+import multiprocessing
+import numpy as np
+
+try:
+    from lindenmaker import lstring_compiler
+    from lindenmaker import turtle_kernel
+except ImportError:
+    # imported outside of Blender, see turtle_kernel
+    import lstring_compiler
+    import turtle_kernel
+
+# L-strings with fewer commands are interpreted sequentially, starting the processes would take longer
+min_parallel_commands = 20000
+# number of branch tasks per process, more tasks balance the load better but add merging overhead
+tasks_per_process = 4
+# seconds to wait for the result of a worker process before yielding progress, see interpret_to_arrays_parallel_steps
+poll_seconds = 0.05
+
+# L-string and interpretation options of the current parallel interpretation,
+# inherited by the forked worker processes so that only branch ranges and states are sent to them
+shared_compiled = None
+shared_options = {}
+
+# import statements of Blender modules, directly or via the add-on (e.g. spatial_queries)
+blender_imports = re.compile(r"^\s*(?:import|from)\s+(?:bpy|bmesh|mathutils|lindenmaker)\b", re.MULTILINE)
+
+def can_fork(lpyfile=None):
+    """
+    Return whether worker processes can be forked, i.e. inherit the interpreter state without starting Blender again.
+    Not for the L-system of an .lpy file importing Blender modules, whose Blender data must not be used by a copy of Blender.
+    """
+    if sys.platform == 'win32' or 'fork' not in multiprocessing.get_all_start_methods():
+        return False
+    if lpyfile is not None:
+        try:
+            with open(lpyfile, encoding='utf-8', errors='replace') as f:
+                return blender_imports.search(f.read()) is None
+        except OSError:
+            pass
+    return True
+
+def direct_branches(compiled, start, stop):
+    """Return (start, end) command indices of the matched branches directly within commands start to stop (exclusive)"""
+    branch_ends = compiled.branch_ends()
+    opcodes = compiled.opcodes
+    branches = []
+    i = start
+    while i < stop:
+        if opcodes[i] == lstring_compiler.OP_PUSH and branch_ends[i] >= 0:
+            branches.append((i, branch_ends[i]))
+            i = branch_ends[i]
+        i += 1
+    return branches
+
+def split_into_branches(compiled, max_commands):
+    """
+    Return sorted (start, end) command indices of disjoint branches to interpret separately.
+    Starts with the top level branches and replaces branches longer than max_commands by the branches within them,
+    the commands of replaced branches outside of their sub-branches are interpreted along with the trunk.
+    """
+    heap = [(start - end, start, end) for start, end in direct_branches(compiled, 0, len(compiled))]
+    heapq.heapify(heap)
+    branches = []
+    while heap and -heap[0][0] > max_commands:
+        _, start, end = heapq.heappop(heap)
+        sub_branches = direct_branches(compiled, start+1, end)
+        if not sub_branches:
+            branches.append((start, end))
+        for sub_start, sub_end in sub_branches:
+            heapq.heappush(heap, (sub_start - sub_end, sub_start, sub_end))
+    branches.extend((start, end) for _, start, end in heap)
+    return sorted(branches)
+
+def concatenate(parts):
+    """Return InterpretationArrays with the modules and queries of all parts in order, each part being a separate tree"""
+    result = turtle_kernel.InterpretationArrays(0)
+    result.count = sum(len(part) for part in parts)
+    for name in ('matrices', 'scales', 'widths', 'lengths', 'materialindices', 'kinds'):
+        setattr(result, name, np.concatenate([getattr(part, name) for part in parts]))
+    offsets = np.cumsum([0] + [len(part) for part in parts])
+    result.parents = np.concatenate([np.where(part.parents >= 0, part.parents + offset, -1).astype(np.int32)
+                                     for part, offset in zip(parts, offsets)])
+    result.custom_object_ids = np.concatenate([global_custom_object_ids(part, result.custom_object_names) for part in parts])
+    for part in parts:
+        result.query_types += part.query_types
+        result.query_vectors += list(part.query_vectors)
+    return result.finish()
+
+def global_custom_object_ids(part, custom_object_names):
+    """Return custom object ids of the modules of part as indices into custom_object_names, adding names of part not in it yet"""
+    ids_of_names = []
+    for name in part.custom_object_names:
+        if name not in custom_object_names:
+            custom_object_names.append(name)
+        ids_of_names.append(custom_object_names.index(name))
+    # the appended -1 is picked by the id -1 of modules that are not custom objects
+    return np.array(ids_of_names + [-1], dtype=np.int32)[part.custom_object_ids]
+
+def interpret_branches(branches):
+    """
+    Interpret (start, end, turtle state) branches of shared_compiled, run in worker processes.
+    Return results of all branches concatenated, since sending many small results back is slow,
+    and the number of modules and queries of each branch.
+    """
+    parts = [turtle_kernel.interpret_to_arrays(shared_compiled.slice(start, end+1), turtle_state=state, **shared_options)
+             for start, end, state in branches]
+    return concatenate(parts), [(len(part), len(part.query_types)) for part in parts]
+
+def merge(trunk, branch_groups):
+    """
+    Return InterpretationArrays of the whole L-string from the trunk result (with split_branch_states)
+    and the concatenated results of the groups of split branches (see interpret_branches),
+    in the same order as sequential interpretation.
+    """
+    branch_counts = [counts for group, group_counts in branch_groups for counts in group_counts]
+    sizes = np.array([modules for modules, queries in branch_counts], dtype=np.int64)
+    insert_at = np.array([state[4] for state in trunk.split_branch_states], dtype=np.int64)
+    n = len(trunk) + int(sizes.sum())
+    result = turtle_kernel.InterpretationArrays(n)
+    result.count = n
+
+    # trunk modules are shifted by the size of the branches inserted before them
+    shift = np.zeros(len(trunk)+1, dtype=np.int64)
+    np.add.at(shift, insert_at, sizes)
+    trunk_indices = np.arange(len(trunk)) + np.cumsum(shift)[:len(trunk)]
+    branch_offsets = insert_at + np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+
+    # custom object ids refer to the custom object names of each part, collect names in one list first
+    custom_object_names = []
+    trunk_custom_object_ids = global_custom_object_ids(trunk, custom_object_names)
+    result.matrices[trunk_indices] = trunk.matrices
+    result.scales[trunk_indices] = trunk.scales
+    result.widths[trunk_indices] = trunk.widths
+    result.lengths[trunk_indices] = trunk.lengths
+    result.materialindices[trunk_indices] = trunk.materialindices
+    result.kinds[trunk_indices] = trunk.kinds
+    result.custom_object_ids[trunk_indices] = trunk_custom_object_ids
+    result.parents[trunk_indices] = np.where(trunk.parents >= 0, trunk_indices[trunk.parents], -1)
+
+    branch_queries = []
+    k = 0
+    for group, group_counts in branch_groups:
+        group_custom_object_ids = global_custom_object_ids(group, custom_object_names)
+        start = query_start = 0
+        for modules, queries in group_counts:
+            stop = start + modules
+            offset = branch_offsets[k]
+            parent = trunk.split_branch_states[k][3]
+            parent = trunk_indices[parent] if parent >= 0 else -1
+            target = slice(offset, offset + modules)
+            result.matrices[target] = group.matrices[start:stop]
+            result.scales[target] = group.scales[start:stop]
+            result.widths[target] = group.widths[start:stop]
+            result.lengths[target] = group.lengths[start:stop]
+            result.materialindices[target] = group.materialindices[start:stop]
+            result.kinds[target] = group.kinds[start:stop]
+            result.custom_object_ids[target] = group_custom_object_ids[start:stop]
+            parents = group.parents[start:stop]
+            result.parents[target] = np.where(parents >= 0, parents - start + offset, parent)
+            branch_queries.append((group.query_types[query_start:query_start+queries],
+                                   group.query_vectors[query_start:query_start+queries]))
+            start = stop
+            query_start += queries
+            k += 1
+
+    # number custom objects by first occurrence, like sequential interpretation does
+    ids = result.custom_object_ids
+    used, first = np.unique(ids[ids >= 0], return_index=True)
+    order = used[np.argsort(first)]
+    renumber = np.full(len(custom_object_names)+1, -1, dtype=np.int32)
+    renumber[order] = np.arange(len(order))
+    result.custom_object_ids = renumber[ids]
+    result.custom_object_names = [custom_object_names[i] for i in order]
+
+    # queries of the branches are inserted between the trunk queries
+    query_starts = [state[5] for state in trunk.split_branch_states] + [len(trunk.query_types)]
+    result.query_types = list(trunk.query_types[:query_starts[0]])
+    result.query_vectors = list(trunk.query_vectors[:query_starts[0]])
+    for k, (query_types, query_vectors) in enumerate(branch_queries):
+        result.query_types += query_types
+        result.query_vectors += list(query_vectors)
+        result.query_types += trunk.query_types[query_starts[k]:query_starts[k+1]]
+        result.query_vectors += list(trunk.query_vectors[query_starts[k]:query_starts[k+1]])
+    return result.finish()
+
+def interpret_to_arrays_parallel(lstring, processes=None, **options):
+    """
+    Turtle interpretation like turtle_kernel.interpret_to_arrays (taking the same keyword options),
+    with the branches of the L-string interpreted in parallel by a pool of worker processes.
+    The trunk is interpreted first, skipping the branches but recording the turtle state at their start,
+    then the branches are interpreted from these states and the results merged in order.
+    Falls back to sequential interpretation for short L-strings or where processes cannot be forked.
+    """
+    return turtle_kernel.run_steps(interpret_to_arrays_parallel_steps(lstring, processes, yield_commands=None, **options))
+
+def interpret_to_arrays_parallel_steps(lstring, processes=None, yield_commands=turtle_kernel.default_yield_commands, **options):
+    """
+    Generator doing the same as interpret_to_arrays_parallel, yielding (commands interpreted, command count)
+    like turtle_kernel.interpret_to_arrays_steps in between, also while waiting for the worker processes.
+    """
+    global shared_compiled, shared_options
+    if isinstance(lstring, lstring_compiler.CompiledLString):
+        compiled = lstring
+    else:
+        compiled = lstring_compiler.get_compiled(lstring)
+    processes = processes or multiprocessing.cpu_count()
+    if processes < 2 or len(compiled) < min_parallel_commands or options.get('queries_only') or not can_fork():
+        return (yield from turtle_kernel.interpret_to_arrays_steps(compiled, yield_commands=yield_commands, **options))
+
+    branches = split_into_branches(compiled, len(compiled) // (processes * tasks_per_process))
+    if len(branches) < 2:
+        return (yield from turtle_kernel.interpret_to_arrays_steps(compiled, yield_commands=yield_commands, **options))
+    # branches of the trunk contain split branches, thus they must not be reused as a whole
+    trunk_options = dict(options, reuse_subtrees=False)
+    trunk = yield from turtle_kernel.interpret_to_arrays_steps(compiled, split_branches=set(start for start, end in branches),
+                                                               yield_commands=yield_commands, **trunk_options)
+    shared_compiled, shared_options = compiled, options
+    # consecutive branches are sent to the workers in groups of about equal command count
+    tasks = [(start, end, state[:3]) for (start, end), state in zip(branches, trunk.split_branch_states)]
+    group_size = max(1, sum(end - start + 1 for start, end in branches) // (processes * tasks_per_process))
+    groups = [[]]
+    group_commands = 0
+    for task in tasks:
+        if group_commands >= group_size:
+            groups.append([])
+            group_commands = 0
+        groups[-1].append(task)
+        group_commands += task[1] - task[0] + 1
+    # commands of the trunk are done, the ones of the branches as their groups are done
+    done = len(compiled) - sum(end - start + 1 for start, end in branches)
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            if not yield_commands:
+                branch_groups = pool.map(interpret_branches, groups, chunksize=1)
+            else:
+                # results in order, waiting for each at most poll_seconds before yielding again
+                results = pool.imap(interpret_branches, groups, chunksize=1)
+                branch_groups = []
+                while len(branch_groups) < len(groups):
+                    try:
+                        branch_groups.append(results.next(poll_seconds))
+                        done += sum(end - start + 1 for start, end, state in groups[len(branch_groups)-1])
+                    except multiprocessing.TimeoutError:
+                        pass
+                    yield done, len(compiled)
+    finally:
+        shared_compiled, shared_options = None, {}
+    return merge(trunk, branch_groups)
@@ -0,0 +1,150 @@
+import io
+import json
+import time
+import pstats
+import cProfile
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    from lindenmaker import lstring_compiler
+    from lindenmaker import turtle_kernel
+except ImportError:
+    # imported outside of Blender, see turtle_kernel
+    import lstring_compiler
+    import turtle_kernel
+
+# profile phases are currently added to, None if profiling is disabled.
+# a run time-sliced by the modal operator keeps its own Profile, which is only active during its slices, see activated
+active = None
+# result of the last finished profile, see Profile.to_dict
+last_profile = None
+
+class Profile:
+    """
+    Timings of the phases of a production / interpretation run and of each derivation step,
+    command and module counts and other values, optionally with a cProfile capture of the run
+    (only while the profile is active, not of the UI in between time slices).
+    """
+
+    def __init__(self, use_cprofile=False):
+        # total seconds and number of calls per phase name, in order of first use
+        self.phases = OrderedDict()
+        self.phase_calls = OrderedDict()
+        # seconds per phase name of each derivation step, and of the current one
+        self.steps = []
+        self.current_step = None
+        # named counts (dicts of counts by key, e.g. commands by symbol) and single values
+        self.counts = OrderedDict()
+        self.values = OrderedDict()
+        self.peak_lstring_length = 0
+        self.start_time = time.perf_counter()
+        self.total_seconds = None
+        self.cprofile = None
+        self.cprofile_stats = None
+        if use_cprofile:
+            self.cprofile = cProfile.Profile()
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager adding the time spent in it to the phase name (and to the current derivation step)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self.phase_calls[name] = self.phase_calls.get(name, 0) + 1
+            if self.current_step is not None:
+                self.current_step[name] = self.current_step.get(name, 0.0) + seconds
+
+    def begin_step(self):
+        """Start timing a new derivation step, phases from now on are also added to it"""
+        self.current_step = OrderedDict()
+        self.steps.append(self.current_step)
+
+    def end_step(self):
+        """Stop adding phases to the current derivation step"""
+        self.current_step = None
+
+    def record_lstring(self, lstring):
+        """Record length of an L-string, keeping the maximum"""
+        self.peak_lstring_length = max(self.peak_lstring_length, len(lstring))
+
+    def count_commands(self, compiled):
+        """Record number of commands of a lstring_compiler.CompiledLString by command symbol"""
+        symbols = {command[0]: symbol for symbol, command in lstring_compiler.COMMANDS.items()}
+        counts = np.bincount(np.frombuffer(compiled.opcodes, dtype=np.uint8), minlength=lstring_compiler.OPCODE_COUNT)
+        self.counts['commands'] = OrderedDict((symbols[opcode], int(n)) for opcode, n in enumerate(counts) if n)
+
+    def count_modules(self, arrays):
+        """Record number of modules of turtle_kernel.InterpretationArrays by kind"""
+        counts = np.bincount(arrays.kinds, minlength=3)
+        self.counts['modules'] = OrderedDict((('internodes', int(counts[turtle_kernel.MODULE_INTERNODE])),
+                                              ('nodes', int(counts[turtle_kernel.MODULE_NODE])),
+                                              ('custom objects', int(counts[turtle_kernel.MODULE_CUSTOM]))))
+
+    def finish(self):
+        """Stop timing and collect the results of the cProfile capture"""
+        self.total_seconds = time.perf_counter() - self.start_time
+        if self.cprofile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.cprofile, stream=stream).sort_stats('cumulative').print_stats(40)
+            self.cprofile_stats = stream.getvalue()
+            self.cprofile = None
+
+    def to_dict(self):
+        """Return all results as dict of plain values, e.g. to be written as JSON"""
+        result = OrderedDict()
+        result['total_seconds'] = self.total_seconds
+        result['phases'] = OrderedDict((name, {'seconds': seconds, 'calls': self.phase_calls[name]})
+                                       for name, seconds in self.phases.items())
+        result['steps'] = self.steps
+        result['peak_lstring_length'] = self.peak_lstring_length
+        result['counts'] = self.counts
+        result.update(self.values)
+        if self.cprofile_stats is not None:
+            result['cprofile'] = self.cprofile_stats
+        return result
+
+    def summary(self):
+        """Return one line summary of the results, e.g. for the operator report"""
+        phases = ", ".join("{} {:.3f}s".format(name, seconds) for name, seconds in self.phases.items())
+        values = ", ".join("{} {}".format(name.replace('_', ' '), value) for name, value in self.values.items())
+        return "Total {:.3f}s ({}). {} steps, peak L-string length {}{}".format(
+               self.total_seconds or 0.0, phases, len(self.steps), self.peak_lstring_length, ", "+values if values else "")
+
+@contextmanager
+def activated(profile):
+    """Context manager adding the phases in it to profile (a Profile, None to not profile them), and running its cProfile capture"""
+    global active
+    previous = active
+    active = profile
+    if profile is not None and profile.cprofile is not None:
+        profile.cprofile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None and profile.cprofile is not None:
+            profile.cprofile.disable()
+        active = previous
+
+def finish(profile):
+    """Finish profile, which is then also available as dict in last_profile"""
+    global last_profile
+    profile.finish()
+    last_profile = profile.to_dict()
+
+@contextmanager
+def phase(name):
+    """Context manager timing phase name of the active profile, does nothing if profiling is disabled"""
+    if active is None:
+        yield
+    else:
+        with active.phase(name):
+            yield
+
+def to_json(profile_dict=None):
+    """Return the given (or last) profile dict as JSON text"""
+    return json.dumps(profile_dict if profile_dict is not None else last_profile, indent=2)
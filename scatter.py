@@ -0,0 +1,200 @@
+import bpy
+import numpy as np
+from mathutils import Matrix
+
+def hierarchy_objects(root):
+    """Return root and all of its descendants"""
+    objects = [root]
+    for obj in objects:
+        objects.extend(obj.children)
+    return objects
+
+def get_source_group(root):
+    """
+    Return group with all objects of the hierarchy of root, instanced relative to the origin of root,
+    and whether its objects changed. The group is named after root and reused when scattering root again,
+    its objects are replaced if the hierarchy of root changed since.
+    """
+    name = root.name+".Scatter"
+    objects = hierarchy_objects(root)
+    group = bpy.data.groups.get(name)
+    changed = group is None or set(obj.name for obj in group.objects) != set(obj.name for obj in objects)
+    if group is None:
+        group = bpy.data.groups.new(name)
+    elif changed:
+        for obj in list(group.objects):
+            group.objects.unlink(obj)
+    if changed:
+        for obj in objects:
+            group.objects.link(obj)
+    group.dupli_offset = root.matrix_world.translation
+    return group, changed
+
+def decimated_mesh(mesh, ratio, name):
+    """Return new mesh with the polygons of mesh reduced to about ratio via the decimate modifier"""
+    scene = bpy.context.scene
+    temp = bpy.data.objects.new(name, mesh)
+    modifier = temp.modifiers.new("Decimate", 'DECIMATE')
+    modifier.ratio = ratio
+    result = temp.to_mesh(scene, True, 'PREVIEW')
+    result.name = name
+    bpy.data.objects.remove(temp)
+    return result
+
+def remove_group_copies(group):
+    """Unlink the objects of group, removing them and their meshes if they are not used otherwise"""
+    for obj in list(group.objects):
+        mesh = obj.data
+        group.objects.unlink(obj)
+        if obj.users == 0:
+            bpy.data.objects.remove(obj)
+            if mesh is not None and mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+
+def get_lod_group(group, level, decimated_meshes, rebuild):
+    """
+    Return group with copies of the objects of group, their meshes decimated to half the polygons per level.
+    Copies share the decimated meshes, decimated_meshes caches them by (original mesh name, level).
+    The group is named after group and level, an existing one is reused unless rebuild is set,
+    then its copies are replaced.
+    """
+    name = "{}.LOD{}".format(group.name, level)
+    lod_group = bpy.data.groups.get(name)
+    if lod_group is None:
+        lod_group = bpy.data.groups.new(name)
+    elif rebuild:
+        remove_group_copies(lod_group)
+    else:
+        lod_group.dupli_offset = group.dupli_offset
+        return lod_group
+    copies = {}
+    for obj in group.objects:
+        copy = obj.copy() # shares data, keeps matrices and parent inverse
+        if obj.type == 'MESH':
+            key = (obj.data.name, level)
+            if key not in decimated_meshes:
+                decimated_meshes[key] = decimated_mesh(obj.data, 0.5**level, "{}.LOD{}".format(obj.data.name, level))
+            copy.data = decimated_meshes[key]
+        copies[obj.name] = copy
+        lod_group.objects.link(copy)
+    for obj in group.objects:
+        if obj.parent is not None and obj.parent.name in copies:
+            copies[obj.name].parent = copies[obj.parent.name]
+    lod_group.dupli_offset = group.dupli_offset
+    return lod_group
+
+def vertex_group_weights(obj, vertex_group):
+    """Return weight of every vertex of mesh object obj in the named vertex group (0 if not assigned)"""
+    index = obj.vertex_groups[vertex_group].index
+    weights = np.zeros(len(obj.data.vertices))
+    for v in obj.data.vertices:
+        for g in v.groups:
+            if g.group == index:
+                weights[v.index] = g.weight
+    return weights
+
+def surface_triangles(obj):
+    """Return N x 3 x 3 world space vertex positions and N x 3 vertex indices of the triangulated polygons of mesh object obj"""
+    mesh = obj.data
+    co = np.empty(len(mesh.vertices)*3)
+    mesh.vertices.foreach_get("co", co)
+    co = co.reshape(-1, 3)
+    loops = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loops)
+    loop_start = np.empty(len(mesh.polygons), dtype=np.int32)
+    loop_total = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", loop_start)
+    mesh.polygons.foreach_get("loop_total", loop_total)
+    # fan triangulation, triangle k of a polygon uses its loops 0, k+1 and k+2
+    triangle_counts = loop_total - 2
+    polygon_of_triangle = np.repeat(np.arange(len(loop_total)), triangle_counts)
+    k = np.arange(triangle_counts.sum()) - np.repeat(np.cumsum(triangle_counts) - triangle_counts, triangle_counts)
+    first_loops = loop_start[polygon_of_triangle]
+    indices = np.stack((loops[first_loops], loops[first_loops+k+1], loops[first_loops+k+2]), axis=1)
+    matrix = np.array(obj.matrix_world)
+    world = co.dot(matrix[:3,:3].T) + matrix[:3,3]
+    return world[indices], indices
+
+def sample_surface(obj, count, vertex_group="", rng=np.random):
+    """
+    Return count random world space positions and normals on the surface of mesh object obj,
+    uniformly distributed by area, with density scaled by the weights of vertex_group if given.
+    """
+    triangles, indices = surface_triangles(obj)
+    normals = np.cross(triangles[:,1] - triangles[:,0], triangles[:,2] - triangles[:,0])
+    areas = np.linalg.norm(normals, axis=1) / 2
+    density = areas
+    if vertex_group:
+        density = areas * vertex_group_weights(obj, vertex_group)[indices].mean(axis=1)
+    if len(density) == 0 or density.sum() <= 0:
+        return np.empty((0, 3)), np.empty((0, 3))
+    chosen = rng.choice(len(density), count, p=density/density.sum())
+    # uniform barycentric coordinates
+    r1 = np.sqrt(rng.random_sample(count))[:,np.newaxis]
+    r2 = rng.random_sample(count)[:,np.newaxis]
+    a, b, c = triangles[chosen,0], triangles[chosen,1], triangles[chosen,2]
+    positions = (1-r1)*a + r1*(1-r2)*b + r1*r2*c
+    normals = normals[chosen] / np.maximum(2*areas[chosen], 1e-12)[:,np.newaxis]
+    return positions, normals
+
+def placement_matrices(positions, normals, align_to_normal, scale_min, scale_max, rng=np.random):
+    """Return N x 4 x 4 matrices placing instances at positions, randomly rotated around the up (or normal) axis and scaled"""
+    n = len(positions)
+    ups = normals if align_to_normal else np.tile((0.0, 0.0, 1.0), (n, 1))
+    # any axis perpendicular to up, then rotated by a random angle around up
+    helper = np.where(np.abs(ups[:,0:1]) < 0.9, [[1.0, 0.0, 0.0]], [[0.0, 1.0, 0.0]])
+    xs = np.cross(helper, ups)
+    xs /= np.linalg.norm(xs, axis=1)[:,np.newaxis]
+    ys = np.cross(ups, xs)
+    angles = rng.uniform(0, 2*np.pi, n)[:,np.newaxis]
+    xs, ys = np.cos(angles)*xs + np.sin(angles)*ys, -np.sin(angles)*xs + np.cos(angles)*ys
+    scales = rng.uniform(scale_min, scale_max, n)[:,np.newaxis]
+    matrices = np.zeros((n, 4, 4))
+    matrices[:,:3,0] = xs * scales
+    matrices[:,:3,1] = ys * scales
+    matrices[:,:3,2] = ups * scales
+    matrices[:,:3,3] = positions
+    matrices[:,3,3] = 1
+    return matrices
+
+def scatter(roots, target, count, vertex_group="", seed=0, align_to_normal=False, scale_min=1.0, scale_max=1.0,
+            lod_levels=1, lod_distance=50.0):
+    """
+    Place count instances of the hierarchies of roots (e.g. interpretation results) randomly on the surface of target.
+    Every instance is an Empty instancing a group with the objects of a randomly chosen root, thus all instances
+    share the objects and meshes of the roots. With lod_levels > 1, each root also gets groups with decimated meshes
+    (half the polygons per level) and instances use level distance_to_camera / lod_distance (if the scene has a camera).
+    The groups are named after the roots and shared with earlier scatterings of them, see get_source_group.
+    Return new Empty parenting all instances.
+    """
+    scene = bpy.context.scene
+    rng = np.random.RandomState(seed)
+    # groups are reused when scattering the same results again, e.g. with another count or seed
+    groups = []
+    decimated_meshes = {}
+    for root in roots:
+        group, changed = get_source_group(root)
+        groups.append([group] + [get_lod_group(group, level, decimated_meshes, changed) for level in range(1, lod_levels)])
+
+    positions, normals = sample_surface(target, count, vertex_group, rng)
+    matrices = placement_matrices(positions, normals, align_to_normal, scale_min, scale_max, rng)
+    sources = rng.randint(len(groups), size=len(positions))
+    levels = np.zeros(len(positions), dtype=np.int64)
+    if lod_levels > 1 and scene.camera is not None:
+        distances = np.linalg.norm(positions - np.array(scene.camera.matrix_world.translation), axis=1)
+        levels = np.minimum((distances / lod_distance).astype(np.int64), lod_levels-1)
+
+    forest = bpy.data.objects.new("Forest", None)
+    forest.empty_draw_type = 'ARROWS'
+    forest.empty_draw_size = 0
+    scene.objects.link(forest)
+    for matrix, source, level in zip(matrices, sources, levels):
+        group = groups[source][level]
+        instance = bpy.data.objects.new(group.name, None)
+        instance.dupli_type = 'GROUP'
+        instance.dupli_group = group
+        instance.empty_draw_size = 0
+        instance.parent = forest
+        instance.matrix_basis = Matrix(matrix.tolist())
+        scene.objects.link(instance)
+    return forest
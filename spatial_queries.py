@@ -0,0 +1,153 @@
+import bpy
+import sys
+import numpy as np
+from bpy.app.handlers import persistent
+from mathutils import Vector
+from mathutils.bvhtree import BVHTree
+from mathutils.kdtree import KDTree
+
+from lindenmaker import profiling
+
+# spatial queries against mesh objects of the scene for .lpy files, e.g. for environment interaction:
+#
+#   from lindenmaker import spatial_queries
+#   ...
+#   ?(vector,x,y,z):
+#       if vector == "P" and spatial_queries.distance(obstacle, (x,y,z)) < 1.0: ...
+#
+# the BVH tree, KD tree and vertex weights of an object are built on first use and kept until its mesh
+# or transform changes, instead of being rebuilt by every query or every time the .lpy file is run.
+# all points and results are in world space. the mesh data is used without modifiers.
+
+# SpatialIndex of each object by object name
+indices = {}
+
+class SpatialIndex:
+    """
+    Spatial search structures of a mesh object in world space: BVH tree of its faces, KD tree of its vertices
+    and weights of each vertex group as array by vertex index, each built when first needed.
+    """
+
+    def __init__(self, obj):
+        self.matrix_world = obj.matrix_world.copy()
+        self.mesh_key = mesh_key(obj)
+        mesh = obj.data
+        co = np.empty(len(mesh.vertices) * 3)
+        mesh.vertices.foreach_get("co", co)
+        matrix = np.array(self.matrix_world)
+        self.vertices = co.reshape(-1, 3).dot(matrix[:3,:3].T) + matrix[:3,3]
+        self.polygons = [tuple(polygon.vertices) for polygon in mesh.polygons]
+        self._bvhtree = None
+        self._kdtree = None
+        self.weights = {}
+
+    def is_valid(self, obj):
+        """Return whether the index still matches the mesh and transform of obj"""
+        return self.mesh_key == mesh_key(obj) and self.matrix_world == obj.matrix_world
+
+    @property
+    def bvhtree(self):
+        if self._bvhtree is None:
+            with profiling.phase("spatial index build"):
+                self._bvhtree = BVHTree.FromPolygons(self.vertices.tolist(), self.polygons)
+        return self._bvhtree
+
+    @property
+    def kdtree(self):
+        if self._kdtree is None:
+            with profiling.phase("spatial index build"):
+                self._kdtree = KDTree(len(self.vertices))
+                for index, co in enumerate(self.vertices.tolist()):
+                    self._kdtree.insert(co, index)
+                self._kdtree.balance()
+        return self._kdtree
+
+    def group_weights(self, obj, group):
+        """Return weights of vertex group (index or name) of obj by vertex index, 0 for vertices not in the group"""
+        group_index = obj.vertex_groups[group].index
+        weights = self.weights.get(group_index)
+        if weights is None:
+            with profiling.phase("spatial index build"):
+                weights = np.zeros(len(self.vertices))
+                for vertex in obj.data.vertices:
+                    for element in vertex.groups:
+                        if element.group == group_index:
+                            weights[vertex.index] = element.weight
+                self.weights[group_index] = weights
+        return weights
+
+def mesh_key(obj):
+    """Return key of the mesh datablock of obj and its size, changes if the mesh is replaced or resized"""
+    mesh = obj.data
+    return (mesh.as_pointer(), len(mesh.vertices), len(mesh.polygons))
+
+def get_object(obj):
+    """Return object of obj (object or object name)"""
+    return bpy.data.objects[obj] if isinstance(obj, str) else obj
+
+def get_index(obj):
+    """Return SpatialIndex of obj (object or object name), built again if its mesh or transform changed"""
+    obj = get_object(obj)
+    if obj.type != 'MESH':
+        raise TypeError("Spatial queries need a mesh object, '{}' is of type {}".format(obj.name, obj.type))
+    index = indices.get(obj.name)
+    if index is None or not index.is_valid(obj):
+        index = indices[obj.name] = SpatialIndex(obj)
+    return index
+
+def closest_point(obj, point):
+    """Return (location, normal, face index, distance) of the point on the surface of obj closest to point, None if it has no faces"""
+    location, normal, face, distance = get_index(obj).bvhtree.find_nearest(Vector(point))
+    if location is None:
+        return None
+    return location, normal, face, distance
+
+def distance(obj, point):
+    """Return distance from point to the surface of obj, infinity if it has no faces"""
+    nearest = closest_point(obj, point)
+    return nearest[3] if nearest is not None else float('inf')
+
+def raycast(obj, origin, direction, max_distance=sys.float_info.max):
+    """Return (location, normal, face index, distance) of the first hit of the ray from origin in direction with obj, None if it misses"""
+    location, normal, face, distance = get_index(obj).bvhtree.ray_cast(Vector(origin), Vector(direction).normalized(),
+                                                                       max_distance)
+    if location is None:
+        return None
+    return location, normal, face, distance
+
+def nearest_vertex(obj, point):
+    """Return (location, vertex index, distance) of the vertex of obj closest to point"""
+    return get_index(obj).kdtree.find(Vector(point))
+
+def vertices_in_range(obj, point, radius):
+    """Return list of (location, vertex index, distance) of the vertices of obj within radius of point"""
+    return get_index(obj).kdtree.find_range(Vector(point), radius)
+
+def weight(obj, point, group=0):
+    """Return weight in vertex group (index or name) of the vertex of obj closest to point, 0 if obj has no vertices"""
+    obj = get_object(obj)
+    index = get_index(obj)
+    if len(index.vertices) == 0:
+        return 0.0
+    location, vertex, distance = index.kdtree.find(Vector(point))
+    return float(index.group_weights(obj, group)[vertex])
+
+def invalidate(obj=None):
+    """Drop the SpatialIndex of obj (object or object name), or of all objects"""
+    if obj is None:
+        indices.clear()
+    else:
+        indices.pop(obj if isinstance(obj, str) else obj.name, None)
+
+@persistent
+def invalidate_updated(scene):
+    """Drop the SpatialIndex of objects whose mesh data was updated, e.g. edited or weight painted"""
+    for name in list(indices):
+        obj = scene.objects.get(name)
+        if obj is not None and obj.is_updated_data:
+            del indices[name]
+
+@persistent
+def clear_indices(dummy=None):
+    """Forget all spatial indices, e.g. when another file is loaded"""
+    indices.clear()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the bpy independent modules are imported directly from the add-on directory, see turtle_kernel
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,19 @@
+"""Comparison of turtle_kernel.InterpretationArrays for tests of interpretations that should give the same result"""
+import numpy as np
+
+def custom_object_names(arrays):
+    """Return custom object name of each module of arrays, None for other modules"""
+    return [arrays.custom_object_names[i] if i >= 0 else None for i in arrays.custom_object_ids]
+
+def assert_modules_equal(arrays, expected, parents=True):
+    """Assert that arrays have the same modules (up to rounding) and queries as expected, optionally ignoring the parents"""
+    assert len(arrays) == len(expected)
+    for name in ('matrices', 'scales', 'widths', 'lengths'):
+        np.testing.assert_allclose(getattr(arrays, name), getattr(expected, name), atol=1e-9, err_msg=name)
+    assert (arrays.materialindices == expected.materialindices).all()
+    assert (arrays.kinds == expected.kinds).all()
+    assert custom_object_names(arrays) == custom_object_names(expected)
+    if parents:
+        assert (arrays.parents == expected.parents).all()
+    assert arrays.query_types == expected.query_types
+    np.testing.assert_allclose(arrays.query_vectors, expected.query_vectors, atol=1e-9)
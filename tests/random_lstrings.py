@@ -0,0 +1,26 @@
+"""Random L-strings for comparing interpretations that should give the same result"""
+
+SYMBOLS = ["F", "F", "F(1.5)", "F(2,0.5)", "f", "f(0.5)", "+", "-(30)", "&", "^(20)", "/", "\\(137.5)", "|",
+           "_", "!", "!(0.3)", ";", ",", ";(2)", "%", "@(1,2,3)",
+           "~(\"Leaf\")", "~(\"Bud\",0.5)", "?(\"P\",0,0,0)", "?(\"H\",0,0,0)", "?(\"U\",0,0,0)"]
+
+def random_commands(rng, length=60, branch_probability=0.15, symbols=SYMBOLS):
+    """Return list of length random commands of symbols (chosen by the random.Random rng) with randomly nested branches, all closed at the end"""
+    commands = []
+    depth = 0
+    for _ in range(length):
+        r = rng.random()
+        if r < branch_probability:
+            commands.append("[")
+            depth += 1
+        elif r < 2*branch_probability and depth > 0:
+            commands.append("]")
+            depth -= 1
+        else:
+            commands.append(rng.choice(symbols))
+    commands.extend("]" * depth)
+    return commands
+
+def random_lstring(rng, length=60, branch_probability=0.15, symbols=SYMBOLS):
+    """Return L-string of random_commands"""
+    return "".join(random_commands(rng, length, branch_probability, symbols))
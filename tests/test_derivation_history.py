@@ -0,0 +1,137 @@
+import random
+import zlib
+
+import derivation_history
+from derivation_history import DerivationHistory
+
+class Tree(list):
+    """Stand-in for lpy.AxialTree: a copy constructor and a text conversion (used outside of Blender)"""
+
+    def __str__(self):
+        return "".join(self)
+
+def lstrings(step, length=200):
+    """Return well compressible L-strings for production and interpretation after step"""
+    return "F" * length + str(step), "F" * length + "~(\"Leaf\")" + str(step)
+
+def random_text(rng, length):
+    """Return hardly compressible text"""
+    return "".join(rng.choice("F+-&^/\\|[]!;") for _ in range(length))
+
+def is_compressed(history, step):
+    return all(isinstance(s, bytes) for s in history.states[step][:2])
+
+def assert_size_consistent(history):
+    assert history.size == sum(derivation_history.state_size(state) for state in history.states.values())
+    assert all(state[2] == derivation_history.state_size(state) for state in history.states.values())
+
+def test_store_get_uncompressed():
+    history = DerivationHistory("key")
+    for step in range(5):
+        history.store(step, *lstrings(step))
+    assert len(history) == 5
+    for step in range(5):
+        assert history.get(step) == lstrings(step)
+        assert not is_compressed(history, step)
+    assert history.get(5) is None
+    assert_size_consistent(history)
+
+def test_least_recently_used_compressed_first():
+    history = DerivationHistory("key", 1000)
+    for step in range(3):
+        history.store(step, *lstrings(step))
+    # the third step exceeds max_bytes, compressing the first is enough
+    assert is_compressed(history, 0)
+    assert not is_compressed(history, 1) and not is_compressed(history, 2)
+    assert history.size <= 1000
+    assert_size_consistent(history)
+    for step in range(3):
+        assert history.get(step) == lstrings(step)
+
+    history = DerivationHistory("key")
+    for step in range(3):
+        history.store(step, *lstrings(step))
+    history.get(0)
+    history.shrink(1000)
+    assert is_compressed(history, 1)
+    assert not is_compressed(history, 0) and not is_compressed(history, 2)
+    assert history.get(1) == lstrings(1)
+
+def test_least_recently_used_dropped_after_compressing_all():
+    rng = random.Random(0)
+    max_bytes = 3000
+    history = DerivationHistory("key", max_bytes)
+    stored = {}
+    for step in range(20):
+        stored[step] = random_text(rng, 400), random_text(rng, 400)
+        history.store(step, *stored[step])
+        assert history.size <= max_bytes
+        assert_size_consistent(history)
+    steps = list(history.states)
+    assert 1 < len(steps) < 20
+    # oldest steps dropped, all others compressed to keep as many as possible
+    assert steps == list(range(20 - len(steps), 20))
+    assert all(is_compressed(history, step) for step in steps[:-1])
+    for step in steps:
+        assert history.get(step) == stored[step]
+
+    history.get(steps[0])
+    history.store(20, random_text(rng, 400), random_text(rng, 400))
+    # the step just read is not dropped before the older ones
+    assert steps[0] in history
+    assert steps[1] not in history
+
+    history.shrink(0)
+    assert len(history) == 0 and history.size == 0
+
+def test_store_replaces_step():
+    history = DerivationHistory("key", 1000)
+    history.store(1, *lstrings(1))
+    history.store(1, *lstrings(2))
+    assert len(history) == 1
+    assert history.get(1) == lstrings(2)
+    assert_size_consistent(history)
+    history.remove(1)
+    history.remove(1)
+    assert len(history) == 0 and history.size == 0
+
+def test_nearest():
+    history = DerivationHistory("key")
+    assert history.nearest(3) is None
+    for step in (0, 2, 5):
+        history.store(step, *lstrings(step))
+    assert [history.nearest(step) for step in range(7)] == [0, 0, 2, 2, 2, 5, 5]
+    history.remove(0)
+    assert history.nearest(1) is None
+
+def test_tree_copied_then_converted_to_text():
+    history = DerivationHistory("key")
+    tree = Tree(["F", "[", "+", "F", "]", "F"])
+    history.store(1, tree, "F[+F]F")
+    tree.append("F")
+    production, interpretation = history.get(1)
+    # a copy is kept and returned, neither is affected by changing the other
+    assert isinstance(production, Tree) and production == Tree("F[+F]F") and production is not tree
+    production.append("F")
+    assert history.get(1)[0] == Tree("F[+F]F")
+    # AxialTree size is estimated by its modules
+    assert history.size == 6 * derivation_history.axialtree_module_bytes + 6
+
+    history.compress(1)
+    assert history.states[1][0] == zlib.compress(b"F[+F]F", 1)
+    assert history.get(1) == ("F[+F]F", "F[+F]F")
+    assert_size_consistent(history)
+
+def test_get_history():
+    derivation_history.clear_histories()
+    history = derivation_history.get_history("Scene", "key", 1000)
+    assert derivation_history.get_history("Scene", "key") is history
+    assert derivation_history.get_history("Scene.001", "key") is not history
+    for step in range(3):
+        history.store(step, *lstrings(step))
+    # a smaller maximum size shrinks the kept history
+    assert derivation_history.get_history("Scene", "key", 500) is history
+    assert history.size <= 500
+    assert derivation_history.get_history("Scene", "other key") is not history
+    derivation_history.clear_histories()
+    assert derivation_history.histories == {}
@@ -0,0 +1,57 @@
+import json
+import numpy as np
+
+import geometry_cache
+import turtle_kernel
+
+LSTRING = "F(2)[+F~(\"Leaf\",0.5)!F][-(30)F;~(\"Bud\")]/(137.5)F~(\"Leaf\")"
+
+def test_store_load_roundtrip(tmp_path):
+    arrays = turtle_kernel.interpret_to_arrays(LSTRING)
+    strings = {'lstring_for_production': LSTRING, 'lstring_for_interpretation': "F(2)[+F]é", 'empty': ""}
+    geometry_cache.store(str(tmp_path), "key", arrays, strings)
+    loaded, loaded_strings = geometry_cache.load(str(tmp_path), "key")
+    assert loaded_strings == strings
+    assert len(loaded) == len(arrays)
+    # transforms are stored in single precision
+    np.testing.assert_allclose(loaded.matrices, arrays.matrices, atol=1e-5)
+    for name in ('scales', 'widths', 'lengths'):
+        np.testing.assert_allclose(getattr(loaded, name), getattr(arrays, name), rtol=1e-6)
+    for name in ('materialindices', 'kinds', 'custom_object_ids', 'parents'):
+        assert (getattr(loaded, name) == getattr(arrays, name)).all()
+        assert getattr(loaded, name).dtype == getattr(arrays, name).dtype
+    assert loaded.custom_object_names == arrays.custom_object_names
+    assert not loaded.parents.flags.writeable
+
+def test_sections_aligned(tmp_path):
+    arrays = turtle_kernel.interpret_to_arrays(LSTRING)
+    path = geometry_cache.store(str(tmp_path), "key", arrays, {'a': "F", 'b': "FF"})
+    with open(path, 'rb') as f:
+        magic, version, header_length, data_offset = geometry_cache.PREFIX.unpack(f.read(geometry_cache.PREFIX.size))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    assert (magic, version) == (geometry_cache.MAGIC, geometry_cache.VERSION)
+    assert data_offset % geometry_cache.ALIGNMENT == 0
+    assert all(section['offset'] % geometry_cache.ALIGNMENT == 0 for section in header['sections'])
+    assert [section['name'] for section in header['sections']][-2:] == ["string:a", "string:b"]
+
+def test_empty_result(tmp_path):
+    arrays = turtle_kernel.interpret_to_arrays("")
+    geometry_cache.store(str(tmp_path), "key", arrays, {})
+    loaded, strings = geometry_cache.load(str(tmp_path), "key")
+    assert len(loaded) == 0 and loaded.matrices.shape == (0, 4, 4) and strings == {}
+
+def test_missing_or_invalid_files(tmp_path):
+    assert geometry_cache.load(str(tmp_path), "missing") is None
+    path = geometry_cache.cache_path(str(tmp_path), "invalid")
+    with open(path, 'wb') as f:
+        f.write(b"not a cache file at all, too short or wrong magic")
+    assert geometry_cache.load(str(tmp_path), "invalid") is None
+    geometry_cache.store(str(tmp_path), "key", turtle_kernel.interpret_to_arrays("F"), {})
+    assert geometry_cache.clear(str(tmp_path)) == 2
+    assert geometry_cache.load(str(tmp_path), "key") is None
+
+def test_cache_key():
+    key = geometry_cache.cache_key("hash", {'angle': 45.0, 'step': 2.0}, 3)
+    assert key == geometry_cache.cache_key("hash", {'step': 2.0, 'angle': 45.0}, 3)
+    assert key != geometry_cache.cache_key("hash", {'angle': 45.0, 'step': 2.0}, 4)
+    assert key != geometry_cache.cache_key("other", {'angle': 45.0, 'step': 2.0}, 3)
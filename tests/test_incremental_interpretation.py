@@ -0,0 +1,92 @@
+import random
+import numpy as np
+
+import incremental_interpretation
+import turtle_kernel
+
+# ids of custom object names, the same for all interpretations like in turtle
+custom_object_name_ids = {}
+
+def interpret(lstring, levels=None):
+    """Return (parents, signatures, is_branch) of the modules of lstring, signatures like DrawingTurtle.get_module_signatures"""
+    arrays = turtle_kernel.interpret_to_arrays(lstring, reuse_subtrees=False)
+    names = np.array([custom_object_name_ids.setdefault(name, len(custom_object_name_ids))
+                      for name in arrays.custom_object_names] + [-1], dtype=np.int64)
+    levels = np.zeros(len(arrays), dtype=np.int64) if levels is None else np.asarray(levels, dtype=np.int64)
+    signatures = arrays.kinds.astype(np.int64) | (levels + 1) << 3 | (names[arrays.custom_object_ids] + 1) << 32
+    return arrays.parents, signatures, arrays.kinds == turtle_kernel.MODULE_NODE
+
+def match(old, new):
+    old_parents, old_signatures, old_is_branch = old
+    new_parents, new_signatures, new_is_branch = new
+    return incremental_interpretation.match_modules(old_parents, old_signatures, new_parents, new_signatures, new_is_branch).tolist()
+
+def test_apex_growth_keeps_modules():
+    # modules: F [ +F ] F  ->  F [ +F F ] F F
+    matches = match(interpret("F[+F]F"), interpret("F[+FF]FF"))
+    assert matches == [0, 1, 2, -1, 3, -1]
+
+def test_removed_middle_branch():
+    # modules: F [ F~A ] [ F~B ] [ F~C ] F  ->  F [ F~A ] [ F~C ] F
+    # branches are aligned by the signatures of their nodes, which are all equal: the last branch reuses
+    # the node and internode of the removed one (they are moved into place), only its custom object is new
+    old = interpret("F[+F~(\"A\")][-F~(\"B\")][&F~(\"C\")]F")
+    matches = match(old, interpret("F[+F~(\"A\")][&F~(\"C\")]F"))
+    assert matches == [0, 1, 2, 3, 4, 5, -1, 10]
+    # the last module of the trunk is still matched when a whole branch is removed
+    assert match(old, interpret("F[+F~(\"A\")]F")) == [0, 1, 2, 3, 10]
+
+def test_changed_level_of_detail():
+    # the second internode changes its level, it cannot be reused but the modules around it still are
+    lstring = "F[+FF]FF"
+    old = interpret(lstring, levels=[0, 0, 0, 0, 0, 0])
+    matches = match(old, interpret(lstring, levels=[0, 0, 1, 0, 0, 0]))
+    assert matches == [0, 1, -1, 3, 4, 5]
+    # a branch node with a new level is not matched, nor are the modules of its branch
+    assert match(old, interpret(lstring, levels=[0, 1, 0, 0, 0, 0])) == [0, -1, -1, -1, 4, 5]
+
+def test_empty_previous_result():
+    assert match(interpret(""), interpret("F[+F]F")) == [-1, -1, -1, -1]
+    assert match(interpret("F[+F]F"), interpret("")) == []
+
+def test_matches_reusable_and_consistent():
+    # matched modules have equal signatures and matched parents, on random changes of random trees
+    from random_lstrings import random_commands
+    rng = random.Random(1)
+    symbols = ["F", "F", "+", "~(\"A\")", "~(\"B\")"]
+    for _ in range(200):
+        commands = random_commands(rng, 40, symbols=symbols)
+        new_commands = list(commands)
+        for _ in range(rng.randint(0, 5)):
+            position = rng.randint(0, len(new_commands))
+            new_commands.insert(position, rng.choice(symbols))
+        old = interpret("".join(commands))
+        new = interpret("".join(new_commands))
+        matches = np.array(match(old, new), dtype=np.int64)
+        matched = np.flatnonzero(matches >= 0)
+        assert (old[1][matches[matched]] == new[1][matched]).all()
+        new_parents = new[0][matched]
+        expected_parents = np.where(new_parents >= 0, matches[new_parents], -1)
+        assert (old[0][matches[matched]] == expected_parents).all()
+        # unchanged trees are matched completely
+        assert match(old, old) == list(range(len(old[0])))
+
+def test_matching_blocks_align_equal_elements():
+    rng = random.Random(0)
+    for _ in range(500):
+        old = np.array([rng.randint(0, 3) for _ in range(rng.randint(0, 30))])
+        new = old.copy()
+        for _ in range(rng.randint(0, 4)):
+            position = rng.randint(0, len(new))
+            if rng.random() < 0.5 and position < len(new):
+                new = np.delete(new, position)
+            else:
+                new = np.insert(new, position, rng.randint(0, 3))
+        blocks = incremental_interpretation.matching_blocks(old, new)
+        old_end = new_end = 0
+        for a, b, size in blocks:
+            assert a >= old_end and b >= new_end
+            assert (old[a:a+size] == new[b:b+size]).all()
+            old_end, new_end = a + size, b + size
+        # an unchanged array is matched as a whole
+        assert incremental_interpretation.matching_blocks(old, old.copy()) == ([(0, 0, len(old))] if len(old) else [(0, 0, 0)])
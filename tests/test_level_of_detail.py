@@ -0,0 +1,51 @@
+import numpy as np
+
+import level_of_detail
+import turtle_kernel
+from level_of_detail import LEVEL_CULLED
+
+# width 1 on the trunk, 0.5 from the second internode on, with branches nested twice
+LSTRING = "F!(0.5)F[+F[-F]]F"
+
+def test_module_depths():
+    arrays = turtle_kernel.interpret_to_arrays(LSTRING)
+    assert level_of_detail.module_depths(arrays).tolist() == [0, 0, 0, 1, 1, 2, 0]
+
+def test_detail_levels():
+    widths = np.array([2.0, 1.0, 0.75, 0.5, 0.3, 0.25, 0.1, 0.05, 0.049, 0.0])
+    levels = level_of_detail.detail_levels(widths, 1.0, 0.05)
+    # one level per halving of the width below full detail, culled below (not at) the cull width
+    assert levels.tolist() == [0, 0, 1, 1, 2, 2, 4, 5, LEVEL_CULLED, LEVEL_CULLED]
+
+def test_detail_levels_without_culling():
+    levels = level_of_detail.detail_levels(np.array([1.0, 1e-3, 0.0]), 1.0, 0.0)
+    assert LEVEL_CULLED not in levels.tolist()
+    assert levels[1] == 10
+
+def test_effective_widths_unchanged():
+    arrays = turtle_kernel.interpret_to_arrays(LSTRING)
+    widths = level_of_detail.effective_widths(arrays)
+    assert widths.tolist() == arrays.widths.tolist()
+    widths *= 2
+    # the module widths are not modified
+    assert arrays.widths.tolist() == [1.0] + [0.5]*6
+
+def test_effective_widths_depth_falloff():
+    arrays = turtle_kernel.interpret_to_arrays(LSTRING)
+    widths = level_of_detail.effective_widths(arrays, depth_falloff=0.5)
+    np.testing.assert_allclose(widths, [1.0, 0.5, 0.5, 0.25, 0.25, 0.125, 0.5])
+    # the nested branch internode is culled only due to the falloff
+    assert level_of_detail.detail_levels(widths, 1.0, 0.2).tolist() == [0, 1, 1, 2, 2, LEVEL_CULLED, 1]
+    assert LEVEL_CULLED not in level_of_detail.detail_levels(arrays.widths, 1.0, 0.2).tolist()
+
+def test_effective_widths_camera_distance():
+    arrays = turtle_kernel.interpret_to_arrays("F(10)F(10)F(10)")
+    camera_position = (0.0, 0.0, -10.0)
+    widths = level_of_detail.effective_widths(arrays, camera_position=camera_position, reference_distance=10.0)
+    # apparent width: full at the reference distance, halved at twice the distance
+    np.testing.assert_allclose(widths, [1.0, 0.5, 1/3])
+    assert level_of_detail.detail_levels(widths, 1.0, 0.4).tolist() == [0, 1, LEVEL_CULLED]
+    # depth falloff and distance combine
+    arrays = turtle_kernel.interpret_to_arrays("F(10)[F(10)]")
+    widths = level_of_detail.effective_widths(arrays, 0.5, camera_position, 10.0)
+    np.testing.assert_allclose(widths, [1.0, 0.5, 0.25])
@@ -0,0 +1,73 @@
+import pytest
+
+import lstring_compiler
+
+def applyCuts(lstring):
+    """Reference: cut handling of the turtle interpretation before cuts were skipped by the compiler"""
+    segments_to_cut = []
+    searching_end_of_branch = False
+    bracketBalance = 0
+    cut_start = cut_end = None
+    for i, c in enumerate(lstring):
+        if searching_end_of_branch:
+            if c == '[':
+                bracketBalance += 1
+            elif c == ']':
+                bracketBalance -= 1
+            if bracketBalance < 0:
+                searching_end_of_branch = False
+                bracketBalance = 0
+                cut_end = i
+                segments_to_cut.append((cut_start, cut_end))
+        elif c == '%':
+            searching_end_of_branch = True
+            cut_start = i
+    if searching_end_of_branch:
+        segments_to_cut.append((cut_start, len(lstring)+1))
+    result = lstring
+    for (start, end) in segments_to_cut:
+        result = result[:start] + '%'*(end-start) + result[end:]
+    return result.replace('%', '')
+
+def compiled_content(compiled):
+    strings = compiled.strings
+    commands = []
+    for opcode, offset, count in zip(compiled.opcodes, compiled.arg_offsets, compiled.arg_counts):
+        args = list(compiled.args[offset:offset+count])
+        if count and opcode in (lstring_compiler.OP_CUSTOM, lstring_compiler.OP_QUERY):
+            args[0] = strings[int(args[0])]
+        commands.append((opcode, tuple(args)))
+    return commands
+
+@pytest.mark.parametrize("lstring", [
+    # cut without closing bracket removes the rest of the string
+    "F(1)[+F(2)%F(3)-F(4)",
+    "F[+F%F[-F]F",
+    # nested branches after a cut are removed with it
+    "F[+F%F[-F[&F]F]F]F(5)",
+    # closing bracket ending the cut branch is kept
+    "F[+F%F]F[-F]",
+    "[[F%F]F]F",
+    # cut at depth 0
+    "F(1)%F(2)[+F]F",
+    "%",
+    "F(1)!(0.5)%]F",
+    # several cuts in one branch
+    "F[+F%F%F]F",
+    "F[+F%F[-F%F]F%F]F[-F%F]F",
+    "[F%F][F%[F]F]%F",
+    # queries and custom objects in and around cut branches
+    "F?(\"P\",0,0,0)[+F%~(\"Leaf\",2)?(\"H\",0,0,0)]~(\"Leaf\")",
+])
+def test_cuts_match_applyCuts(lstring):
+    expected = lstring_compiler.compile_lstring(applyCuts(lstring))
+    assert compiled_content(lstring_compiler.compile_lstring(lstring)) == compiled_content(expected)
+
+def test_cuts_match_applyCuts_random():
+    import random
+    rng = random.Random(0)
+    symbols = ["F", "F(2)", "+", "-(30)", "[", "]", "%", "!", ";"]
+    for _ in range(500):
+        lstring = "".join(rng.choice(symbols) for _ in range(rng.randint(0, 40)))
+        expected = lstring_compiler.compile_lstring(applyCuts(lstring))
+        assert compiled_content(lstring_compiler.compile_lstring(lstring)) == compiled_content(expected), lstring
@@ -0,0 +1,67 @@
+import random
+import pytest
+
+import lstring_compiler
+import parallel_interpretation
+import turtle_kernel
+from interpretation_arrays import assert_modules_equal
+from random_lstrings import random_lstring
+
+def interpret_merged(lstring, processes, groups, rng):
+    """
+    Return interpretation of lstring merged like interpret_to_arrays_parallel,
+    with the branches interpreted in this process in about the given number of random groups
+    """
+    compiled = lstring_compiler.get_compiled(lstring)
+    max_commands = len(compiled) // (processes * parallel_interpretation.tasks_per_process)
+    branches = parallel_interpretation.split_into_branches(compiled, max_commands)
+    trunk = turtle_kernel.interpret_to_arrays(compiled, split_branches=set(start for start, end in branches), reuse_subtrees=False)
+    tasks = [(start, end, state[:3]) for (start, end), state in zip(branches, trunk.split_branch_states)]
+    bounds = sorted(set([0, len(tasks)] + [rng.randint(0, len(tasks)) for _ in range(groups-1)]))
+    parallel_interpretation.shared_compiled = compiled
+    try:
+        branch_groups = [parallel_interpretation.interpret_branches(tasks[start:stop]) for start, stop in zip(bounds, bounds[1:])]
+    finally:
+        parallel_interpretation.shared_compiled = None
+    return parallel_interpretation.merge(trunk, branch_groups)
+
+def test_merge_like_sequential():
+    # shifted trunk modules, remapped parents, renumbered custom objects and interleaved queries
+    rng = random.Random(0)
+    for _ in range(200):
+        lstring = random_lstring(rng, 200, branch_probability=0.2)
+        assert_modules_equal(interpret_merged(lstring, 2, 3, rng), turtle_kernel.interpret_to_arrays(lstring))
+
+@pytest.mark.skipif(not parallel_interpretation.can_fork(), reason="worker processes cannot be forked")
+@pytest.mark.parametrize("yield_commands", [None, 50])
+def test_parallel_like_sequential(monkeypatch, yield_commands):
+    monkeypatch.setattr(parallel_interpretation, 'min_parallel_commands', 0)
+    rng = random.Random(1)
+    for _ in range(5):
+        lstring = random_lstring(rng, 1000, branch_probability=0.2)
+        steps = parallel_interpretation.interpret_to_arrays_parallel_steps(lstring, 3, yield_commands=yield_commands)
+        assert_modules_equal(turtle_kernel.run_steps(steps), turtle_kernel.interpret_to_arrays(lstring))
+
+def test_split_into_branches_disjoint():
+    compiled = lstring_compiler.get_compiled(random_lstring(random.Random(2), 2000, branch_probability=0.2))
+    branches = parallel_interpretation.split_into_branches(compiled, 50)
+    ends = compiled.branch_ends()
+    for (start, end), (next_start, next_end) in zip(branches, branches[1:]):
+        assert end < next_start
+    for start, end in branches:
+        assert compiled.opcodes[start] == lstring_compiler.OP_PUSH and ends[start] == end
+
+@pytest.mark.skipif(not parallel_interpretation.can_fork(), reason="worker processes cannot be forked")
+@pytest.mark.parametrize("source, forked", [
+    ("import random\nAxiom: F\n", True),
+    ("# import bpy\nAxiom: F\n", True),
+    ("import bpy\nAxiom: F\n", False),
+    ("import random\nfrom lindenmaker import spatial_queries\n", False),
+    ("  import mathutils\n", False),
+])
+def test_no_fork_for_lpyfile_importing_blender(tmp_path, source, forked):
+    lpyfile = tmp_path / "model.lpy"
+    lpyfile.write_text(source)
+    assert parallel_interpretation.can_fork(str(lpyfile)) == forked
+    # files that cannot be read do not prevent forking
+    assert parallel_interpretation.can_fork(str(tmp_path / "missing.lpy"))
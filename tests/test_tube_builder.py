@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import tube_builder
+import turtle_kernel
+
+def build_rings(lstring, ring_vertex_count=8, **options):
+    arrays = turtle_kernel.interpret_to_arrays(lstring, **options)
+    co, loops, loop_total, materialindices = tube_builder.build_tubes(arrays, ring_vertex_count)
+    return arrays, co.reshape(-1, ring_vertex_count, 3)
+
+def test_rings_at_scaled_internode_ends():
+    # joints and the chain end are at the end of the preceding internode scaled by the internode length scale
+    arrays, rings = build_rings("F(2)F(3)", internode_length_scale=0.5)
+    heading = arrays.matrices[0,:3,0]
+    start = arrays.matrices[0,:3,3]
+    assert np.allclose(rings.mean(axis=1), [start, start + 1*heading, start + 3.5*heading])
+
+@pytest.mark.parametrize("roll", [137.5, 180, 90, -45])
+def test_roll_does_not_twist_straight_tube(roll):
+    arrays, rings = build_rings("F(2)/({})F(2)".format(roll))
+    edges = np.linalg.norm(rings[1:] - rings[:-1], axis=2)
+    assert np.allclose(edges, 2.0)
+
+def test_roll_does_not_change_bent_tube():
+    # the rings only depend on the headings: rolling before a bend gives the same tube
+    # as rolling, bending and rolling back at the joint
+    arrays, rings = build_rings("F(2)+(30)F(2)/(137.5)F(2)&(40)F(2)")
+    arrays, unrolled = build_rings(r"F(2)+(30)F(2)F(2)/(137.5)&(40)\(137.5)F(2)")
+    assert np.allclose(rings, unrolled)
@@ -0,0 +1,108 @@
+import random
+import pytest
+
+import turtle_kernel
+from interpretation_arrays import assert_modules_equal
+from random_lstrings import SYMBOLS, random_commands, random_lstring
+
+# commands that do not depend on the absolute turtle state, see reuse_subtrees of turtle_kernel.interpret_to_arrays_steps
+SYMBOLS_WITHOUT_WORLD = [symbol for symbol in SYMBOLS if symbol[0] not in "@?"]
+
+def module_tail(arrays, n):
+    """Return InterpretationArrays of the last n modules of arrays, parents not adjusted"""
+    tail = turtle_kernel.InterpretationArrays(0)
+    for name in ('matrices', 'scales', 'widths', 'lengths', 'materialindices', 'kinds', 'custom_object_ids', 'parents'):
+        setattr(tail, name, getattr(arrays, name)[len(arrays)-n:])
+    tail.count = n
+    tail.custom_object_names = arrays.custom_object_names
+    tail.query_types = arrays.query_types
+    tail.query_vectors = arrays.query_vectors
+    return tail
+
+def query_result(query, value):
+    """Return query command, e.g. ?("P",0,0,0), with the given value as result"""
+    return '{},{},{},{})'.format(query[:5], value, -value, 0.5)
+
+def test_checkpoints_resume_like_full_run():
+    # like the dry runs of consecutive production steps: the L-string changes at some point,
+    # and the values of earlier queries were replaced by their results
+    rng = random.Random(0)
+    resumed_count = 0
+    for _ in range(100):
+        checkpoints = turtle_kernel.TurtleCheckpoints(interval=rng.randint(1, 20))
+        commands = random_commands(rng, 150)
+        for step in range(4):
+            lstring = "".join(commands)
+            resumed = turtle_kernel.interpret_to_arrays(lstring, queries_only=True, checkpoints=checkpoints)
+            full = turtle_kernel.interpret_to_arrays(lstring, queries_only=True)
+            # modules before the command the interpretation resumed at are not in the result
+            assert_modules_equal(resumed, module_tail(full, len(resumed)), parents=False), lstring
+            resumed_count += checkpoints.resumed_at > 0
+            position = rng.randint(0, len(commands))
+            commands = ([query_result(c, step) if c.startswith("?") else c for c in commands[:position]]
+                        + [rng.choice(SYMBOLS) for _ in range(rng.randint(1, 3))] + commands[position:])
+    assert resumed_count > 100
+
+def test_checkpoints_not_used_after_option_change():
+    checkpoints = turtle_kernel.TurtleCheckpoints(interval=2)
+    lstring = "F[+F?(\"P\",0,0,0)]F(2)F?(\"P\",0,0,0)"
+    turtle_kernel.interpret_to_arrays(lstring, queries_only=True, checkpoints=checkpoints)
+    resumed = turtle_kernel.interpret_to_arrays(lstring, queries_only=True, checkpoints=checkpoints, default_length=3.0)
+    assert checkpoints.resumed_at == 0
+    assert_modules_equal(resumed, turtle_kernel.interpret_to_arrays(lstring, queries_only=True, default_length=3.0))
+
+def count_copies(monkeypatch):
+    """Return list that collects the start of every copied branch of InterpretationArrays.add_copy"""
+    copies = []
+    add_copy = turtle_kernel.InterpretationArrays.add_copy
+    def counted_add_copy(self, start, end, transform, parent):
+        copies.append(start)
+        return add_copy(self, start, end, transform, parent)
+    monkeypatch.setattr(turtle_kernel.InterpretationArrays, 'add_copy', counted_add_copy)
+    return copies
+
+def repeated_branches_lstring(rng, symbols):
+    """Return L-string with a random branch repeated at random places, in different turtle states and nested in itself"""
+    branch = "[" + random_lstring(rng, 20, symbols=symbols) + "]"
+    return "".join(rng.choice([branch, branch, "[" + branch + "F" + branch + "]"] + SYMBOLS_WITHOUT_WORLD)
+                   for _ in range(30))
+
+def test_reuse_subtrees_like_interpretation(monkeypatch):
+    copies = count_copies(monkeypatch)
+    rng = random.Random(0)
+    for _ in range(100):
+        lstring = repeated_branches_lstring(rng, SYMBOLS_WITHOUT_WORLD)
+        reused = turtle_kernel.interpret_to_arrays(lstring, reuse_subtrees=True)
+        assert_modules_equal(reused, turtle_kernel.interpret_to_arrays(lstring, reuse_subtrees=False))
+    assert len(copies) > 100
+
+@pytest.mark.parametrize("world_dependent", ["@(1,2,3)", "?(\"P\",0,0,0)"])
+def test_reuse_subtrees_excludes_world_dependent_branches(monkeypatch, world_dependent):
+    copies = count_copies(monkeypatch)
+    rng = random.Random(1)
+    branch = "[" + random_lstring(rng, 20, symbols=SYMBOLS_WITHOUT_WORLD) + world_dependent + "F]"
+    lstring = "F" + branch + "+F(2)" + branch + "/(30)F" + branch
+    reused = turtle_kernel.interpret_to_arrays(lstring, reuse_subtrees=True)
+    assert copies == []
+    assert_modules_equal(reused, turtle_kernel.interpret_to_arrays(lstring, reuse_subtrees=False))
+    # without the world dependent command, the repeated branches are copied
+    turtle_kernel.interpret_to_arrays(lstring.replace(world_dependent, ""), reuse_subtrees=True)
+    assert len(copies) == 2
+
+ROTATION_SYMBOLS = ["+", "-(30)", "&", "^(20)", "/", "\\(137.5)", "|", "+(0.5)", "-"]
+
+def test_rotation_run_ends():
+    compiled = turtle_kernel.lstring_compiler.get_compiled("+-F&^[/\\|]?(\"P\",0,0,0)+|F+")
+    assert turtle_kernel.rotation_run_ends(compiled) == [1, -1, -1, 4, -1, -1, 8, -1, -1, -1, -1, 12, -1, -1, -1]
+
+@pytest.mark.parametrize("default_angle", [45.0, 30.0])
+def test_rotation_runs_like_rotating_per_command(default_angle):
+    # runs of rotations broken by branches, queries and moves, separated by f(0) the rotations are done one by one.
+    # '@' is left out: it is ill-conditioned when the up vector points at the target, where rounding decides the result
+    rng = random.Random(0)
+    symbols = ROTATION_SYMBOLS * 3 + ["F", "f(0.5)", "?(\"H\",0,0,0)", "?(\"U\",0,0,0)", "~(\"Leaf\")"]
+    for _ in range(200):
+        commands = random_commands(rng, 80, symbols=symbols)
+        composed = turtle_kernel.interpret_to_arrays("".join(commands), default_angle=default_angle)
+        separate = turtle_kernel.interpret_to_arrays("f(0)".join(commands), default_angle=default_angle)
+        assert_modules_equal(composed, separate)
@@ -0,0 +1,139 @@
+import numpy as np
+
+try:
+    from lindenmaker.turtle_kernel import MODULE_INTERNODE
+except ImportError:
+    # imported outside of Blender, see turtle_kernel
+    from turtle_kernel import MODULE_INTERNODE
+
+# maximum distance between end of an internode and start of the next one to weld them
+weld_distance = 1e-5
+
+def find_internode_chains(arrays):
+    """
+    Return indices of internode modules and for each of them the position (within these indices)
+    of the preceding internode of its unbranched chain, -1 if it starts a chain.
+    An internode continues a chain if it is the next internode on the same branch
+    and starts where the preceding one ends (i.e. the turtle did not move without drawing).
+    """
+    internodes = np.flatnonzero(arrays.kinds == MODULE_INTERNODE)
+    predecessors = np.full(len(internodes), -1, dtype=np.int64)
+    last_internode_on_branch = {}
+    for n, (i, parent) in enumerate(zip(internodes, arrays.parents[internodes])):
+        predecessors[n] = last_internode_on_branch.get(parent, -1)
+        last_internode_on_branch[parent] = n
+    starts = arrays.matrices[internodes,:3,3]
+    ends = starts + arrays.matrices[internodes,:3,0] * arrays.lengths[internodes,np.newaxis]
+    has_predecessor = predecessors >= 0
+    gaps = np.linalg.norm(ends[predecessors[has_predecessor]] - starts[has_predecessor], axis=1)
+    predecessors[np.flatnonzero(has_predecessor)[gaps > weld_distance]] = -1
+    return internodes, predecessors
+
+def normalized(vectors):
+    """Return row vectors normalized to unit length (zero vectors stay zero)"""
+    lengths = np.linalg.norm(vectors, axis=1)
+    lengths[lengths == 0] = 1
+    return vectors / lengths[:,np.newaxis]
+
+def minimal_rotations(vectors, sources, targets):
+    """
+    Return row vectors rotated by the smallest rotations taking the unit source vectors onto the unit target vectors.
+    Vectors are left as they are where source and target are opposite.
+    """
+    cos = np.sum(sources*targets, axis=1)
+    axes = np.cross(sources, targets)
+    opposite = cos < -1 + 1e-9
+    factors = np.sum(axes*vectors, axis=1) / np.where(opposite, 1, 1 + cos)
+    rotated = vectors*cos[:,np.newaxis] + np.cross(axes, vectors) + axes*factors[:,np.newaxis]
+    rotated[opposite] = vectors[opposite]
+    return rotated
+
+def build_tubes(arrays, ring_vertex_count):
+    """
+    Return geometry of welded tubes along the unbranched internode chains of the given InterpretationArrays,
+    as vertex positions (V x 3), polygon loop vertex indices, loop totals and turtle material index per polygon.
+    Consecutive internodes share one ring of vertices at the end of the preceding internode,
+    placed in the plane bisecting their headings.
+    Ring radius follows the internode width at the start of each internode.
+    Tubes are only capped at the ends of chains.
+    """
+    internodes, predecessors = find_internode_chains(arrays)
+    m = len(internodes)
+    if m == 0:
+        return np.empty((0, 3)), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    successors = np.full(m, -1, dtype=np.int64)
+    successors[predecessors[predecessors >= 0]] = np.flatnonzero(predecessors >= 0)
+    matrices = arrays.matrices[internodes]
+    headings = matrices[:,:3,0]
+    lefts = matrices[:,:3,1]
+    widths = arrays.scales[internodes,1]
+
+    # one ring at the start of every internode, plus one at the end of every chain.
+    # rings are placed at the end of the preceding internode scaled by the internode length scale (see turtle_kernel),
+    # so a chain covers the same length as its internodes drawn separately
+    chain_ends = np.flatnonzero(successors < 0)
+    scaled_ends = matrices[:,:3,3] + headings*arrays.scales[internodes,0,np.newaxis]
+    ring_centers = matrices[:,:3,3].copy()
+    joints = np.flatnonzero(predecessors >= 0)
+    ring_centers[joints] = scaled_ends[predecessors[joints]]
+    ring_centers = np.concatenate((ring_centers, scaled_ends[chain_ends]))
+    ring_radii = np.concatenate((widths, widths[chain_ends])) / 2
+    # ring normal at joints is the bisector of both headings
+    ring_normals = headings.copy()
+    bisectors = normalized(headings[joints] + headings[predecessors[joints]])
+    straight_back = np.linalg.norm(bisectors, axis=1) == 0
+    ring_normals[joints[~straight_back]] = bisectors[~straight_back]
+    ring_normals = np.concatenate((ring_normals, headings[chain_ends]))
+    turtle_lefts = np.concatenate((lefts, lefts[chain_ends]))
+    turtle_lefts = normalized(turtle_lefts - ring_normals * np.sum(turtle_lefts*ring_normals, axis=1)[:,np.newaxis])
+
+    # the turtle left vectors roll with the turtle (e.g. via '/'), which would twist the quads between rings.
+    # instead the left vector of the first ring of a chain is carried along it (parallel transport):
+    # the left vector of a ring is the one of the preceding ring, rotated minimally onto its normal.
+    # this differs from the turtle left vector by a roll angle around the normal, accumulated along the chain
+    # from the roll of each ring against the turtle left vector of the preceding ring carried onto it.
+    ring_predecessors = np.concatenate((predecessors, chain_ends))
+    has_predecessor = np.flatnonzero(ring_predecessors >= 0)
+    carried = minimal_rotations(turtle_lefts[ring_predecessors[has_predecessor]],
+                                ring_normals[ring_predecessors[has_predecessor]], ring_normals[has_predecessor])
+    rolls = np.zeros(len(ring_normals))
+    rolls[has_predecessor] = np.arctan2(np.sum(ring_normals[has_predecessor]
+                                               * np.cross(turtle_lefts[has_predecessor], carried), axis=1),
+                                        np.sum(turtle_lefts[has_predecessor]*carried, axis=1))
+    # predecessors come first, both among internodes and for the end rings after them
+    roll_angles = rolls.tolist()
+    for r, p in enumerate(ring_predecessors.tolist()):
+        if p >= 0:
+            roll_angles[r] += roll_angles[p]
+    roll_angles = np.array(roll_angles)[:,np.newaxis]
+    ring_lefts = turtle_lefts*np.cos(roll_angles) + np.cross(ring_normals, turtle_lefts)*np.sin(roll_angles)
+    ring_ups = np.cross(ring_normals, ring_lefts)
+
+    # ring vertices, around the normal from left to up like the default internode cylinder
+    angles = np.linspace(0, 2*np.pi, ring_vertex_count, endpoint=False)
+    co = (ring_centers[:,np.newaxis,:]
+          + ring_radii[:,np.newaxis,np.newaxis] * (np.cos(angles)[np.newaxis,:,np.newaxis] * ring_lefts[:,np.newaxis,:]
+                                                 + np.sin(angles)[np.newaxis,:,np.newaxis] * ring_ups[:,np.newaxis,:]))
+
+    # side quads of every internode between its start ring and the start ring of its successor
+    # or its own end ring at the end of a chain
+    end_rings = successors.copy()
+    end_rings[chain_ends] = m + np.arange(len(chain_ends))
+    k = np.arange(ring_vertex_count)
+    k_next = (k+1) % ring_vertex_count
+    start_ring_offsets = (np.arange(m) * ring_vertex_count)[:,np.newaxis]
+    end_ring_offsets = (end_rings * ring_vertex_count)[:,np.newaxis]
+    quads = np.stack((start_ring_offsets + k, start_ring_offsets + k_next,
+                      end_ring_offsets + k_next, end_ring_offsets + k), axis=2).reshape(-1, 4)
+    # caps at chain starts (facing backwards) and chain ends
+    chain_starts = np.flatnonzero(predecessors < 0)
+    start_caps = (chain_starts * ring_vertex_count)[:,np.newaxis] + k[::-1]
+    end_caps = (end_rings[chain_ends] * ring_vertex_count)[:,np.newaxis] + k
+
+    materialindices = arrays.materialindices[internodes]
+    loops = np.concatenate((quads.ravel(), start_caps.ravel(), end_caps.ravel())).astype(np.int32)
+    loop_total = np.concatenate((np.full(len(quads), 4), np.full(len(chain_starts)+len(chain_ends), ring_vertex_count))).astype(np.int32)
+    polygon_materialindices = np.concatenate((np.repeat(materialindices, ring_vertex_count),
+                                              materialindices[chain_starts],
+                                              materialindices[chain_ends])).astype(np.int32)
+    return co.reshape(-1, 3), loops, loop_total, polygon_materialindices
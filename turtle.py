@@ -1,93 +1,73 @@
 import bpy
+import numpy as np
 from math import radians
-from mathutils import Vector, Matrix
+from mathutils import Matrix
 
 from lindenmaker.turtle_interpretation_error import TurtleInterpretationError
+from lindenmaker import mesh_builder
+from lindenmaker import instance_builder
+from lindenmaker import tube_builder
+from lindenmaker import level_of_detail
+from lindenmaker import incremental_interpretation
+from lindenmaker.level_of_detail import LEVEL_CULLED
+from lindenmaker.turtle_kernel import MODULE_INTERNODE, MODULE_NODE, MODULE_CUSTOM
+# also used for the generators drawing in steps, e.g. DrawingTurtle.draw_steps
+from lindenmaker.turtle_kernel import run_steps
+import imp
+imp.reload(mesh_builder)
+imp.reload(instance_builder)
+imp.reload(tube_builder)
+imp.reload(level_of_detail)
+imp.reload(incremental_interpretation)
 
-class Turtle:
-    """This is the base class of the turtle that does not create any objects, but can be used to perform a dry-run interpretation to query the turtle state at different moments"""
-    
-    def __init__(self, _linewidth, _materialindex):
-        # turtle state consists of a 4x4 matrix and some drawing attributes
-        self.mat = Matrix()
-        self.linewidth = _linewidth
-        self.materialindex = _materialindex
-        # stack to save and restore turtle state
-        self.stack = []
-        # rotate such that heading is in +Z (we want to grow upwards in blender)
-        # we thus have heading = +Z, left = -Y, up = +X
-        self.mat *= Matrix.Rotation(radians(270), 4, 'Y') 
-        
-    def push(self):
-        """Push turtle state to stack"""
-        # push state to stack
-        self.stack.append((self.mat.copy(), self.linewidth, self.materialindex))
-        
-    def pop(self):
-        """Pop last turtle state from stack and use as current"""
-        (self.mat, self.linewidth, self.materialindex) = self.stack.pop()
+# number of modules drawn between progress updates of DrawingTurtle.draw_steps
+draw_chunk_size = 1000
 
-    def move(self, stepsize):
-        """Move turtle in its heading direction."""
-        vec = self.mat * Vector((stepsize,0,0,0))
-        self.mat.col[3] += vec 
-        
-    def turn(self, angle_degrees):
-        self.mat *= Matrix.Rotation(radians(angle_degrees), 4, 'Z')
-    def pitch(self, angle_degrees):
-        self.mat *= Matrix.Rotation(radians(angle_degrees), 4, 'Y')
-    def roll(self, angle_degrees):
-        self.mat *= Matrix.Rotation(radians(angle_degrees), 4, 'X')
-        
-    def look_at(self, target):
-        """
-        Let turtle look at a given 3D targed vector point.
-        The heading vector will point toward x, y, z 
-        and the heading, up, and left vectors will have the same
-        relative orientation (handedness) as before.
-        """
-        turtle_pos = self.mat.col[3].xyz
-        turtle_to_target = target - turtle_pos
-        turtle_to_target.normalize()
-        result_mat = Matrix()
-        
-        # position stays same
-        result_mat.col[3] = self.mat.col[3]
-        
-        # heading towards target
-        result_mat.col[0] = turtle_to_target.resized(4)
-        
-        # use old up vector to compute orthogonal left vector
-        # the cross product defaults to right hand order but we store a left vector
-        # thus we negate the cross product vector
-        old_up = self.mat.col[1].xyz.normalized()
-        left = Vector.cross(old_up, turtle_to_target).normalized()
-        result_mat.col[2] = left.resized(4)
-        
-        # compute new up vector from left and heading vector
-        # since the left and new up vectors were constructed using the same left hand order
-        # the left hand order is preserved. 
-        result_mat.col[1] = Vector.cross(left, turtle_to_target).normalized().resized(4)
+# last hierarchy drawn in each scene (by scene name), see DrawingTurtle.update_hierarchy
+hierarchy_states = {}
+# ids of custom object names used in module signatures, stable across interpretations
+custom_object_name_ids = {}
+
+class HierarchyState:
+    """Objects of a drawn hierarchy and the module data they were created from, to update the hierarchy incrementally"""
     
-        self.mat = result_mat
-        
-    def draw_internode_module(self, length=None, width=None):
-        """DELIBERATRELY NOT IMPLEMENTED"""
-        pass
+    def __init__(self, root, objects, arrays, signatures, worlds, settings):
+        self.root = root
+        self.objects = objects
+        # copies, since the arrays can be views of a memory-mapped geometry cache file, which must not be kept open
+        self.parents = arrays.parents.copy()
+        self.materialindices = arrays.materialindices.copy()
+        self.signatures = signatures
+        self.worlds = worlds
+        self.settings = settings
     
-    def draw_module_from_custom_object(self, objname=None, objscale=None):
-        """DELIBERATRELY NOT IMPLEMENTED"""
-        pass
+    def is_valid(self):
+        """Return whether all objects of the hierarchy still exist in the scene"""
+        try:
+            return self.root.users > 0 and all(obj.users > 0 for obj in self.objects)
+        except ReferenceError:
+            # removed, e.g. by undo
+            return False
+
+def hierarchy_settings(scene):
+    """Return the scene settings that objects of a hierarchy depend on, besides the modules themselves"""
+    return (scene.internode_mesh_name, scene.node_mesh_name, scene.bool_force_shade_flat,
+            scene.default_internode_cylinder_vertices, scene.default_node_icosphere_subdivisions)
 
+def can_update_hierarchy(scene, root):
+    """Return whether the hierarchy of root, drawn last in scene, can be updated incrementally by the next drawing"""
+    state = hierarchy_states.get(scene.name)
+    return (scene.output_mode == 'HIERARCHY' and not scene.bool_recreate_default_meshes
+            and state is not None and state.root == root
+            and state.settings == hierarchy_settings(scene) and state.is_valid())
 
-class DrawingTurtle(Turtle):
-    """Subtype of the Turtle base class with implemented drawing functions"""
+class DrawingTurtle:
+    """Creates the Blender objects for the modules computed by the turtle interpretation kernel (see turtle_kernel.interpret_to_arrays)"""
     
-    def __init__(self, _linewidth, _materialindex):
-        super().__init__(_linewidth, _materialindex)
-        
+    def __init__(self):
         scene = bpy.context.scene
-        self.current_parent = None # parent of objects on current branch
+        # lower detail meshes already recreated on user request during this interpretation
+        self.recreated_lod_meshes = set()
         
         # get mesh used to draw internodes (mesh reuse to save memory)
         default_internode_mesh_name = bpy.types.Scene.internode_mesh_name[1]['default']
@@ -121,127 +101,367 @@ class DrawingTurtle(Turtle):
             scene.node_mesh_name = default_node_mesh_name
         self.node_mesh = bpy.data.meshes[scene.node_mesh_name]
         
-        # init root node
-        if bpy.context.scene.bool_no_hierarchy:
-            # create empty mesh with no vertices to join with subsequent objects
-            bpy.ops.mesh.primitive_plane_add()
-            root = bpy.context.object
-            root.data.name = "Root"
-            root.data.use_auto_smooth = True
-            root.data.auto_smooth_angle = radians(85)
-            bpy.ops.object.mode_set(mode = 'EDIT')
-            bpy.ops.mesh.select_all(action = 'SELECT')
-            bpy.ops.mesh.delete()
-            bpy.ops.object.mode_set(mode = 'OBJECT')
+    def draw(self, arrays, update_root=None):
+        """Draw all modules of the given turtle_kernel.InterpretationArrays"""
+        run_steps(self.draw_steps(arrays, update_root))
+    
+    def draw_steps(self, arrays, update_root=None):
+        """
+        Generator drawing all modules of the given turtle_kernel.InterpretationArrays in chunks,
+        yielding the number of modules done so far after each chunk, e.g. to update progress in between.
+        If it is closed before the end, objects created so far are removed again.
+        If update_root is given (see can_update_hierarchy), its hierarchy is updated instead of drawing a new one.
+        """
+        scene = bpy.context.scene
+        self.levels = self.get_detail_levels(arrays)
+        output_mode = scene.output_mode
+        state = hierarchy_states.pop(scene.name, None)
+        if update_root is not None:
+            yield from self.update_hierarchy(arrays, state)
+        elif output_mode == 'SINGLE_OBJECT':
+            yield from self.draw_single_object(arrays)
+        elif output_mode == 'INSTANCED':
+            yield from self.draw_instanced(arrays)
         else:
-            bpy.ops.object.empty_add(type='ARROWS', radius=0)
-        self.root = self.current_parent = bpy.context.object
-        bpy.ops.object.select_all(action='DESELECT')
-        
-    def push(self):
-        """Push turtle state to stack and place draw node object as parent for subsequent cylinders"""
-        # push state to stack
-        self.stack.append((self.mat.copy(), self.linewidth, self.materialindex, self.current_parent))
-        if not bpy.context.scene.bool_no_hierarchy:
-            if bpy.context.scene.bool_draw_nodes:
-                # add node object as new parent for objects on this branch
-                nodeobj = self.draw_node_module(scalefactor=self.linewidth)
-                nodeobj.name = "Node"
-                self.current_parent = nodeobj
-            else:
-                # add empty as new parent for objects on this branch
-                bpy.ops.object.empty_add(type='ARROWS', radius=0)
-                empty = bpy.context.object
-                empty.name = "Node"
-                empty.matrix_world *= self.mat
-                self.add_child_to_current_branch_parent(empty)
-                self.current_parent = empty
-                bpy.ops.object.select_all(action='DESELECT')
-        elif bpy.context.scene.bool_draw_nodes:
-            # just draw nodes without hierarchy
-            self.draw_node_module(scalefactor=self.linewidth)
-        
-    def pop(self):
-        """Pop last turtle state from stack and use as current"""
-        (self.mat, self.linewidth, self.materialindex, self.current_parent) = self.stack.pop()
-        
-    def draw_internode_module(self, length, width=None):
-        """Draw internode object instance in current turtle coordinate system."""
-        if width is None:
-            width = self.linewidth
+            yield from self.draw_hierarchy(arrays)
+    
+    def get_detail_levels(self, arrays):
+        """Return detail level of every module, all 0 (full detail) if adaptive level of detail is disabled"""
         scene = bpy.context.scene
-        self.draw_module(self.internode_mesh, 
-                         "Internode", 
-                         scale=Vector((length*scene.internode_length_scale, width, width)),
-                         assign_material_by_index=True)
-                         
-    def draw_node_module(self, scalefactor=1):
-        """Draw node object instance in current turtle coordinate system."""
-        return self.draw_module(self.node_mesh, 
-                         "Node", 
-                         scale=Vector((scalefactor, scalefactor, scalefactor)),
-                         assign_material_by_index=True)
+        if not scene.bool_lod:
+            return np.zeros(len(arrays), dtype=np.int32)
+        camera_position = None
+        if scene.bool_lod_camera and scene.camera is not None:
+            camera_position = scene.camera.matrix_world.translation
+        widths = level_of_detail.effective_widths(arrays, scene.lod_depth_falloff,
+                                                  camera_position, scene.lod_reference_distance)
+        return level_of_detail.detail_levels(widths, scene.lod_full_detail_width, scene.lod_cull_width)
     
-    def draw_module_from_custom_object(self, objname, objscale=Vector((1, 1, 1))):
-        """Add custom object instance in current turtle coordinate system."""
-        # get object data (mesh) for drawing
-        # dont add material, object can be edited itself
+    def get_module_mesh(self, arrays, i):
+        """Return mesh and object name used to draw module i, according to its detail level"""
+        kind = arrays.kinds[i]
+        if kind == MODULE_INTERNODE:
+            return self.get_internode_mesh(self.levels[i]), "Internode"
+        elif kind == MODULE_NODE:
+            return self.get_node_mesh(self.levels[i]), "Node"
+        # get object data (mesh) of custom object
+        objname = arrays.custom_object_names[arrays.custom_object_ids[i]]
         if objname not in bpy.data.objects.keys():
             raise TurtleInterpretationError("Error using '~' draw custom object command: No object named '{}'. Example usage: ~(\"Object\")".format(objname))
-        self.draw_module(bpy.data.objects[objname].data, name=objname, scale=objscale)
+        return bpy.data.objects[objname].data, objname
     
-    def draw_module(self, 
-                    mesh, 
-                    name="Module", 
-                    scale=Vector((1, 1, 1)), 
-                    assign_material_by_index=False):
-        """Add object instance from given shared mesh in current turtle coordinate system."""
+    def get_internode_mesh(self, level):
+        """
+        Return internode mesh for the given detail level.
+        Lower detail levels of the default cylinder have half the vertices per level (at least 3),
+        culled internodes are drawn as a single quad. Custom internode meshes are only replaced when culled.
+        """
         scene = bpy.context.scene
-        obj = bpy.data.objects.new(name, mesh) # create new object sharing the given mesh data
-        scene.objects.link(obj)
-        scene.objects.active = obj
-        obj.select = True
-        # optionally set shading
-        if scene.bool_force_shade_flat:
-            bpy.ops.object.shade_flat()
+        if level == LEVEL_CULLED:
+            return self.get_internode_card_mesh()
+        default_internode_mesh_name = bpy.types.Scene.internode_mesh_name[1]['default']
+        if level == 0 or self.internode_mesh.name != default_internode_mesh_name:
+            return self.internode_mesh
+        vertex_count = max(3, scene.default_internode_cylinder_vertices >> level)
+        name = "{}.LOD{}".format(default_internode_mesh_name, vertex_count)
+        if name not in bpy.data.meshes.keys() or scene.bool_recreate_default_meshes and name not in self.recreated_lod_meshes:
+            if name in bpy.data.meshes.keys():
+                self.deprecate_lod_mesh(bpy.data.meshes[name])
+            self.create_default_internode_mesh(vertex_count, name)
+            self.recreated_lod_meshes.add(name)
+        return bpy.data.meshes[name]
+    
+    def get_node_mesh(self, level):
+        """Return node mesh for the given detail level, lower levels of the default icosphere have fewer subdivisions"""
+        scene = bpy.context.scene
+        default_node_mesh_name = bpy.types.Scene.node_mesh_name[1]['default']
+        if level <= 0 or self.node_mesh.name != default_node_mesh_name:
+            return self.node_mesh
+        subdivisions = max(1, scene.default_node_icosphere_subdivisions - level)
+        if subdivisions == scene.default_node_icosphere_subdivisions:
+            return self.node_mesh
+        name = "{}.LOD{}".format(default_node_mesh_name, subdivisions)
+        if name not in bpy.data.meshes.keys() or scene.bool_recreate_default_meshes and name not in self.recreated_lod_meshes:
+            if name in bpy.data.meshes.keys():
+                self.deprecate_lod_mesh(bpy.data.meshes[name])
+            self.create_default_node_mesh(subdivisions, name)
+            self.recreated_lod_meshes.add(name)
+        return bpy.data.meshes[name]
+    
+    def deprecate_lod_mesh(self, mesh):
+        """Release outdated level of detail mesh being recreated: removed if unused, otherwise renamed and freed with its last user"""
+        mesh.use_fake_user = False
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
         else:
-            bpy.ops.object.shade_smooth()
-        # optionally create material slot and assign material from given materialindex
+            mesh.name = mesh.name+".DEPRECATED"
+    
+    def get_internode_card_mesh(self):
+        """Return single quad mesh along the heading, used to draw culled internodes"""
+        name = bpy.types.Scene.internode_mesh_name[1]['default']+".Card"
+        if name not in bpy.data.meshes.keys():
+            card = bpy.data.meshes.new(name)
+            card.from_pydata([(0,-0.5,0), (1,-0.5,0), (1,0.5,0), (0,0.5,0)], [], [(0,1,2,3)])
+            card.update()
+            card.use_fake_user = True
+        return bpy.data.meshes[name]
+    
+    def create_mesh(self, arrays, name):
+        """Return a new mesh joining all modules like single object output, without creating an object"""
+        self.levels = self.get_detail_levels(arrays)
+        return run_steps(self.collect_single_object(arrays)).build_mesh(name)
+    
+    def draw_single_object(self, arrays):
+        """Generator creating a single object with the joined mesh of all modules, yielding progress like draw_steps"""
+        builder = yield from self.collect_single_object(arrays)
+        self.root = builder.build("Root")
+    
+    def collect_single_object(self, arrays):
+        """Generator collecting the geometry of all modules, yielding progress like draw_steps, returns the MeshBuilder"""
+        scene = bpy.context.scene
+        # collect geometry of all modules and create the mesh at once
+        builder = mesh_builder.MeshBuilder(shade_smooth=not scene.bool_force_shade_flat)
+        if scene.bool_weld_internodes:
+            # internodes are drawn as continuous tubes along unbranched chains instead of separate meshes
+            co, loops, loop_total, materialindices = tube_builder.build_tubes(arrays, scene.default_internode_cylinder_vertices)
+            slots = {m: builder.get_material_slot(self.get_material_by_index(m)) for m in np.unique(materialindices)}
+            builder.add_geometry(co, loops, loop_total, [slots[m] for m in materialindices])
+        for i in range(len(arrays)):
+            if i % draw_chunk_size == 0:
+                yield i
+            kind = arrays.kinds[i]
+            if kind == MODULE_NODE and (not scene.bool_draw_nodes or self.levels[i] == LEVEL_CULLED):
+                continue
+            if kind == MODULE_INTERNODE and scene.bool_weld_internodes:
+                continue
+            mesh, name = self.get_module_mesh(arrays, i)
+            if kind == MODULE_CUSTOM:
+                # dont add material, polygons keep the materials of the custom object
+                builder.add_mesh(mesh, arrays.matrices[i], arrays.scales[i],
+                                 slot_materials=[slot.material for slot in bpy.data.objects[name].material_slots])
+            else:
+                builder.add_mesh(mesh, arrays.matrices[i], arrays.scales[i],
+                                 material=self.get_material_by_index(arrays.materialindices[i]))
+        return builder
+    
+    def draw_instanced(self, arrays):
+        """Generator creating carrier objects instancing the shared internode / node / custom object meshes, yielding progress like draw_steps"""
+        scene = bpy.context.scene
+        builder = instance_builder.InstanceBuilder(shade_smooth=not scene.bool_force_shade_flat)
+        kinds = arrays.kinds
+        levels = self.levels
+        done = 0
+        try:
+            for kind, get_mesh, name in ((MODULE_INTERNODE, self.get_internode_mesh, "Internode"),
+                                         (MODULE_NODE, self.get_node_mesh, "Node")):
+                if kind == MODULE_NODE and not scene.bool_draw_nodes:
+                    continue
+                # modules with different materials or detail levels need different prototypes
+                for level in np.unique(levels[kinds == kind]):
+                    if kind == MODULE_NODE and level == LEVEL_CULLED:
+                        continue
+                    mesh = get_mesh(level)
+                    for materialindex in np.unique(arrays.materialindices[(kinds == kind) & (levels == level)]):
+                        members = (kinds == kind) & (levels == level) & (arrays.materialindices == materialindex)
+                        builder.add_instances(mesh, name, arrays.matrices[members], arrays.scales[members],
+                                              material=self.get_material_by_index(materialindex))
+                        done += np.count_nonzero(members)
+                        yield done
+            for custom_object_id, objname in enumerate(arrays.custom_object_names):
+                members = (kinds == MODULE_CUSTOM) & (arrays.custom_object_ids == custom_object_id)
+                mesh, name = self.get_module_mesh(arrays, np.flatnonzero(members)[0])
+                # dont add material, prototype keeps the materials of the custom object mesh
+                builder.add_instances(mesh, name, arrays.matrices[members], arrays.scales[members])
+                done += np.count_nonzero(members)
+                yield done
+        except BaseException:
+            # cancelled (generator closed) or failed
+            builder.discard()
+            raise
+        self.root = builder.build("Root")
+    
+    def draw_hierarchy(self, arrays):
+        """
+        Generator creating a branching hierarchy of objects sharing the internode / node meshes, yielding progress like draw_steps.
+        Objects are created via bpy.data and their matrices are set directly from the turtle frames,
+        without any operator calls or selection changes.
+        """
+        scene = bpy.context.scene
+        n = len(arrays)
+        is_empty = self.get_empty_modules(arrays)
+        worlds, inverses = self.get_hierarchy_matrices(arrays, is_empty)
+        
+        root = self.new_empty("Root")
+        objects = []
+        shaded_meshes = set()
+        try:
+            for i in range(n):
+                if i % draw_chunk_size == 0:
+                    yield i
+                obj = self.new_module_object(arrays, i, is_empty[i], shaded_meshes)
+                # add obj to existing structure
+                parent = arrays.parents[i]
+                if parent < 0:
+                    obj.parent = root
+                else:
+                    obj.parent = objects[parent]
+                    obj.matrix_parent_inverse = Matrix(inverses[parent].tolist())
+                # align object with turtle
+                obj.matrix_basis = Matrix(worlds[i].tolist())
+                scene.objects.link(obj)
+                objects.append(obj)
+        except BaseException:
+            # cancelled (generator closed) or failed, remove the incomplete hierarchy
+            for obj in [root] + objects:
+                scene.objects.unlink(obj)
+                bpy.data.objects.remove(obj)
+            raise
+        self.root = root
+        hierarchy_states[scene.name] = HierarchyState(root, objects, arrays, self.get_module_signatures(arrays, is_empty),
+                                                      worlds, hierarchy_settings(scene))
+    
+    def update_hierarchy(self, arrays, state):
+        """
+        Generator updating the hierarchy of the HierarchyState of the last draw_hierarchy (see can_update_hierarchy)
+        to the given modules, yielding progress like draw_steps. Modules are matched with the previous ones
+        (see incremental_interpretation.match_modules), objects of matched modules are kept and only changed
+        transforms, parents and materials are set. Only added modules get new objects, removed ones are deleted.
+        """
+        scene = bpy.context.scene
+        root = state.root
+        n = len(arrays)
+        is_empty = self.get_empty_modules(arrays)
+        worlds, inverses = self.get_hierarchy_matrices(arrays, is_empty)
+        signatures = self.get_module_signatures(arrays, is_empty)
+        matches = incremental_interpretation.match_modules(state.parents, state.signatures, arrays.parents, signatures,
+                                                           arrays.kinds == MODULE_NODE)
+        kept = matches >= 0
+        matched = np.where(kept, matches, 0)
+        moved = kept & np.any((worlds != state.worlds[matched]).reshape(n, 16), axis=1)
+        # modules whose parent is not the match of their previous parent (or got no parent)
+        parents = arrays.parents
+        previous_parents = state.parents[matched]
+        reparented = kept & np.where(parents >= 0, matches[parents] != previous_parents, previous_parents >= 0)
+        # the parent inverse changes with the parent, or when the parent moved
+        parent_moved = (parents >= 0) & (reparented | moved[parents])
+        recolored = kept & ~is_empty & (arrays.kinds != MODULE_CUSTOM) & (arrays.materialindices != state.materialindices[matched])
+        changed = np.flatnonzero(~kept | moved | reparented | parent_moved | recolored)
+        removed = np.ones(len(state.objects), dtype=bool)
+        removed[matches[kept]] = False
+        
+        objects = [state.objects[j] if j >= 0 else None for j in matches.tolist()]
+        created = []
+        shaded_meshes = set()
+        try:
+            for k, i in enumerate(changed.tolist()):
+                if k % draw_chunk_size == 0:
+                    yield k * n // len(changed)
+                obj = objects[i]
+                if obj is None:
+                    obj = objects[i] = self.new_module_object(arrays, i, is_empty[i], shaded_meshes)
+                    scene.objects.link(obj)
+                    created.append(obj)
+                elif recolored[i]:
+                    obj.material_slots[0].material = self.get_material_by_index(arrays.materialindices[i])
+                parent = parents[i]
+                if parent < 0:
+                    obj.parent = root
+                else:
+                    obj.parent = objects[parent]
+                    obj.matrix_parent_inverse = Matrix(inverses[parent].tolist())
+                obj.matrix_basis = Matrix(worlds[i].tolist())
+            for j in np.flatnonzero(removed).tolist():
+                obj = state.objects[j]
+                scene.objects.unlink(obj)
+                bpy.data.objects.remove(obj)
+        except BaseException:
+            # cancelled (generator closed) or failed, the hierarchy is partially updated, thus remove it like an incomplete one
+            for obj in set([root] + [obj for obj in objects if obj is not None] + state.objects):
+                try:
+                    scene.objects.unlink(obj)
+                    bpy.data.objects.remove(obj)
+                except (ReferenceError, RuntimeError):
+                    # already removed
+                    pass
+            raise
+        self.root = root
+        self.updated_modules = len(changed)
+        self.removed_modules = int(removed.sum())
+        hierarchy_states[scene.name] = HierarchyState(root, objects, arrays, signatures, worlds, hierarchy_settings(scene))
+    
+    def get_empty_modules(self, arrays):
+        """Return which modules are drawn as Empty: nodes are parents of the modules on their branch, thus hidden or culled nodes become empties"""
+        return (arrays.kinds == MODULE_NODE) & ((not bpy.context.scene.bool_draw_nodes) | (self.levels == LEVEL_CULLED))
+    
+    def get_hierarchy_matrices(self, arrays, is_empty):
+        """Return world matrices of the objects of all modules and the inverse world matrices of node modules (identity for others)"""
+        n = len(arrays)
+        # world matrices of all objects: turtle frame with object scale (empties are not scaled)
+        worlds = arrays.matrices.copy()
+        worlds[~is_empty,:,:3] *= arrays.scales[~is_empty,np.newaxis,:]
+        # objects are parented without moving them, i.e. using the inverse world matrix of the parent.
+        # only node modules are parents, thus only their inverses are needed.
+        inverses = np.empty((n, 4, 4))
+        inverses[:] = np.identity(4)
+        nodes = np.flatnonzero(arrays.kinds == MODULE_NODE)
+        if len(nodes):
+            try:
+                inverses[nodes] = np.linalg.inv(worlds[nodes])
+            except np.linalg.LinAlgError:
+                # some node has zero scale. pinv of stacked matrices needs numpy 1.14, newer than in Blender 2.7x
+                for node in nodes:
+                    inverses[node] = np.linalg.pinv(worlds[node])
+        return worlds, inverses
+    
+    def get_module_signatures(self, arrays, is_empty):
+        """Return int code of every module, equal for modules drawn by the same kind of object with the same mesh"""
+        name_ids = np.array([custom_object_name_ids.setdefault(name, len(custom_object_name_ids))
+                             for name in arrays.custom_object_names] + [-1], dtype=np.int64)
+        # bits 0-1 kind, bit 2 empty, bits 3-31 level, bits 32-62 custom object name
+        return (arrays.kinds.astype(np.int64) | is_empty.astype(np.int64) << 2 | (self.levels.astype(np.int64) + 1) << 3
+                | (name_ids[arrays.custom_object_ids] + 1) << 32)
+    
+    def new_module_object(self, arrays, i, is_empty, shaded_meshes):
+        """Return new object drawing module i, an Empty if is_empty. Shading is set once per mesh not in shaded_meshes"""
+        scene = bpy.context.scene
+        if is_empty:
+            return self.new_empty("Node", link=False)
+        mesh, name = self.get_module_mesh(arrays, i)
+        obj = bpy.data.objects.new(name, mesh) # create new object sharing the given mesh data
+        # set shading once per shared mesh
+        if mesh.name not in shaded_meshes:
+            shaded_meshes.add(mesh.name)
+            mesh.polygons.foreach_set("use_smooth", [not scene.bool_force_shade_flat]*len(mesh.polygons))
+        # create material slot and assign material from turtle materialindex.
+        # dont add material to custom objects, object can be edited itself.
         # note: the important thing is to create a material slot for the module,
         # other materials can be assigned to it later
-        if assign_material_by_index:
-            # if materialindex exceeds length of material list just create new empty materials
-            while self.materialindex >= len(bpy.data.materials): 
-                bpy.ops.material.new()
+        if arrays.kinds[i] != MODULE_CUSTOM:
             # to avoid cluttering the shared mesh, link material to current object
-            # when joining objects (no hierarchy) relevant polygons will have the material assigned
-            obj.active_material = bpy.data.materials[self.materialindex] # also adds slot if none
+            material = self.get_material_by_index(arrays.materialindices[i])
+            obj.active_material = material # also adds slot if none
             obj.material_slots[0].link = 'OBJECT'
-            obj.material_slots[0].material = bpy.data.materials[self.materialindex]
-        # align object with turtle
-        obj.matrix_world *= self.mat
-        # set scale
-        obj.scale = scale
-        # add obj to existing structure
-        if scene.bool_no_hierarchy:
-            self.root.select = True
-            scene.objects.active = self.root
-            bpy.ops.object.join()
-        else:
-            self.add_child_to_current_branch_parent(obj)
-        bpy.ops.object.select_all(action='DESELECT')
-        
-        if not bpy.context.scene.bool_no_hierarchy:
-            return obj # return a reference to the object in case that is needed
+            obj.material_slots[0].material = material
+        return obj
+    
+    def new_empty(self, name, link=True):
+        """Create empty object, linked to the scene unless link is False"""
+        empty = bpy.data.objects.new(name, None)
+        empty.empty_draw_type = 'ARROWS'
+        empty.empty_draw_size = 0
+        if link:
+            bpy.context.scene.objects.link(empty)
+        return empty
         
-    def add_child_to_current_branch_parent(self, object):
-        if self.current_parent is None:
-            return
-        object.parent = self.current_parent
-        object.matrix_parent_inverse = self.current_parent.matrix_world.inverted()
+    def get_material_by_index(self, materialindex):
+        """Return material for given turtle materialindex"""
+        # if materialindex exceeds length of material list just create new empty materials
+        while materialindex >= len(bpy.data.materials): 
+            bpy.data.materials.new("Material")
+        return bpy.data.materials[int(materialindex)]
         
-    def create_default_internode_mesh(self, vertex_count):
-        """Initialize the default cylinder mesh used to draw internodes"""
+    def create_default_internode_mesh(self, vertex_count, name=None):
+        """Initialize the default cylinder mesh used to draw internodes, or a cylinder mesh with the given name"""
         cylinder_radius = 0.5
         cylinder_length = 1
         bpy.ops.mesh.primitive_cylinder_add(vertices=vertex_count, 
@@ -254,7 +474,7 @@ class DrawingTurtle(Turtle):
         bpy.ops.transform.rotate(value=radians(90), axis=(0, 1, 0))
         bpy.ops.transform.translate(value=(cylinder_length/2,0,0))
         bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
-        cyl.data.name = bpy.types.Scene.internode_mesh_name[1]['default']
+        cyl.data.name = name or bpy.types.Scene.internode_mesh_name[1]['default']
         # smooth cylinder sides, but not cylinder caps
         cyl.data.use_auto_smooth = True
         cyl.data.auto_smooth_angle = radians(85)
@@ -262,11 +482,11 @@ class DrawingTurtle(Turtle):
         cyl.data.use_fake_user = True
         bpy.ops.object.delete()
         
-    def create_default_node_mesh(self, _subdivisions=1):
-        """Initialize the default icosphere mesh used to draw nodes"""
+    def create_default_node_mesh(self, _subdivisions=1, name=None):
+        """Initialize the default icosphere mesh used to draw nodes, or an icosphere mesh with the given name"""
         bpy.ops.mesh.primitive_ico_sphere_add(subdivisions=_subdivisions, size=0.5)
         icosphere = bpy.context.object
-        icosphere.data.name = bpy.types.Scene.node_mesh_name[1]['default']
+        icosphere.data.name = name or bpy.types.Scene.node_mesh_name[1]['default']
         icosphere.data.use_auto_smooth = True
         icosphere.data.auto_smooth_angle = radians(85)
         # delete object and make sure mesh will persist via fake user reference
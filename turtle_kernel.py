@@ -0,0 +1,603 @@
+import re
+import numpy as np
+from math import radians, sin, cos
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+try:
+    from lindenmaker import lstring_compiler
+except ImportError:
+    # imported outside of Blender (no bpy / lpy available), e.g. for profiling or benchmarking
+    # the interpretation kernel on its own with the addon directory on sys.path.
+    import lstring_compiler
+
+# kinds of modules produced by the turtle interpretation
+MODULE_INTERNODE = 0 # 'F' command
+MODULE_NODE = 1      # branching point at '[' command (node object, or Empty if hierarchy is used)
+MODULE_CUSTOM = 2    # '~' command
+
+# column of the turtle matrix queried by the '?' command
+QUERY_COLUMNS = {'H': 0, 'L': 1, 'U': 2, 'P': 3}
+# '?' command with its arguments in the L-string used for production
+query_pattern = re.compile(r'\?\([^()]*\)')
+# rotation commands: axis and sign of the angle ('|' always turns by 180 degrees)
+ROTATION_AXES = {
+    lstring_compiler.OP_TURN_LEFT: ('Z', -1),
+    lstring_compiler.OP_TURN_RIGHT: ('Z', 1),
+    lstring_compiler.OP_PITCH_DOWN: ('Y', -1),
+    lstring_compiler.OP_PITCH_UP: ('Y', 1),
+    lstring_compiler.OP_ROLL_RIGHT: ('X', -1),
+    lstring_compiler.OP_ROLL_LEFT: ('X', 1),
+    lstring_compiler.OP_TURN_AROUND: ('Z', 0),
+}
+# minimum number of commands of a branch to look it up among the already interpreted identical branches,
+# for smaller branches interpreting them again is about as fast
+min_subtree_commands = 8
+# number of commands between the turtle states recorded by TurtleCheckpoints
+default_checkpoint_interval = 1000
+# number of commands interpreted between the progress yields of interpret_to_arrays_steps
+default_yield_commands = 10000
+
+# rotation matrices by (axis, angle), most models only use a handful of distinct angles
+rotation_matrices = {}
+# maximum number of cached rotation matrices, the cache is cleared when exceeded
+max_cached_rotation_matrices = 4096
+
+def rotation_matrix(angle_degrees, axis):
+    """
+    Return 4x4 rotation matrix around the given axis ('X', 'Y' or 'Z'), same as mathutils.Matrix.Rotation.
+    The returned matrix is cached and must not be modified.
+    """
+    key = (axis, angle_degrees)
+    mat = rotation_matrices.get(key)
+    if mat is None:
+        c = cos(radians(angle_degrees))
+        s = sin(radians(angle_degrees))
+        if axis == 'X':
+            mat = np.array(((1, 0, 0, 0), (0, c, -s, 0), (0, s, c, 0), (0, 0, 0, 1)))
+        elif axis == 'Y':
+            mat = np.array(((c, 0, s, 0), (0, 1, 0, 0), (-s, 0, c, 0), (0, 0, 0, 1)))
+        else:
+            mat = np.array(((c, -s, 0, 0), (s, c, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1)))
+        mat.setflags(write=False)
+        if len(rotation_matrices) >= max_cached_rotation_matrices:
+            rotation_matrices.clear()
+        rotation_matrices[key] = mat
+    return mat
+
+# composed rotation matrices of runs of consecutive rotation commands, by their content and default angle
+rotation_run_matrices = {}
+
+def rotation_run_ends(compiled):
+    """Return for every command the index of the last command of the run of consecutive rotation commands it starts, -1 if it starts no such run of at least two commands"""
+    opcodes = np.frombuffer(compiled.opcodes.tobytes(), dtype=np.uint8)
+    is_rotation = lstring_compiler.opcode_table(ROTATION_AXES)[opcodes].astype(np.int8)
+    changes = np.diff(np.concatenate(([0], is_rotation, [0])))
+    starts = np.flatnonzero(changes == 1)
+    ends = np.flatnonzero(changes == -1) - 1
+    runs = ends > starts
+    result = np.full(len(opcodes), -1, dtype=np.int64)
+    result[starts[runs]] = ends[runs]
+    return result.tolist()
+
+class Turtle:
+    """Turtle state and movement, using NumPy for the matrix math so that it runs without Blender"""
+
+    __slots__ = ('mat', 'linewidth', 'materialindex', 'parent', 'stack_matrices', 'stack_attributes', 'stack_depth')
+
+    def __init__(self, _linewidth, _materialindex, stack_capacity=64):
+        # turtle state consists of a 4x4 matrix and some drawing attributes
+        self.mat = np.identity(4)
+        self.linewidth = _linewidth
+        self.materialindex = _materialindex
+        # index of the node module of the current branch (-1 for root)
+        self.parent = -1
+        # stack to save and restore turtle state, preallocated and grown by doubling:
+        # matrices and (line width, material index, parent) tuples
+        self.stack_matrices = np.empty((stack_capacity, 4, 4))
+        self.stack_attributes = [None] * stack_capacity
+        self.stack_depth = 0
+        # rotate such that heading is in +Z (we want to grow upwards in blender)
+        # we thus have heading = +Z, left = -Y, up = +X
+        self.mat = self.mat.dot(rotation_matrix(270, 'Y'))
+
+    def push(self):
+        """Push turtle state to stack"""
+        d = self.stack_depth
+        if d == len(self.stack_matrices):
+            self.stack_matrices = np.concatenate((self.stack_matrices, np.empty_like(self.stack_matrices)))
+            self.stack_attributes += [None] * d
+        self.stack_matrices[d] = self.mat
+        self.stack_attributes[d] = (self.linewidth, self.materialindex, self.parent)
+        self.stack_depth = d + 1
+
+    def pop(self):
+        """Pop last turtle state from stack and use as current"""
+        if self.stack_depth == 0:
+            raise IndexError("pop from empty turtle stack")
+        d = self.stack_depth = self.stack_depth - 1
+        # copy, since the matrix is modified in place when moving
+        self.mat = self.stack_matrices[d].copy()
+        (self.linewidth, self.materialindex, self.parent) = self.stack_attributes[d]
+
+    def snapshot(self):
+        """Return copy of the turtle state including the stack, see restore"""
+        d = self.stack_depth
+        return (self.mat.copy(), self.linewidth, self.materialindex, self.parent,
+                self.stack_matrices[:d].copy(), self.stack_attributes[:d])
+
+    def restore(self, snapshot):
+        """Set turtle state including the stack to a snapshot"""
+        mat, self.linewidth, self.materialindex, self.parent, matrices, attributes = snapshot
+        self.mat = mat.copy()
+        d = len(matrices)
+        if d > len(self.stack_matrices):
+            self.stack_matrices = np.empty((2*d, 4, 4))
+            self.stack_attributes = [None] * (2*d)
+        self.stack_matrices[:d] = matrices
+        self.stack_attributes[:d] = attributes
+        self.stack_depth = d
+
+    def move(self, stepsize):
+        """Move turtle in its heading direction."""
+        self.mat[:,3] += self.mat[:,0] * stepsize
+
+    def rotate(self, rotation):
+        """Rotate turtle by the given 4x4 rotation matrix in its local coordinate system"""
+        self.mat = self.mat.dot(rotation)
+
+    def turn(self, angle_degrees):
+        self.mat = self.mat.dot(rotation_matrix(angle_degrees, 'Z'))
+    def pitch(self, angle_degrees):
+        self.mat = self.mat.dot(rotation_matrix(angle_degrees, 'Y'))
+    def roll(self, angle_degrees):
+        self.mat = self.mat.dot(rotation_matrix(angle_degrees, 'X'))
+
+    def look_at(self, target):
+        """
+        Let turtle look at a given 3D targed vector point.
+        The heading vector will point toward x, y, z
+        and the heading, up, and left vectors will have the same
+        relative orientation (handedness) as before.
+        """
+        turtle_to_target = np.asarray(target, dtype=float) - self.mat[:3,3]
+        turtle_to_target /= np.linalg.norm(turtle_to_target)
+        result_mat = np.identity(4)
+
+        # position stays same
+        result_mat[:,3] = self.mat[:,3]
+
+        # heading towards target
+        result_mat[:3,0] = turtle_to_target
+
+        # use old up vector to compute orthogonal left vector
+        # the cross product defaults to right hand order but we store a left vector
+        # thus we negate the cross product vector
+        old_up = self.mat[:3,1] / np.linalg.norm(self.mat[:3,1])
+        left = np.cross(old_up, turtle_to_target)
+        left /= np.linalg.norm(left)
+        result_mat[:3,2] = left
+
+        # compute new up vector from left and heading vector
+        # since the left and new up vectors were constructed using the same left hand order
+        # the left hand order is preserved.
+        up = np.cross(left, turtle_to_target)
+        result_mat[:3,1] = up / np.linalg.norm(up)
+
+        self.mat = result_mat
+
+class InterpretationArrays:
+    """
+    Result of the turtle interpretation as packed arrays, one entry per module.
+    matrices: N x 4 x 4 turtle matrix (orientation and position) at the module
+    scales: N x 3 object scale of the module
+    widths: N line width of the turtle at the module
+    lengths: N move step length of internode modules, 0 for other modules
+    materialindices: N turtle material index at the module
+    kinds: N module kind (MODULE_INTERNODE, MODULE_NODE or MODULE_CUSTOM)
+    custom_object_ids: N index into custom_object_names for '~' modules, -1 otherwise
+    parents: N index of the node module of the enclosing branch, -1 for root
+    The turtle state queries ('?' commands) are stored in order as query_types and query_vectors (Q x 3).
+    Branches skipped via split_branches of interpret_to_arrays are stored in order as split_branch_states:
+    (turtle matrix, line width, material index, parent, module count, query count) at their '['.
+    """
+
+    def __init__(self, capacity):
+        self.matrices = np.empty((capacity, 4, 4))
+        self.scales = np.empty((capacity, 3))
+        self.widths = np.empty(capacity)
+        self.lengths = np.zeros(capacity)
+        self.materialindices = np.empty(capacity, dtype=np.int32)
+        self.kinds = np.empty(capacity, dtype=np.uint8)
+        self.custom_object_ids = np.empty(capacity, dtype=np.int32)
+        self.parents = np.empty(capacity, dtype=np.int32)
+        self.custom_object_names = []
+        self.query_types = []
+        self.query_vectors = []
+        self.split_branch_states = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, t, kind, scale, width, custom_object_id=-1, length=0):
+        """Append module in current state of turtle t, return its index"""
+        i = self.count
+        self.matrices[i] = t.mat
+        self.scales[i] = scale
+        self.widths[i] = width
+        self.lengths[i] = length
+        self.materialindices[i] = t.materialindex
+        self.kinds[i] = kind
+        self.custom_object_ids[i] = custom_object_id
+        self.parents[i] = t.parent
+        self.count += 1
+        return i
+
+    def add_copy(self, start, end, transform, parent):
+        """
+        Append copies of the modules start to end (exclusive), a complete branch starting with its node module,
+        with their matrices transformed by the 4x4 transform. The copied node gets the given parent.
+        Return index of the copied node.
+        """
+        i = self.count
+        n = end - start
+        self.matrices[i:i+n] = np.matmul(transform, self.matrices[start:end])
+        self.scales[i:i+n] = self.scales[start:end]
+        self.widths[i:i+n] = self.widths[start:end]
+        self.lengths[i:i+n] = self.lengths[start:end]
+        self.materialindices[i:i+n] = self.materialindices[start:end]
+        self.kinds[i:i+n] = self.kinds[start:end]
+        self.custom_object_ids[i:i+n] = self.custom_object_ids[start:end]
+        # modules within the branch are children of modules within the copy
+        self.parents[i:i+n] = self.parents[start:end] + (i - start)
+        self.parents[i] = parent
+        self.count += n
+        return i
+
+    def add_custom_object_name(self, objname):
+        """Return id of custom object name, adding it if new"""
+        if objname not in self.custom_object_names:
+            self.custom_object_names.append(objname)
+        return self.custom_object_names.index(objname)
+
+    def finish(self):
+        """Trim arrays to the number of modules added"""
+        n = self.count
+        self.matrices = self.matrices[:n]
+        self.scales = self.scales[:n]
+        self.widths = self.widths[:n]
+        self.lengths = self.lengths[:n]
+        self.materialindices = self.materialindices[:n]
+        self.kinds = self.kinds[:n]
+        self.custom_object_ids = self.custom_object_ids[:n]
+        self.parents = self.parents[:n]
+        self.query_vectors = np.array(self.query_vectors, dtype=float).reshape(-1, 3)
+        return self
+
+class TurtleCheckpoints:
+    """
+    Turtle states (matrix, line width, material index and stack) recorded every interval commands
+    during a queries_only interpretation, along with its query results. The next queries_only interpretation
+    given the same TurtleCheckpoints resumes from the last recorded state before the first command that differs
+    from the recorded L-string, e.g. the dry run of the next production step, where most of the L-string is unchanged.
+    """
+
+    def __init__(self, interval=default_checkpoint_interval):
+        self.interval = interval
+        # recorded L-string and interpretation options, None while recording
+        self.compiled = None
+        self.options = None
+        # command index of each state, sorted, and (Turtle.snapshot, query count) before that command
+        self.indices = []
+        self.states = []
+        self.query_types = []
+        self.query_vectors = []
+        # command index the last interpretation resumed from
+        self.resumed_at = 0
+
+    def resume_state(self, compiled, options):
+        """Return (command index, Turtle.snapshot, query count) to resume the interpretation of compiled from, None to start over"""
+        if self.compiled is None or options != self.options:
+            return None
+        # the values of queries are replaced by their results, they do not change the turtle
+        prefix = self.compiled.common_prefix_length(compiled, ignore_args_of=(lstring_compiler.OP_QUERY,))
+        k = bisect_left(self.indices, prefix) - 1
+        if k < 0:
+            return None
+        return (self.indices[k],) + self.states[k]
+
+    def begin(self, options, start):
+        """Start recording an interpretation resumed at command index start, keeping the states up to it"""
+        k = bisect_right(self.indices, start)
+        del self.indices[k:]
+        del self.states[k:]
+        self.compiled = None
+        self.options = options
+        self.resumed_at = start
+
+    def record(self, index, turtle, query_count):
+        """Record state of turtle before command index"""
+        self.indices.append(index)
+        self.states.append((turtle.snapshot(), query_count))
+
+    def finish(self, compiled, result):
+        """Finish recording the interpretation of compiled with the InterpretationArrays result"""
+        self.compiled = compiled
+        self.query_types = list(result.query_types)
+        self.query_vectors = list(result.query_vectors)
+
+def run_steps(steps):
+    """Run generator steps (e.g. interpret_to_arrays_steps) to the end and return its return value"""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as e:
+            return e.value
+
+def interpret_to_arrays(lstring, **options):
+    """Turtle Interpretation of L-string into InterpretationArrays at once, taking the same options as interpret_to_arrays_steps"""
+    return run_steps(interpret_to_arrays_steps(lstring, yield_commands=None, **options))
+
+def interpret_to_arrays_steps(lstring, default_length = 2.0,
+                                       default_width = 1.0,
+                                       default_width_growth_factor = 1.05,
+                                       default_angle = 45.0,
+                                       default_materialindex = 0,
+                                       internode_length_scale = 1.0,
+                                       queries_only = False,
+                                       reuse_subtrees = True,
+                                       turtle_state = None,
+                                       split_branches = None,
+                                       checkpoints = None,
+                                       yield_commands = default_yield_commands):
+    """Generator doing the Turtle Interpretation of L-string (str or lstring_compiler.CompiledLString) into InterpretationArrays, without creating any objects. NOTE: Commands that are not supported will be ignored and not raise an error.
+    Yields (commands interpreted, command count) every yield_commands commands (never if None), e.g. to keep a UI responsive, and returns the InterpretationArrays.
+    If queries_only is set, interpretation stops after the last '?' command, since the commands after it cannot change any query result.
+    If reuse_subtrees is set, branches identical to an already interpreted branch (same commands, line width and material index
+    at the '[') are not interpreted again, instead the modules of the first one are copied and transformed into place.
+    turtle_state optionally gives the initial (turtle matrix, line width, material index), e.g. to interpret a single branch.
+    Branches starting at the command indices in split_branches are skipped, only their initial state is recorded
+    (see InterpretationArrays.split_branch_states), e.g. to interpret them separately (see parallel_interpretation).
+    If TurtleCheckpoints are given for a queries_only interpretation, it resumes from them if possible and records them,
+    the modules before the command it resumed at are not included in the result then."""
+
+    if isinstance(lstring, lstring_compiler.CompiledLString):
+        compiled = lstring
+    else:
+        compiled = lstring_compiler.get_compiled(lstring)
+    args = compiled.args
+    strings = compiled.strings
+
+    t = Turtle(default_width, default_materialindex)
+    if turtle_state is not None:
+        mat, t.linewidth, t.materialindex = turtle_state
+        t.mat = np.array(mat, dtype=float)
+    # every module is produced by one command, thus this is enough space for all of them
+    result = InterpretationArrays(compiled.count(lstring_compiler.OP_MOVE_DRAW,
+                                                 lstring_compiler.OP_PUSH,
+                                                 lstring_compiler.OP_CUSTOM))
+
+    # command handlers, called with offset and count of the command arguments in args.
+    # argument counts are already validated by the compiler.
+
+    def move_draw(offset, count):
+        # move turtle and draw internode between old and new position
+        length = args[offset] if count > 0 else default_length
+        width = args[offset+1] if count > 1 else t.linewidth
+        result.add(t, MODULE_INTERNODE, (length*internode_length_scale, width, width), width, length=length)
+        t.move(length)
+    def move(offset, count):
+        t.move(args[offset] if count else default_length)
+
+    def push(offset, count):
+        # node module at branching point becomes parent for modules on this branch
+        node = result.add(t, MODULE_NODE, (t.linewidth,)*3, t.linewidth)
+        t.push()
+        t.parent = node
+    def pop(offset, count):
+        t.pop()
+
+    # rotate commands (turn, pitch, roll)
+    def turn_left(offset, count):
+        t.turn(-(args[offset] if count else default_angle))
+    def turn_right(offset, count):
+        t.turn(args[offset] if count else default_angle)
+    def pitch_down(offset, count):
+        t.pitch(-(args[offset] if count else default_angle))
+    def pitch_up(offset, count):
+        t.pitch(args[offset] if count else default_angle)
+    def roll_right(offset, count):
+        t.roll(-(args[offset] if count else default_angle))
+    def roll_left(offset, count):
+        t.roll(args[offset] if count else default_angle)
+    def turn_around(offset, count):
+        t.turn(180)
+
+    # drawing attributes
+    def width_inc(offset, count):
+        # increase linewidth or set to value
+        if count:
+            t.linewidth = args[offset]
+        else:
+            t.linewidth *= default_width_growth_factor
+    def width_dec(offset, count):
+        # decrease linewidth or set to value
+        if count:
+            t.linewidth = args[offset]
+        else:
+            t.linewidth *= 1-(default_width_growth_factor-1)
+        t.linewidth = max(t.linewidth, 0.0001)
+    def material_inc(offset, count):
+        # increase materialindex or set to value
+        if count:
+            t.materialindex = max(int(args[offset]), 0)
+        else:
+            t.materialindex += 1 # if exceeds mat count, drawing adds new mats
+    def material_dec(offset, count):
+        # decrease materialindex or set to value
+        if count:
+            t.materialindex = int(args[offset])
+        else:
+            t.materialindex -= 1
+        t.materialindex = max(t.materialindex, 0)
+
+    # draw custom object
+    def custom(offset, count):
+        if count == 4:
+            objscale = (args[offset+1], args[offset+2], args[offset+3])
+        elif count == 2:
+            objscale = (args[offset+1],)*3
+        else:
+            objscale = (1, 1, 1)
+        objname = strings[int(args[offset])]
+        result.add(t, MODULE_CUSTOM, objscale, t.linewidth,
+                   custom_object_id=result.add_custom_object_name(objname))
+
+    # turtle lookAt function
+    def look_at(offset, count):
+        t.look_at((args[offset], args[offset+1], args[offset+2]))
+
+    # query turtle state (heading, left, up or position vector)
+    def query(offset, count):
+        querytype = strings[int(args[offset])]
+        result.query_types.append(querytype)
+        result.query_vectors.append(t.mat[:3,QUERY_COLUMNS.get(querytype, 0)].copy())
+
+    handlers = [None] * lstring_compiler.OPCODE_COUNT
+    handlers[lstring_compiler.OP_MOVE_DRAW] = move_draw
+    handlers[lstring_compiler.OP_MOVE] = move
+    handlers[lstring_compiler.OP_PUSH] = push
+    handlers[lstring_compiler.OP_POP] = pop
+    handlers[lstring_compiler.OP_TURN_LEFT] = turn_left
+    handlers[lstring_compiler.OP_TURN_RIGHT] = turn_right
+    handlers[lstring_compiler.OP_PITCH_DOWN] = pitch_down
+    handlers[lstring_compiler.OP_PITCH_UP] = pitch_up
+    handlers[lstring_compiler.OP_ROLL_RIGHT] = roll_right
+    handlers[lstring_compiler.OP_ROLL_LEFT] = roll_left
+    handlers[lstring_compiler.OP_TURN_AROUND] = turn_around
+    handlers[lstring_compiler.OP_WIDTH_INC] = width_inc
+    handlers[lstring_compiler.OP_WIDTH_DEC] = width_dec
+    handlers[lstring_compiler.OP_MATERIAL_INC] = material_inc
+    handlers[lstring_compiler.OP_MATERIAL_DEC] = material_dec
+    handlers[lstring_compiler.OP_CUSTOM] = custom
+    handlers[lstring_compiler.OP_LOOK_AT] = look_at
+    handlers[lstring_compiler.OP_QUERY] = query
+
+    def rotation_run_matrix(start, end):
+        # composed rotation of the consecutive rotation commands start to end (inclusive)
+        key = compiled.segment_key(start, end) + (default_angle,)
+        mat = rotation_run_matrices.get(key)
+        if mat is None:
+            mat = np.identity(4)
+            for i in range(start, end+1):
+                axis, sign = ROTATION_AXES[compiled.opcodes[i]]
+                count = compiled.arg_counts[i]
+                if sign == 0:
+                    angle = 180
+                else:
+                    angle = sign * (args[compiled.arg_offsets[i]] if count else default_angle)
+                mat = mat.dot(rotation_matrix(angle, axis))
+            if len(rotation_run_matrices) >= max_cached_rotation_matrices:
+                rotation_run_matrices.clear()
+            rotation_run_matrices[key] = mat
+        return mat
+
+    # hash-consing of branches: content of an interpreted branch -> (first module, end of modules,
+    # inverse turtle matrix at its '['). only branches that dont depend on the absolute turtle state are used,
+    # i.e. without '@' (look at world position) and '?' (query world state).
+    interpreted_subtrees = {}
+    # for every open branch its content and start, or None if it is not to be reused
+    open_subtrees = []
+
+    # resume from the last checkpoint before the first difference to the L-string of the checkpoints
+    resume_index = 0
+    next_checkpoint = len(compiled) + 1
+    if checkpoints is not None and queries_only and turtle_state is None and not split_branches:
+        options = (default_length, default_width, default_width_growth_factor, default_angle,
+                   default_materialindex, internode_length_scale)
+        resume = checkpoints.resume_state(compiled, options)
+        if resume is not None:
+            resume_index, snapshot, query_count = resume
+            t.restore(snapshot)
+            # modules before resume_index are not in the result, their branches attach to the trunk
+            t.parent = -1
+            for d in range(t.stack_depth):
+                linewidth, materialindex, parent = t.stack_attributes[d]
+                t.stack_attributes[d] = (linewidth, materialindex, -1)
+            result.query_types = checkpoints.query_types[:query_count]
+            result.query_vectors = checkpoints.query_vectors[:query_count]
+            # branches opened before are not reused
+            open_subtrees = [None] * t.stack_depth
+        checkpoints.begin(options, resume_index)
+        next_checkpoint = resume_index + checkpoints.interval
+    else:
+        checkpoints = None
+
+    commands = zip(compiled.opcodes, compiled.arg_offsets, compiled.arg_counts)
+    command_count = len(compiled)
+    if queries_only:
+        command_count = compiled.last_index(lstring_compiler.OP_QUERY)+1
+        commands = islice(commands, resume_index, command_count)
+    next_yield = resume_index + yield_commands if yield_commands else command_count + 1
+    run_ends = rotation_run_ends(compiled)
+    branch_ends = compiled.branch_ends()
+    world_dependent = (bytes((lstring_compiler.OP_LOOK_AT,)), bytes((lstring_compiler.OP_QUERY,)))
+    skip_to = -1
+    for i, (opcode, offset, count) in enumerate(commands, resume_index):
+        if i <= skip_to:
+            continue
+        if i >= next_checkpoint:
+            checkpoints.record(i, t, len(result.query_types))
+            next_checkpoint = i + checkpoints.interval
+        if i >= next_yield:
+            yield i, command_count
+            next_yield = i + yield_commands
+        if run_ends[i] >= 0:
+            # consecutive rotations are applied as one composed rotation
+            end = run_ends[i]
+            t.rotate(rotation_run_matrix(i, end))
+            skip_to = end
+            continue
+        if opcode == lstring_compiler.OP_PUSH:
+            end = branch_ends[i]
+            if split_branches and i in split_branches:
+                result.split_branch_states.append((t.mat.copy(), t.linewidth, t.materialindex, t.parent,
+                                                   result.count, len(result.query_types)))
+                skip_to = end
+                continue
+            key = None
+            if reuse_subtrees and end - i >= min_subtree_commands:
+                key = compiled.segment_key(i, end)
+                if any(op in key[0] for op in world_dependent):
+                    key = None
+                else:
+                    key += (t.linewidth, t.materialindex)
+            subtree = interpreted_subtrees.get(key) if key is not None else None
+            if subtree is not None:
+                start, stop, inverse = subtree
+                result.add_copy(start, stop, t.mat.dot(inverse), t.parent)
+                skip_to = end
+                continue
+            open_subtrees.append((key, result.count) if key is not None else None)
+        elif opcode == lstring_compiler.OP_POP and open_subtrees:
+            subtree = open_subtrees.pop()
+            if subtree is not None:
+                key, start = subtree
+                interpreted_subtrees.setdefault(key, (start, result.count, np.linalg.inv(result.matrices[start])))
+        handlers[opcode](offset, count)
+
+    result.finish()
+    if checkpoints is not None:
+        checkpoints.finish(compiled, result)
+    return result
+
+def splice_query_results(lstring, arrays):
+    """
+    Return lstring with the arguments of its '?' commands replaced by the turtle state query results
+    of the given InterpretationArrays, in order, e.g. ?("P",0,0,0) becomes ?("P",Px,Py,Pz).
+    Done in a single pass over lstring instead of one pass per query.
+    """
+    results = iter(['?("{}",{},{},{})'.format(querytype, float(vector[0]), float(vector[1]), float(vector[2]))
+                    for querytype, vector in zip(arrays.query_types, arrays.query_vectors)])
+    return query_pattern.sub(lambda match: next(results), lstring, count=len(arrays.query_types))
@@ -0,0 +1,72 @@
+import lpy
+import bpy
+import os.path
+import random
+import multiprocessing
+
+from lindenmaker import turtle
+from lindenmaker import turtle_kernel
+from lindenmaker import parallel_interpretation
+from lindenmaker.lstring_production import axialtree_to_lstring
+
+def derive_variant(lpyfile, seed, derivation_length, options):
+    """
+    Derive and interpret the L-system of lpyfile with the random module seeded with seed,
+    return its InterpretationArrays. Same production as the Lindenmaker operator (one step at a time with
+    turtle state queries in between), but independent of the scene, such that it can run in a worker process.
+    derivation_length 0 uses the one of the .lpy file, options are passed to turtle_kernel.interpret_to_arrays.
+    """
+    # module level code of the .lpy file might use the random module as well, thus seed before compiling
+    random.seed(seed)
+    lsys = lpy.Lsystem(lpyfile)
+    steps = derivation_length or lsys.derivationLength
+    lsys.derivationLength = 1
+    axialtree = None
+    lstring = ""
+    # the dry run of each step resumes from the turtle states of the previous one
+    checkpoints = turtle_kernel.TurtleCheckpoints()
+    for step in range(steps):
+        if axialtree is not None:
+            lsys.axiom = axialtree
+        axialtree = lsys.derive()
+        lstring = str(lsys.interpret(axialtree))
+        if '?' in lstring:
+            # turtle state queries, results are used by the productions of the next step
+            queries = turtle_kernel.interpret_to_arrays(lstring, queries_only=True, checkpoints=checkpoints, **options)
+            if queries.query_types:
+                axialtree = lpy.AxialTree(turtle_kernel.splice_query_results(axialtree_to_lstring(axialtree), queries))
+    return turtle_kernel.interpret_to_arrays(lstring, **options)
+
+def derive_variants(lpyfile, seeds, derivation_length, options, processes=None):
+    """
+    Return InterpretationArrays of derive_variant for every seed, derived by a pool of worker processes if possible,
+    i.e. if processes can be forked and the .lpy file does not import Blender modules (see parallel_interpretation.can_fork).
+    """
+    processes = min(processes or multiprocessing.cpu_count(), len(seeds))
+    tasks = [(lpyfile, seed, derivation_length, options) for seed in seeds]
+    if processes < 2 or not parallel_interpretation.can_fork(lpyfile):
+        return [derive_variant(*task) for task in tasks]
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        return pool.starmap(derive_variant, tasks, chunksize=1)
+
+def generate_variants(lpyfile, seeds, derivation_length=0, processes=None):
+    """
+    Derive the L-system of lpyfile once per seed (in parallel) and return the results as meshes,
+    named after the .lpy file and seed (e.g. "tree.seed3") and kept via fake user, such that they can be shared
+    by any number of objects. Interpretation parameters are taken from the scene.
+    """
+    scene = bpy.context.scene
+    options = dict(default_length=scene.turtle_step_size,
+                   default_width=scene.turtle_line_width,
+                   default_width_growth_factor=scene.turtle_width_growth_factor,
+                   default_angle=scene.turtle_rotation_angle,
+                   internode_length_scale=scene.internode_length_scale)
+    results = derive_variants(lpyfile, seeds, derivation_length, options, processes)
+    basename = os.path.splitext(os.path.basename(lpyfile))[0]
+    t = turtle.DrawingTurtle()
+    meshes = []
+    for seed, arrays in zip(seeds, results):
+        mesh = t.create_mesh(arrays, "{}.seed{}".format(basename, seed))
+        mesh.use_fake_user = True
+        meshes.append(mesh)
+    return meshes